@@ -1 +1,21 @@
-# This file intentionally left empty - all models removed for LangGraph-only approach
+from django.contrib import admin
+
+from chatbot.models import SafetyEvent
+
+
+@admin.register(SafetyEvent)
+class SafetyEventAdmin(admin.ModelAdmin):
+    """Read-only browser over the safety event log; aggregates are at /debug/safety-events/."""
+
+    list_display = ("created_at", "thread_id", "status", "violation_type", "source", "latency_ms")
+    list_filter = ("status", "violation_type", "source")
+    search_fields = ("=thread_id",)
+    ordering = ("-id",)
+    # Counting millions of rows for every page view is what makes a log table slow to browse
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
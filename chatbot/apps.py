@@ -1,6 +1,35 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatbotConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chatbot"
+
+    def ready(self):
+        """Warm up the chatbot in the background when the app is served.
+
+        Enabled by ``CHATBOT_EAGER_WARMUP``. Requests arriving before warm-up
+        finishes wait for the same instance rather than building their own.
+        """
+        if not getattr(settings, "CHATBOT_EAGER_WARMUP", False) or not _is_server_process():
+            return
+
+        from chatbot.services.chatbot_service import warm_up
+
+        ping = getattr(settings, "CHATBOT_WARMUP_PING", False)
+        threading.Thread(target=warm_up, kwargs={"ping": ping}, name="chatbot-warm-up", daemon=True).start()
+
+
+def _is_server_process() -> bool:
+    """False for management commands other than runserver, and for runserver's reloader parent."""
+    if len(sys.argv) < 2 or not sys.argv[0].endswith("manage.py"):
+        # WSGI/ASGI servers (gunicorn, uvicorn, ...) import the project directly
+        return True
+    if sys.argv[1] != "runserver":
+        return False
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
@@ -0,0 +1,32 @@
+"""Offline benchmarks for the chatbot pipeline.
+
+Run a scenario with ``python manage.py benchmark <scenario>``. Scenarios drive the
+real graph, state manager and streamer against ``FakeChatModel`` so results do not
+depend on network conditions or provider load.
+"""
+
+SCENARIOS = {
+    "admission": "chatbot.benchmarks.admission",
+    "bulk_screening": "chatbot.benchmarks.bulk_screening",
+    "checkpoint_serde": "chatbot.benchmarks.checkpoint_serde",
+    "checkpoints": "chatbot.benchmarks.checkpoints",
+    "compaction": "chatbot.benchmarks.compaction",
+    "concurrency": "chatbot.benchmarks.concurrency",
+    "context_window": "chatbot.benchmarks.context_window",
+    "disconnect": "chatbot.benchmarks.disconnect",
+    "history": "chatbot.benchmarks.history",
+    "metrics": "chatbot.benchmarks.metrics",
+    "model_tiering": "chatbot.benchmarks.model_tiering",
+    "pipeline": "chatbot.benchmarks.pipeline",
+    "prefilter": "chatbot.benchmarks.prefilter",
+    "prompt_cache": "chatbot.benchmarks.prompt_cache",
+    "resilience": "chatbot.benchmarks.resilience",
+    "response_cache": "chatbot.benchmarks.response_cache",
+    "resume": "chatbot.benchmarks.resume",
+    "safety_events": "chatbot.benchmarks.safety_events",
+    "safety_streaming": "chatbot.benchmarks.safety_streaming",
+    "scale_out": "chatbot.benchmarks.scale_out",
+    "speculative": "chatbot.benchmarks.speculative",
+    "sse": "chatbot.benchmarks.sse",
+    "warmup": "chatbot.benchmarks.warmup",
+}
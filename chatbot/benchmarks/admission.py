@@ -0,0 +1,89 @@
+"""A burst of overlapping stream requests with and without admission control.
+
+``USERS`` users each send ``DUPLICATES`` copies of one message (double submits
+and retries) and ``EXTRA_MESSAGES`` different messages at the same moment, all
+as concurrent requests against one worker. Without admission control every
+request runs the graph; with it duplicates attach to the response in flight,
+each user is limited to ``MAX_PER_USER`` responses, and at most
+``MAX_CONCURRENT`` are generated at once with the rest queued or turned away.
+"""
+
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.admission import AdmissionController, AdmissionRejected, StreamHub
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+DUPLICATES = 3
+EXTRA_MESSAGES = 2
+MAX_PER_USER = 2
+MAX_CONCURRENT = 16
+MAX_QUEUE = 32
+QUEUE_TIMEOUT = 5
+
+SAFETY_LATENCY = 0.1
+FIRST_TOKEN_LATENCY = 0.1
+TOKEN_INTERVAL = 0.005
+
+
+def run(iterations: int = 10, **_) -> dict:
+    users = iterations * 2
+    requests = [
+        (user, message)
+        for user in range(users)
+        for message in ["What is LangGraph?"] * DUPLICATES + [f"Follow-up {n}" for n in range(EXTRA_MESSAGES)]
+    ]
+    results = {"requests": len(requests)}
+    for mode in ("unlimited", "admission"):
+        llm = FakeChatModel(
+            safety_latency=SAFETY_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, token_interval=TOKEN_INTERVAL
+        )
+        graph = GraphBuilder(llm).build_graph(InMemorySaver())
+        streamer = ResponseStreamer(graph, StateManager(graph))
+        hub = None
+        if mode == "admission":
+            hub = StreamHub(AdmissionController(MAX_PER_USER, MAX_CONCURRENT, MAX_QUEUE, QUEUE_TIMEOUT))
+
+        start_line = threading.Barrier(len(requests))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+            outcomes = list(pool.map(lambda request: _request(streamer, hub, start_line, *request), requests))
+        elapsed = time.perf_counter() - start
+
+        counters = llm.counters
+        completed = [ttft for outcome, ttft in outcomes if outcome == "completed"]
+        results[mode] = {
+            "outcomes": dict(Counter(outcome for outcome, _ in outcomes)),
+            "llm_calls": counters["safety_calls"] + counters["domain_calls"],
+            "domain_tokens": counters["domain_tokens"],
+            "ttft": summarize_ms(completed),
+            "elapsed_ms": round(elapsed * 1000, 1),
+        }
+    return results
+
+
+def _request(streamer, hub, start_line, user_id: int, message: str):
+    user = benchmark_user(user_id)
+    start_line.wait()
+    start = time.perf_counter()
+    try:
+        if hub is None:
+            chunks = streamer.stream_response(message, user)
+        else:
+            chunks = hub.open(
+                user_id, message, lambda shared: streamer.stream_response(message, user, shared.timings)
+            ).follow()
+    except AdmissionRejected as e:
+        return f"rejected_{e.reason}", None
+    first = None
+    for _ in chunks:
+        first = first or time.perf_counter()
+    return "completed", (first or time.perf_counter()) - start
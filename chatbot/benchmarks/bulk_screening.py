@@ -0,0 +1,62 @@
+"""Bulk safety screening: messages per minute, LLM requests and input tokens per message.
+
+Compares one message per request sent sequentially, which is screening through
+the graph's safety node one message at a time, against a worker pool and against
+batched requests. The scripted model takes ``SAFETY_LATENCY`` per request plus
+``RESULT_LATENCY`` per verdict it writes, and charges prefill per input token, so
+batching saves the per-request latency and the repeated system prompt but not
+the output. The pre-filter is off so every message reaches the model.
+"""
+
+import time
+from itertools import cycle, islice
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.prefilter import CORPUS
+from chatbot.services.bulk_screening import BulkScreener
+
+SAFETY_LATENCY = 0.2
+RESULT_LATENCY = 0.02
+INPUT_TOKEN_LATENCY = 0.02
+TENANTS = 3
+
+# name: (batch_size, workers)
+MODES = {
+    "sequential": (1, 1),
+    "pool": (1, 8),
+    "batched": (20, 1),
+    "batched_pool": (20, 8),
+}
+
+
+def run(iterations: int = 10, **_) -> dict:
+    records = [
+        {"id": str(i), "text": text, "tenant": f"tenant-{i % TENANTS}"}
+        for i, (text, _) in enumerate(islice(cycle(CORPUS), iterations * 10))
+    ]
+    labels = dict(CORPUS)
+
+    results = {}
+    for name, (batch_size, workers) in MODES.items():
+        llm = FakeChatModel(
+            safety_latency=SAFETY_LATENCY,
+            safety_result_latency=RESULT_LATENCY,
+            input_token_latency=INPUT_TOKEN_LATENCY,
+            verdicts=labels,
+        )
+        screener = BulkScreener(llm, batch_size=batch_size, workers=workers)
+
+        start = time.perf_counter()
+        screened = list(screener.screen(records))
+        elapsed = time.perf_counter() - start
+
+        texts = {record["id"]: record["text"] for record in records}
+        agreed = sum(result.verdict.violation_type == labels[texts[result.id]] for result in screened if result.verdict)
+        counters = llm.counters
+        results[name] = {
+            "messages_per_min": round(len(screened) / elapsed * 60),
+            "llm_requests": counters["safety_calls"],
+            "input_tokens_per_message": round(counters["safety_input_tokens"] / len(records)),
+            "agreement_pct": round(agreed / len(records) * 100, 1),
+        }
+    return results
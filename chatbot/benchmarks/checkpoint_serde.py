@@ -0,0 +1,127 @@
+"""Checkpoint size, write and read time with LangGraph's serializer vs. the compact one.
+
+Synthetic threads of ``THREAD_SIZES`` messages, alternating user questions and
+assistant answers carrying the response and usage metadata the Anthropic client
+attaches, are checkpointed by a ``PooledSqliteSaver`` with each serializer in
+``SERIALIZERS``: LangGraph's ``jsonplus``, ``compact``, and ``compact`` with a
+zstd (or, without ``zstandard``, zlib) dictionary trained on a separate
+``TRAINING_MESSAGES``-message thread. Reported per thread size are the stored
+bytes per message of the checkpoint, the time to write it (``put``) and to read
+it back (``get_tuple``, the read behind ``get_state``), and the size of a single
+message written as a pending write, as every turn does.
+"""
+
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from chatbot.benchmarks.harness import summarize_ms
+from chatbot.services.checkpoint_serde import CompactSerializer, CompressionDictionary
+from chatbot.services.checkpoint_storage import PooledSqliteSaver
+
+THREAD_SIZES = (100, 1000, 10000)
+TRAINING_MESSAGES = 1000
+DICTIONARY_SIZE = 64 * 1024
+
+QUESTIONS = (
+    "How do checkpoints work?",
+    "Can a conversation be resumed on another worker?",
+    "What does the safety agent check before the response is streamed?",
+)
+ANSWER = (
+    "Every step of the graph is persisted by the checkpointer, so the next request restores the thread "
+    "and only sends the new message. Answer {i} goes into the details of turn {turn}."
+)
+
+
+def run(iterations: int = 10, **_) -> dict:
+    training = _thread(TRAINING_MESSAGES, seed="training")
+    plain = CompactSerializer()
+    samples = [plain.pack(message) for message in training] + [plain.pack(_checkpoint(training))]
+    serializers = {
+        "jsonplus": None,
+        "compact": plain,
+        "compact_dictionary": CompactSerializer(CompressionDictionary.train(samples, DICTIONARY_SIZE)),
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in THREAD_SIZES:
+            messages = _thread(size, seed="thread")
+            results[f"{size}_messages"] = {
+                name: _measure(
+                    PooledSqliteSaver(Path(tmp) / f"{name}_{size}.sqlite", serde=serde), messages, iterations
+                )
+                for name, serde in serializers.items()
+            }
+    return results
+
+
+def _measure(saver: PooledSqliteSaver, messages: list, iterations: int) -> dict:
+    config = {"configurable": {"thread_id": "benchmark", "checkpoint_ns": ""}}
+    writes, reads = [], []
+    for _ in range(iterations):
+        checkpoint = _checkpoint(messages)
+        start = time.perf_counter()
+        saved = saver.put(config, checkpoint, {"source": "loop", "step": 1}, {})
+        writes.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        restored = saver.get_tuple(saved)
+        reads.append(time.perf_counter() - start)
+    assert restored.checkpoint["channel_values"]["messages"] == messages
+
+    saver.put_writes(saved, [("messages", [messages[-1]])], str(uuid.uuid4()))
+    with saver.cursor(transaction=False) as cur:
+        checkpoint_bytes = cur.execute(
+            "SELECT length(checkpoint) FROM checkpoints WHERE checkpoint_id = ?", (checkpoint["id"],)
+        ).fetchone()[0]
+        write_bytes = cur.execute("SELECT length(value) FROM writes").fetchone()[0]
+    saver.close()
+    return {
+        "bytes_per_message": round(checkpoint_bytes / len(messages), 1),
+        "message_write_bytes": write_bytes,
+        "put": summarize_ms(writes),
+        "get_tuple": summarize_ms(reads),
+    }
+
+
+def _checkpoint(messages: list) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": messages, "user_id": 1}
+    return checkpoint
+
+
+def _thread(size: int, seed: str) -> list:
+    messages = []
+    for i in range(size):
+        turn = i // 2
+        message_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{seed}/{i}"))
+        if i % 2 == 0:
+            messages.append(HumanMessage(content=QUESTIONS[turn % len(QUESTIONS)], id=message_id))
+            continue
+        input_tokens = 200 + 40 * turn
+        messages.append(
+            AIMessage(
+                content=ANSWER.format(i=i, turn=turn),
+                id=f"run--{message_id}",
+                response_metadata={
+                    "id": f"msg_{message_id.replace('-', '')[:24]}",
+                    "model": "claude-3-5-sonnet-latest",
+                    "model_name": "claude-3-5-sonnet-latest",
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                },
+                usage_metadata={
+                    "input_tokens": input_tokens,
+                    "output_tokens": 42,
+                    "total_tokens": input_tokens + 42,
+                    "input_token_details": {"cache_read": input_tokens - 60, "cache_creation": 0},
+                },
+            )
+        )
+    return messages
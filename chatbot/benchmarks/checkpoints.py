@@ -0,0 +1,80 @@
+"""Checkpoint latency under concurrent writers: one shared connection vs. the pooled WAL saver.
+
+N threads each stream turns into their own ``user_{id}`` thread against a fresh
+database file. Every ``get_tuple``, ``put`` and ``put_writes`` call is timed, and
+``database is locked`` errors are counted rather than aborting the run.
+"""
+
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.checkpoint_storage import PooledSqliteSaver
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+TIMED_METHODS = ("get_tuple", "put", "put_writes")
+
+
+def run(iterations: int = 10, concurrency: int = 200, **_) -> dict:
+    results = {}
+    for mode in ("shared_connection", "pooled_wal"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "checkpoints.sqlite"
+            if mode == "shared_connection":
+                saver = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+            else:
+                saver = PooledSqliteSaver(path)
+            results[mode] = _measure(saver, iterations, concurrency)
+    return results
+
+
+def _measure(saver, turns: int, threads: int) -> dict:
+    samples = {name: [] for name in TIMED_METHODS}
+    errors = []
+    for name in TIMED_METHODS:
+        setattr(saver, name, _timed(getattr(saver, name), samples[name], errors))
+
+    graph = GraphBuilder(FakeChatModel(response="Sure.")).build_graph(saver)
+    streamer = ResponseStreamer(graph, StateManager(graph))
+
+    def converse(user_id: int):
+        user = benchmark_user(user_id)
+        for turn in range(turns):
+            for _chunk in streamer.stream_response(f"Question {turn}", user):
+                pass
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(converse, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    writes = samples["put"] + samples["put_writes"]
+    return {
+        "turns_per_second": round(turns * threads / elapsed, 1),
+        "read": summarize_ms(samples["get_tuple"]),
+        "write": summarize_ms(writes),
+        "lock_errors": sum("locked" in str(e) for e in errors),
+        "other_errors": sum("locked" not in str(e) for e in errors),
+    }
+
+
+def _timed(method, samples: list, errors: list):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+            raise
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    return timed
@@ -0,0 +1,77 @@
+"""Checkpoint database size and ``get_state`` latency before and after compaction.
+
+Several threads are grown turn by turn. At each checkpoint the database size and
+``get_state`` latency are measured, the database is compacted, and both are
+measured again. Without compaction the file grows with every turn because each
+checkpoint is a full snapshot of the thread; with it the file tracks only the
+latest state of each thread.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.checkpoint_compaction import CheckpointCompactor
+from chatbot.services.checkpoint_storage import PooledSqliteSaver
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.state_manager import StateManager
+
+THREADS = 5
+TURN_MILESTONES = (25, 100, 200)
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = PooledSqliteSaver(Path(tmp) / "checkpoints.sqlite")
+        graph = GraphBuilder(FakeChatModel(response="Sure.")).build_graph(saver)
+        state_manager = StateManager(graph)
+        compactor = CheckpointCompactor(saver, keep_latest=3)
+        users = [benchmark_user(user_id) for user_id in range(THREADS)]
+
+        turns = 0
+        for milestone in TURN_MILESTONES:
+            for turn in range(turns, milestone):
+                for user in users:
+                    graph.invoke(
+                        {"messages": state_manager.prepare_messages_for_graph(user, f"Question {turn}")},
+                        state_manager.get_thread_config(user),
+                    )
+            turns = milestone
+
+            before = {
+                "bytes": compactor.database_size(),
+                "get_state": _time_get_state(state_manager, users, iterations),
+            }
+            report = compactor.compact()
+            after = {"bytes": compactor.database_size(), "get_state": _time_get_state(state_manager, users, iterations)}
+            results[f"{milestone}_turns"] = {
+                "before": before,
+                "after": after,
+                "checkpoints_deleted": report.checkpoints_deleted,
+                "bytes_reclaimed": report.bytes_reclaimed,
+            }
+
+        # Cleared threads are removed entirely
+        for user in users:
+            state_manager.clear_conversation(user)
+        report = compactor.compact()
+        results["after_clear"] = {
+            "threads_deleted": report.threads_deleted,
+            "bytes": compactor.database_size(),
+            "bytes_reclaimed": report.bytes_reclaimed,
+        }
+        saver.close()
+    return results
+
+
+def _time_get_state(state_manager, users, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        for user in users:
+            start = time.perf_counter()
+            state_manager.get_conversation_state(user)
+            samples.append(time.perf_counter() - start)
+    return summarize_ms(samples)
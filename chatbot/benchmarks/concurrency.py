@@ -0,0 +1,126 @@
+"""Concurrent streams per worker: thread-per-stream sync path vs. event-loop async path.
+
+Each mode runs in a fresh process so resident memory measurements do not bleed
+into each other. Memory per connection is the peak RSS growth while all streams
+are open divided by the number of streams.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user
+from chatbot.services.graph_builder import AsyncGraphProvider, GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+FIRST_TOKEN_LATENCY = 0.5
+TOKEN_INTERVAL = 0.02
+SAFETY_LATENCY = 0.2
+
+
+def run(iterations: int = 10, concurrency: int = 200, **_) -> dict:
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+    ) as pool:
+        for mode in ("sync", "async"):
+            results[mode] = pool.submit(_measure, mode, concurrency).result()
+    return results
+
+
+def _init_worker():
+    django.setup()
+    logging.getLogger("chatbot").setLevel(logging.ERROR)
+
+
+def _build_streamer():
+    llm = FakeChatModel(
+        safety_latency=SAFETY_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, token_interval=TOKEN_INTERVAL
+    )
+    graph = GraphBuilder(llm).build_graph(InMemorySaver())
+    async_graph = AsyncGraphProvider(graph, db_path=None)
+    return ResponseStreamer(graph, StateManager(graph, async_graph), async_graph=async_graph)
+
+
+def _measure(mode: str, concurrency: int) -> dict:
+    streamer = _build_streamer()
+    sampler = _PeakSampler()
+    baseline_rss = _rss_bytes()
+
+    sampler.start()
+    start = time.perf_counter()
+    if mode == "sync":
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            chunks = sum(
+                pool.map(lambda i: _consume(streamer.stream_response("hello", benchmark_user(i))), range(concurrency))
+            )
+    else:
+        chunks = asyncio.run(_consume_all_async(streamer, concurrency))
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    return {
+        "streams": concurrency,
+        "wall_s": round(elapsed, 3),
+        "streams_per_s": round(concurrency / elapsed, 1),
+        "chunks": chunks,
+        "peak_threads": sampler.peak_threads,
+        "memory_per_stream_kb": round(max(sampler.peak_rss - baseline_rss, 0) / concurrency / 1024, 1),
+    }
+
+
+def _consume(chunks) -> int:
+    return sum(1 for _ in chunks)
+
+
+async def _consume_all_async(streamer, concurrency: int) -> int:
+    async def consume(user_id):
+        count = 0
+        async for _ in streamer.astream_response("hello", benchmark_user(user_id)):
+            count += 1
+        return count
+
+    return sum(await asyncio.gather(*(consume(i) for i in range(concurrency))))
+
+
+def _rss_bytes() -> int:
+    """Current resident set size (Linux); 0 where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+class _PeakSampler:
+    """Background sampler of peak RSS and live thread count."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            # Exclude the sampler thread itself
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            time.sleep(self.interval)
@@ -0,0 +1,54 @@
+"""Prompt size and latency per turn with and without the context window.
+
+Plays a long conversation through the graph twice: once sending the full history
+to the domain agent, once with a token budget and rolling summarization. The fake
+LLM charges ``INPUT_TOKEN_LATENCY`` per thousand input tokens, so prompt growth
+shows up as time-to-first-token growth.
+"""
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms, time_stream
+from chatbot.services.context_window import ContextWindow
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+TURNS = 200
+MAX_TOKENS = 2000
+INPUT_TOKEN_LATENCY = 0.05
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for mode, context_window in (("full", None), ("windowed", ContextWindow(max_tokens=MAX_TOKENS))):
+        llm = FakeChatModel(input_token_latency=INPUT_TOKEN_LATENCY)
+        graph = GraphBuilder(llm, context_window=context_window).build_graph(InMemorySaver())
+        streamer = ResponseStreamer(graph, StateManager(graph))
+        user = benchmark_user(1)
+
+        domain_tokens = []
+        ttfts = []
+        for turn in range(TURNS):
+            before = llm.counters["domain_input_tokens"]
+            timing = time_stream(streamer.stream_response(f"Question {turn}: tell me more about checkpoints.", user))
+            domain_tokens.append(llm.counters["domain_input_tokens"] - before)
+            ttfts.append(timing.ttft)
+
+        counters = llm.counters
+        results[mode] = {
+            "domain_input_tokens_first_turn": domain_tokens[0],
+            "domain_input_tokens_last_turn": domain_tokens[-1],
+            "domain_input_tokens_max": max(domain_tokens),
+            "summary_calls": counters["summary_calls"],
+            "input_tokens_per_turn": round(
+                (counters["domain_input_tokens"] + counters["summary_input_tokens"]) / TURNS
+            ),
+            "ttft_last_10_turns": summarize_ms(ttfts[-10:]),
+        }
+
+    results["input_tokens_saved_per_turn"] = (
+        results["full"]["input_tokens_per_turn"] - results["windowed"]["input_tokens_per_turn"]
+    )
+    return results
@@ -0,0 +1,111 @@
+"""Clients going away mid-response, with the generation kept running vs. cancelled.
+
+``CONCURRENCY`` clients at a time send a message, read ``READ_CHUNKS`` chunks of
+a response of about ``RESPONSE_WORDS`` tokens and close the stream, ``iterations``
+times. Turns go through the stream hub, as with admission control or resuming
+enabled, with no cancellation and with a grace period of 0, and straight from
+the streamer with ``cancel_on_disconnect``. Reported are the response tokens
+generated and read per turn, the tokens saved against running every response
+to the end, the worker time each turn held after its client left (until the
+hub's producer finished, or until closing the stream returned) and the turns
+checkpointed with the truncated marker.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import DEFAULT_RESPONSE, FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.constants import TRUNCATED_MARKER
+from chatbot.services.admission import StreamHub
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+MESSAGE = "What is LangGraph?"
+RESPONSE = " ".join([DEFAULT_RESPONSE] * 4)
+RESPONSE_WORDS = len(RESPONSE.split())
+READ_CHUNKS = 10
+CONCURRENCY = 8
+
+SAFETY_LATENCY = 0.05
+FIRST_TOKEN_LATENCY = 0.1
+TOKEN_INTERVAL = 0.01
+
+MODES = {
+    "keep_generating": {"hub": True, "cancel_grace": None},
+    "cancel": {"hub": True, "cancel_grace": 0},
+    "cancel_direct": {"hub": False},
+}
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for name, mode in MODES.items():
+        llm = FakeChatModel(
+            response=RESPONSE,
+            safety_latency=SAFETY_LATENCY,
+            first_token_latency=FIRST_TOKEN_LATENCY,
+            token_interval=TOKEN_INTERVAL,
+        )
+        graph = GraphBuilder(llm).build_graph(InMemorySaver())
+        state_manager = StateManager(graph)
+        streamer = ResponseStreamer(graph, state_manager, cancel_on_disconnect=not mode["hub"])
+        hub = StreamHub(dedupe=False, cancel_grace=mode["cancel_grace"]) if mode["hub"] else None
+
+        users = [benchmark_user(user_id) for user_id in range(CONCURRENCY)]
+        held = []
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            for _ in range(iterations):
+                held += pool.map(lambda user: _abandon(streamer, hub, user), users)
+
+        turns = len(held)
+        generated = llm.counters["domain_tokens"] / turns
+        results[name] = {
+            "tokens_generated_per_turn": generated,
+            "tokens_read_per_turn": READ_CHUNKS,
+            "held_after_disconnect": summarize_ms(held),
+            "worker_seconds_per_1k_turns": round(sum(held) / turns * 1000, 1),
+            "truncated_checkpoints": sum(_truncated(state_manager, user) for user in users),
+        }
+
+    baseline = results["keep_generating"]
+    for result in results.values():
+        result["tokens_saved_per_turn"] = baseline["tokens_generated_per_turn"] - result["tokens_generated_per_turn"]
+        result["worker_seconds_reclaimed_per_1k_turns"] = round(
+            baseline["worker_seconds_per_1k_turns"] - result["worker_seconds_per_1k_turns"], 1
+        )
+    return results
+
+
+def _abandon(streamer: ResponseStreamer, hub, user) -> float:
+    """Read the first chunks of a turn, leave, and return the seconds the turn still held a worker."""
+    if hub is None:
+        chunks = streamer.stream_response(MESSAGE, user)
+        _read(chunks)
+        left = time.perf_counter()
+        chunks.close()
+        return time.perf_counter() - left
+
+    shared = hub.open(user.id, MESSAGE, lambda shared: streamer.stream_response(MESSAGE, user, abort=shared.abort))
+    chunks = shared.follow()
+    _read(chunks)
+    left = time.perf_counter()
+    chunks.close()
+    while not shared.done:
+        time.sleep(0.005)
+    return time.perf_counter() - left
+
+
+def _read(chunks):
+    for read, _ in enumerate(chunks, 1):
+        if read == READ_CHUNKS:
+            return
+
+
+def _truncated(state_manager: StateManager, user) -> bool:
+    """Whether the user's last turn was checkpointed cut short."""
+    history = state_manager.get_conversation_history(user)
+    return bool(history) and history[-1].text().endswith(TRUNCATED_MARKER)
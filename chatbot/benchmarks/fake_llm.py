@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Iterator, Optional
+from xml.sax.saxutils import unescape
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from chatbot.constants import SAFETY_STATUS_APPROVE, SAFETY_STATUS_REJECT
+from chatbot.services.utils import extract_all_xml
+
+DEFAULT_RESPONSE = (
+    "LangGraph models an application as a graph of nodes that read and write a shared state. "
+    "Each node is a plain function, edges decide what runs next, and a checkpointer persists the "
+    "state after every step so a conversation can be resumed on the next request."
+)
+
+DEFAULT_SUMMARY = "The user is learning how LangGraph persists conversation state."
+
+# Prefill time of a cached input token relative to an uncached one
+CACHED_PREFILL_RATIO = 0.1
+
+
+class InjectedError(Exception):
+    """Failure injected by ``FakeChatModel``, standing in for a provider error."""
+
+
+class FakeChatModel(BaseChatModel):
+    """Scripted chat model with configurable latency, used by the benchmarks.
+
+    Calls are classified by their prompt: safety checks (a system prompt asking for a
+    ``<status>`` tag) get an XML verdict after ``safety_latency``; summarization calls
+    (a ``<conversation>`` transcript) get a fixed summary; every other call streams
+    ``response`` word by word. ``input_token_latency`` adds prefill time per thousand
+    input tokens to the first token of every call.
+
+    A batched safety check (``<message id="...">`` blocks) gets one ``<result>``
+    block per message, each adding ``safety_result_latency`` to the response time.
+    Verdicts list their tags in the order the safety prompt asks for, with
+    ``safety_reasoning`` as the reasoning, and stream word by word every
+    ``safety_token_interval`` seconds after the first token.
+    Safety verdicts come from ``verdicts`` (message text to violation type, with
+    ``NONE`` meaning approve) when the checked message is listed there, and from
+    ``reject_markers`` otherwise. Responses carry ``usage_metadata`` with the
+    approximate input token count and one output token per streamed word;
+    ``max_tokens`` cuts every output off after that many words, like the
+    provider's output cap.
+
+    With ``prompt_cache`` the model simulates a provider prompt cache: the prefix
+    ending at each ``cache_control`` breakpoint is written once it reaches
+    ``prompt_cache_min_tokens``, and a later call reads the longest written prefix
+    ending at, or up to 20 messages before, its last breakpoint. Cached tokens
+    take ``CACHED_PREFILL_RATIO`` of the normal prefill time and are reported in
+    ``input_token_details`` the way the Anthropic client reports them.
+
+    Faults are injected at random, reproducibly for a given ``seed``: a call
+    fails with ``InjectedError`` at ``error_rate``, and takes ``latency_spike``
+    seconds longer to its first token at ``latency_spike_rate``. Injected faults
+    are counted as ``<kind>_errors`` and ``<kind>_spikes``.
+    """
+
+    response: str = DEFAULT_RESPONSE
+    summary: str = DEFAULT_SUMMARY
+    safety_latency: float = 0.0
+    safety_result_latency: float = 0.0
+    safety_token_interval: float = 0.0
+    safety_reasoning: str = "Scripted verdict."
+    first_token_latency: float = 0.0
+    token_interval: float = 0.0
+    input_token_latency: float = 0.0
+    reject_markers: tuple[str, ...] = ("ignore previous instructions", "jailbreak")
+    verdicts: dict[str, str] = {}
+    prompt_cache: bool = False
+    prompt_cache_min_tokens: int = 1024
+    max_tokens: Optional[int] = None
+    error_rate: float = 0.0
+    latency_spike_rate: float = 0.0
+    latency_spike: float = 0.0
+    seed: Optional[int] = None
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _counters: dict = PrivateAttr(default_factory=lambda: defaultdict(int))
+    _cached_prefixes: set = PrivateAttr(default_factory=set)
+    _random: Optional[random.Random] = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @property
+    def counters(self) -> dict:
+        """Snapshot of call and token counters, e.g. ``domain_calls`` or ``safety_input_tokens``."""
+        with self._lock:
+            return defaultdict(int, self._counters)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._counters[key] += amount
+
+    def _kind(self, messages) -> str:
+        if any(isinstance(m, SystemMessage) and "<status>" in m.text() for m in messages):
+            return "safety"
+        if "<conversation>" in messages[-1].text():
+            return "summary"
+        return "domain"
+
+    def _start_call(self, messages) -> tuple[str, float, dict]:
+        """Record a call and return its kind, the delay before its first token and its input usage."""
+        kind = self._kind(messages)
+        input_tokens = count_tokens_approximately(_plain(messages))
+        cache_read, cache_write = self._cache_usage(messages)
+        self._count(f"{kind}_calls")
+        self._count(f"{kind}_input_tokens", input_tokens)
+        self._count(f"{kind}_cache_read_tokens", cache_read)
+        self._count(f"{kind}_cache_write_tokens", cache_write)
+
+        prefill_tokens = input_tokens - cache_read * (1 - CACHED_PREFILL_RATIO)
+        delay = self.input_token_latency * prefill_tokens / 1000
+        delay += self.safety_latency if kind == "safety" else self.first_token_latency
+        if kind == "safety":
+            delay += self.safety_result_latency * max(messages[-1].text().count("<message id="), 1)
+        delay += self._inject_fault(kind)
+
+        input_usage = {"input_tokens": input_tokens}
+        if self.prompt_cache:
+            input_usage["input_token_details"] = {"cache_read": cache_read, "cache_creation": cache_write}
+        return kind, delay, input_usage
+
+    def _inject_fault(self, kind: str) -> float:
+        """Raise an injected error or return the injected extra latency of a call."""
+        if not (self.error_rate or self.latency_spike_rate):
+            return 0.0
+        with self._lock:
+            if self._random is None:
+                self._random = random.Random(self.seed)
+            draw = self._random.random()
+        if draw < self.error_rate:
+            self._count(f"{kind}_errors")
+            raise InjectedError(f"Injected {kind} error")
+        if draw < self.error_rate + self.latency_spike_rate:
+            self._count(f"{kind}_spikes")
+            return self.latency_spike
+        return 0.0
+
+    def _cache_usage(self, messages) -> tuple[int, int]:
+        """Tokens read from and written to the simulated prompt cache by a call."""
+        breakpoints = [i for i, m in enumerate(messages) if _has_cache_control(m)] if self.prompt_cache else []
+        if not breakpoints:
+            return 0, 0
+
+        # Key and cumulative token count of every prefix up to the last breakpoint
+        digest = hashlib.sha256()
+        keys, tokens, total = [], [], 0
+        for message in _plain(messages[: breakpoints[-1] + 1]):
+            digest.update(f"{message.type}\0{message.text()}\0".encode())
+            keys.append(digest.hexdigest())
+            total += count_tokens_approximately([message])
+            tokens.append(total)
+
+        last = breakpoints[-1]
+        with self._lock:
+            hit = next((i for i in range(last, max(last - 21, -1), -1) if keys[i] in self._cached_prefixes), None)
+            read = tokens[hit] if hit is not None else 0
+            written = [i for i in breakpoints if tokens[i] >= self.prompt_cache_min_tokens and tokens[i] > read]
+            self._cached_prefixes.update(keys[i] for i in written)
+        return read, (tokens[written[-1]] - read if written else 0)
+
+    @staticmethod
+    def _usage(input_usage: dict, output_tokens: int) -> dict:
+        return {
+            **input_usage,
+            "output_tokens": output_tokens,
+            "total_tokens": input_usage["input_tokens"] + output_tokens,
+        }
+
+    def _tokens(self, kind: str, messages) -> list[str]:
+        if kind == "safety":
+            text = self._verdict(messages)
+        else:
+            text = self.summary if kind == "summary" else self.response
+        return re.findall(r"\S+\s*", text)[: self.max_tokens]
+
+    def _interval(self, kind: str) -> float:
+        return self.safety_token_interval if kind == "safety" else self.token_interval
+
+    def _verdict(self, messages) -> str:
+        text = messages[-1].text()
+        prompt = messages[0].text()
+        reasoning_first = prompt.find("<reasoning>") < prompt.find("<status>")
+        batch = extract_all_xml(text, "message")
+        if batch:
+            return "\n\n".join(
+                f'<result id="{id}">\n{self._message_verdict(unescape(message), reasoning_first)}\n</result>'
+                for id, message in batch.items()
+            )
+        return self._message_verdict(text, reasoning_first)
+
+    def _message_verdict(self, text: str, reasoning_first: bool = False) -> str:
+        violation_type = next((v for message, v in self.verdicts.items() if text.endswith(message)), None)
+        if violation_type is None:
+            lowered = text.lower()
+            violation_type = "JAILBREAK" if any(marker in lowered for marker in self.reject_markers) else "NONE"
+        status = SAFETY_STATUS_APPROVE if violation_type == "NONE" else SAFETY_STATUS_REJECT
+        tags = [f"<status>{status}</status>", f"<violation_type>{violation_type}</violation_type>"]
+        reasoning = f"<reasoning>{self.safety_reasoning}</reasoning>"
+        return "\n\n".join([reasoning, *tags] if reasoning_first else [*tags, reasoning])
+
+    def _chunk(self, token: str, index: int, tokens: list[str], input_usage: dict) -> AIMessageChunk:
+        """Stream chunk for ``tokens[index]``; like the Anthropic client, usage arrives with the last one."""
+        if index < len(tokens) - 1:
+            return AIMessageChunk(content=token)
+        return AIMessageChunk(content=token, usage_metadata=self._usage(input_usage, len(tokens)))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        kind, delay, input_usage = self._start_call(messages)
+        tokens = self._tokens(kind, messages)
+        time.sleep(delay + self._interval(kind) * (len(tokens) - 1))
+        self._count(f"{kind}_tokens", len(tokens))
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(input_usage, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        kind, delay, input_usage = self._start_call(messages)
+        tokens = self._tokens(kind, messages)
+        await asyncio.sleep(delay + self._interval(kind) * (len(tokens) - 1))
+        self._count(f"{kind}_tokens", len(tokens))
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(input_usage, len(tokens)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        kind, delay, input_usage = self._start_call(messages)
+        time.sleep(delay)
+        tokens = self._tokens(kind, messages)
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self._interval(kind))
+            self._count(f"{kind}_tokens")
+            chunk = ChatGenerationChunk(message=self._chunk(token, index, tokens, input_usage))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        kind, delay, input_usage = self._start_call(messages)
+        await asyncio.sleep(delay)
+        tokens = self._tokens(kind, messages)
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self._interval(kind))
+            self._count(f"{kind}_tokens")
+            chunk = ChatGenerationChunk(message=self._chunk(token, index, tokens, input_usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def _has_cache_control(message) -> bool:
+    return isinstance(message.content, list) and any(
+        isinstance(block, dict) and "cache_control" in block for block in message.content
+    )
+
+
+def _plain(messages) -> list:
+    """Messages with content blocks flattened to text, so cache markers do not change token counts."""
+    return [m if isinstance(m.content, str) else m.model_copy(update={"content": m.text()}) for m in messages]
@@ -0,0 +1,110 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+
+
+def benchmark_user(user_id: int):
+    """Stand-in for a Django user; the pipeline only needs ``user.id``."""
+    return SimpleNamespace(id=user_id)
+
+
+@contextmanager
+def test_databases(directory):
+    """Create the test databases in ``directory`` for the block, as the test runner would.
+
+    The default database is a file rather than SQLite's shared-cache in-memory
+    test database, and uses immediate transactions, so concurrent writers wait for
+    the lock instead of failing with "database table is locked".
+    """
+    from django.db import connections
+    from django.test.utils import (
+        setup_databases,
+        setup_test_environment,
+        teardown_databases,
+        teardown_test_environment,
+    )
+
+    database = connections["default"].settings_dict
+    saved = database["TEST"].get("NAME"), database["OPTIONS"]
+    database["TEST"]["NAME"] = str(Path(directory) / "test.sqlite3")
+    database["OPTIONS"] = {**saved[1], "transaction_mode": "IMMEDIATE"}
+    setup_test_environment()
+    old_databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_databases, verbosity=0)
+        teardown_test_environment()
+        database["TEST"]["NAME"], database["OPTIONS"] = saved
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of a non-empty sequence."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize_ms(values) -> dict:
+    """p50/p99/max of a list of durations in seconds, reported in milliseconds."""
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2),
+    }
+
+
+# Result keys compared against a baseline, by suffix: True when higher is better.
+# Tail latencies (p99/max) are left out, they are too noisy for a fixed tolerance.
+BASELINE_DIRECTIONS = {"_per_s": True, "p50_ms": False, "_bytes": False, "_kib": False}
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions of ``results`` against ``baseline`` beyond a relative ``tolerance``.
+
+    Nested keys are compared by their dotted path; keys missing from either side,
+    or without a known direction, are skipped.
+    """
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        before = previous.get(key)
+        higher_is_better = next((v for suffix, v in BASELINE_DIRECTIONS.items() if key.endswith(suffix)), None)
+        if not before or higher_is_better is None:
+            continue
+        change = value / before - 1
+        if change < -tolerance if higher_is_better else change > tolerance:
+            regressions.append(f"{key}: {before} -> {value} ({change:+.1%})")
+    return regressions
+
+
+def _flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+@dataclass
+class StreamTiming:
+    ttft: float
+    total: float
+    chunks: int
+
+
+def time_stream(chunks) -> StreamTiming:
+    """Consume a chunk iterator, recording time-to-first-chunk and total time."""
+    start = time.perf_counter()
+    ttft = None
+    count = 0
+    for _ in chunks:
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        count += 1
+    total = time.perf_counter() - start
+    return StreamTiming(ttft=total if ttft is None else ttft, total=total, chunks=count)
@@ -0,0 +1,74 @@
+"""Per-turn pipeline overhead as a thread's history grows.
+
+Compares the delta input used by ``StateManager.prepare_messages_for_graph`` with
+the previous behaviour of loading the checkpointed history and resubmitting it in
+full. The fake LLM answers instantly, so the timings are pure pipeline overhead:
+preparing the input, restoring and merging state, and writing the checkpoint.
+"""
+
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.state_manager import StateManager
+
+HISTORY_SIZES = (10, 100, 1000, 5000)
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(Path(tmp) / "checkpoints.sqlite", check_same_thread=False)
+        graph = GraphBuilder(FakeChatModel(response="Sure.")).build_graph(SqliteSaver(conn))
+        state_manager = StateManager(graph)
+
+        for user_id, size in enumerate(HISTORY_SIZES):
+            user = benchmark_user(user_id)
+            config = state_manager.get_thread_config(user)
+            graph.update_state(config, {"messages": _history(size)}, as_node="chatbot")
+
+            results[f"{size}_messages"] = {
+                "full": _measure_turns(graph, state_manager, user, iterations, full_history=True),
+                "delta": _measure_turns(graph, state_manager, user, iterations, full_history=False),
+            }
+        conn.close()
+    return results
+
+
+def _history(size: int) -> list:
+    return [
+        HumanMessage(content=f"Question {i}: how do checkpoints work?")
+        if i % 2 == 0
+        else AIMessage(content=f"Answer {i}: every step of the graph is persisted by the checkpointer.")
+        for i in range(size)
+    ]
+
+
+def _measure_turns(graph, state_manager, user, iterations: int, full_history: bool) -> dict:
+    config = state_manager.get_thread_config(user)
+    prepare_times = []
+    turn_times = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        if full_history:
+            # Previous behaviour: load the whole history and resubmit it with the new message
+            state = state_manager.get_conversation_state(user)
+            messages = state.values.get("messages", []) + [HumanMessage(content=f"Follow-up {i}")]
+        else:
+            messages = state_manager.prepare_messages_for_graph(user, f"Follow-up {i}")
+        prepared = time.perf_counter()
+
+        for _ in graph.stream({"messages": messages, "user_id": user.id}, config=config, stream_mode="messages"):
+            pass
+
+        prepare_times.append(prepared - start)
+        turn_times.append(time.perf_counter() - start)
+
+    return {"prepare": summarize_ms(prepare_times), "turn": summarize_ms(turn_times)}
@@ -0,0 +1,96 @@
+"""Cost of per-turn latency metrics, with metrics enabled vs. disabled.
+
+Turns run against a model that answers instantly and a SQLite checkpointer, so
+the turn time is pipeline overhead only. This is the worst case for the relative
+cost of instrumentation; a real model call makes it vanish. Every turn starts a
+new thread so turn cost does not drift, and modes alternate turn by turn in
+ABBA order so neither is favoured by its position.
+
+The cost of one timed phase is also measured directly and multiplied by the
+number of phases a turn records, which is a steadier estimate than the
+difference of two noisy end-to-end timings.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, percentile, summarize_ms
+from chatbot.services.checkpoint_storage import PooledSqliteSaver
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.metrics import REGISTRY, TurnMetrics, timed
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+MICRO_ITERATIONS = 100_000
+WARM_UP_TURNS = 50
+
+
+def run(iterations: int = 10, **_) -> dict:
+    turns = iterations * 100
+    samples = {"enabled": [], "disabled": []}
+    enabled_before = getattr(settings, "CHATBOT_METRICS_ENABLED", True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = PooledSqliteSaver(Path(tmp) / "checkpoints.sqlite")
+        graph = GraphBuilder(FakeChatModel()).build_graph(saver)
+        streamer = ResponseStreamer(graph, StateManager(graph))
+
+        for turn in range(WARM_UP_TURNS):
+            for _ in streamer.stream_response("Warm up", benchmark_user(-turn - 1)):
+                pass
+
+        observations_before = _observation_count()
+        try:
+            for turn in range(turns * 2):
+                mode = "enabled" if turn % 4 in (0, 3) else "disabled"
+                settings.CHATBOT_METRICS_ENABLED = mode == "enabled"
+
+                start = time.perf_counter()
+                for _ in streamer.stream_response(f"Question {turn}", benchmark_user(turn)):
+                    pass
+                samples[mode].append(time.perf_counter() - start)
+        finally:
+            settings.CHATBOT_METRICS_ENABLED = enabled_before
+            saver.close()
+
+    observations_per_turn = (_observation_count() - observations_before) / turns
+    enabled, disabled = summarize_ms(samples["enabled"]), summarize_ms(samples["disabled"])
+    observe_cost = _observe_cost()
+    return {
+        "turns_per_mode": turns,
+        "enabled": enabled,
+        "disabled": disabled,
+        "measured_overhead_p50_pct": round((enabled["p50_ms"] / disabled["p50_ms"] - 1) * 100, 2),
+        "observations_per_turn": round(observations_per_turn, 1),
+        "observe_cost_us": round(observe_cost * 1e6, 3),
+        "estimated_overhead_pct": round(
+            observations_per_turn * observe_cost / percentile(samples["disabled"], 50) * 100, 3
+        ),
+        "render_ms": round(_render_cost() * 1000, 3),
+    }
+
+
+def _observe_cost() -> float:
+    """Seconds per phase recorded through ``timed``, as agents and the checkpointer do."""
+    config = TurnMetrics().attach({"configurable": {}})
+    start = time.perf_counter()
+    for _ in range(MICRO_ITERATIONS):
+        with timed(config, "benchmark", "benchmark"):
+            pass
+    return (time.perf_counter() - start) / MICRO_ITERATIONS
+
+
+def _observation_count() -> int:
+    """Phase observations recorded so far, read from the rendered histogram."""
+    lines = REGISTRY.render().splitlines()
+    return sum(int(line.rsplit(" ", 1)[1]) for line in lines if line.startswith("chatguard_phase_seconds_count"))
+
+
+def _render_cost() -> float:
+    start = time.perf_counter()
+    REGISTRY.render()
+    return time.perf_counter() - start
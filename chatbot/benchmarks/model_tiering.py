@@ -0,0 +1,103 @@
+"""Safety phase latency and cost with one large model for every node vs. a small model for safety.
+
+Each configuration is a ``CHATBOT_LLM_MODELS`` value whose model names refer to
+``MODELS``: typical first-token latency and output speed of a large and a small
+model, replayed by ``FakeChatModel``, and their list prices in USD per million
+tokens. ``CONCURRENCY`` users send a turn at once, ``iterations`` times. The
+safety response is read in full (``CHATBOT_SAFETY_STREAMING`` off), so the
+output cap shows in latency as well as in cost. Reported per configuration are
+the safety phase, including any wait for the node's concurrency limit, time to
+first token, safety output tokens per check and the cost of 1,000 turns.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test.utils import override_settings
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.llm_clients import NodeModels
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+MODELS = {
+    "large": {"first_token_latency": 0.6, "token_interval": 0.015, "input_price": 3.0, "output_price": 15.0},
+    "small": {"first_token_latency": 0.3, "token_interval": 0.006, "input_price": 0.8, "output_price": 4.0},
+}
+
+CONFIGURATIONS = {
+    "single_large": {"default": {"MODEL": "large"}},
+    "tiered": {"default": {"MODEL": "large"}, "safety": {"MODEL": "small"}},
+    "tiered_capped": {"default": {"MODEL": "large"}, "safety": {"MODEL": "small", "MAX_TOKENS": 24}},
+    "tiered_capped_limited": {
+        "default": {"MODEL": "large"},
+        "safety": {"MODEL": "small", "MAX_TOKENS": 24, "MAX_CONCURRENCY": 4},
+    },
+}
+
+CONCURRENCY = 16
+MESSAGE = "What is LangGraph?"
+SAFETY_REASONING = " ".join(["The message asks a technical question about the framework."] * 6)
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for name, models in CONFIGURATIONS.items():
+        created = []
+
+        def create_llm(config):
+            profile = MODELS[config.model]
+            llm = FakeChatModel(
+                safety_latency=profile["first_token_latency"],
+                safety_token_interval=profile["token_interval"],
+                safety_reasoning=SAFETY_REASONING,
+                first_token_latency=profile["first_token_latency"],
+                token_interval=profile["token_interval"],
+                max_tokens=config.max_tokens,
+            )
+            created.append((llm, profile))
+            return llm
+
+        with override_settings(CHATBOT_LLM_MODELS=models, CHATBOT_SAFETY_STREAMING=False):
+            graph = GraphBuilder(NodeModels.from_settings(create_llm)).build_graph(InMemorySaver())
+            streamer = ResponseStreamer(graph, StateManager(graph))
+            samples = []
+            with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+                for _ in range(iterations):
+                    samples += pool.map(lambda user_id: _turn(streamer, user_id), range(CONCURRENCY))
+
+        turns = len(samples)
+        safety_cost = sum(_cost(llm.counters, "safety", profile) for llm, profile in created)
+        domain_cost = sum(_cost(llm.counters, "domain", profile) for llm, profile in created)
+        results[name] = {
+            "safety_phase": summarize_ms([safety for safety, _ in samples]),
+            "ttft": summarize_ms([ttft for _, ttft in samples]),
+            "safety_output_tokens_per_check": sum(llm.counters["safety_tokens"] for llm, _ in created) / turns,
+            "usd_per_1k_turns": {
+                "safety": round(safety_cost / turns * 1000, 4),
+                "domain": round(domain_cost / turns * 1000, 4),
+                "total": round((safety_cost + domain_cost) / turns * 1000, 4),
+            },
+        }
+    return results
+
+
+def _turn(streamer: ResponseStreamer, user_id: int) -> tuple[float, float]:
+    """Safety phase and time to first token of one turn, in seconds."""
+    timings = {}
+    start = time.perf_counter()
+    first = None
+    for _ in streamer.stream_response(MESSAGE, benchmark_user(user_id), timings):
+        first = first or time.perf_counter()
+    safety_ms = timings.get("safety.safety_llm", 0) + timings.get("safety.llm_queue", 0)
+    return safety_ms / 1000, (first or time.perf_counter()) - start
+
+
+def _cost(counters: dict, kind: str, profile: dict) -> float:
+    """USD spent on ``kind`` calls of one model."""
+    return (
+        counters[f"{kind}_input_tokens"] * profile["input_price"] + counters[f"{kind}_tokens"] * profile["output_price"]
+    ) / 1_000_000
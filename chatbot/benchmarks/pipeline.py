@@ -0,0 +1,156 @@
+"""End-to-end cost of the ``ChatbotService`` pipeline and the HTTP ``/stream/`` path.
+
+The service is built the way views build it, with a scripted model injected
+through ``LLMFactory.override``, a throwaway checkpoint database and a test
+database for the message index and users, so nothing touches the configured
+databases or the network. The model answers instantly, so every number is
+pipeline cost: graph, checkpointer, message index, streamer and, for the HTTP
+path, the view, middleware and SSE framing. Pass a configured ``model`` (token
+rate, latency, safety verdicts) to measure with model time included.
+
+Results are meant to be compared against a stored baseline recorded on the
+same machine (``manage.py benchmark pipeline --baseline <file>``).
+"""
+
+import gc
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.test import Client
+from django.test.utils import override_settings
+
+import chatbot.services.chatbot_service as chatbot_service
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import StreamTiming, benchmark_user, summarize_ms, test_databases, time_stream
+from chatbot.services.chatbot_service import ChatbotService
+from chatbot.services.checkpoint_compaction import CheckpointCompactor
+from chatbot.services.graph_builder import LLMFactory
+
+HISTORY_MILESTONES = (10, 100, 400)
+MEMORY_THREADS = 50
+WORKERS = 8
+
+
+def run(iterations: int = 10, model: FakeChatModel | None = None, **_) -> dict:
+    with tempfile.TemporaryDirectory() as tmp, test_databases(tmp):
+        settings = {
+            "CHATBOT_CHECKPOINT_PATH": str(Path(tmp) / "checkpoints.sqlite"),
+            "CHATBOT_CHECKPOINT_COMPACTION_INTERVAL": None,
+            "CHATBOT_SAFETY_CACHE_BACKEND": None,
+        }
+        with override_settings(**settings), LLMFactory.override(model or FakeChatModel()):
+            chatbot = ChatbotService()
+            try:
+                return {
+                    "service": _service_api(chatbot, iterations),
+                    "http": _http(chatbot, iterations),
+                }
+            finally:
+                chatbot.graph.checkpointer.close()
+
+
+def _service_api(chatbot, iterations: int) -> dict:
+    next_user = iter(range(1, 1_000_000))
+
+    def turn(user, message="What is LangGraph?"):
+        return time_stream(chatbot.stream_response(message, user))
+
+    # Warm up lazily initialized parts (SQLite statements, model schemas)
+    for _ in range(5):
+        turn(benchmark_user(next(next_user)))
+
+    first_turns = [turn(benchmark_user(next(next_user))) for _ in range(iterations * 5)]
+    sequential = _throughput(lambda: turn(benchmark_user(next(next_user))), iterations * 10, workers=1)
+    concurrent = _throughput(lambda: turn(benchmark_user(next(next_user))), iterations * 10, workers=WORKERS)
+
+    return {
+        "ttft": summarize_ms([t.ttft for t in first_turns]),
+        "turn": summarize_ms([t.total for t in first_turns]),
+        "throughput": {"sequential_turns_per_s": sequential, f"{WORKERS}_workers_turns_per_s": concurrent},
+        "history": _history_overhead(chatbot, turn, benchmark_user(next(next_user)), iterations),
+        "per_thread": _per_thread_cost(chatbot, turn, next_user),
+    }
+
+
+def _throughput(turn, turns: int, workers: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(turn) for _ in range(turns)]:
+            future.result()
+    return round(turns / (time.perf_counter() - start), 1)
+
+
+def _history_overhead(chatbot, turn, user, iterations: int) -> dict:
+    """Turn latency on one thread as its history grows through real turns."""
+    results = {}
+    messages = 0
+    for milestone in HISTORY_MILESTONES:
+        while messages < milestone:
+            turn(user, f"Question {messages}")
+            messages += 2
+        samples = [turn(user, f"Question {messages + 2 * i}") for i in range(iterations)]
+        messages += 2 * iterations
+        results[f"{milestone}_messages"] = summarize_ms([t.total for t in samples])
+    return results
+
+
+def _per_thread_cost(chatbot, turn, next_user) -> dict:
+    """Checkpoint database growth and retained Python memory for new one-turn threads."""
+    compactor = CheckpointCompactor(chatbot.graph.checkpointer)
+    bytes_before = compactor.database_size()
+
+    gc.collect()
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    for _ in range(MEMORY_THREADS):
+        turn(benchmark_user(next(next_user)))
+    gc.collect()
+    memory_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "checkpoint_bytes": round((compactor.database_size() - bytes_before) / MEMORY_THREADS),
+        "memory_kib": round((memory_after - memory_before) / MEMORY_THREADS / 1024, 2),
+    }
+
+
+def _http(chatbot, iterations: int) -> dict:
+    """``POST /stream/`` through the test client, middleware and view included."""
+    from django.contrib.auth import get_user_model
+
+    previous, chatbot_service._chatbot_instance = chatbot_service._chatbot_instance, chatbot
+    try:
+        clients = []
+        for i in range(iterations):
+            client = Client()
+            client.force_login(get_user_model().objects.create_user(f"benchmark-{i}"))
+            clients.append(client)
+
+        def turn(client):
+            """Time to the first event and to the end of the response, from sending the request."""
+            start = time.perf_counter()
+            ttft = None
+            for _ in client.post("/stream/", {"message": "What is LangGraph?"}).streaming_content:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+            return StreamTiming(ttft=ttft, total=time.perf_counter() - start, chunks=0)
+
+        for client in clients:
+            turn(client)
+        samples = [turn(client) for _ in range(5) for client in clients]
+
+        start = time.perf_counter()
+        for client in clients * 5:
+            turn(client)
+        throughput = round(len(clients) * 5 / (time.perf_counter() - start), 1)
+    finally:
+        chatbot_service._chatbot_instance = previous
+
+    return {
+        "ttft": summarize_ms([t.ttft for t in samples]),
+        "turn": summarize_ms([t.total for t in samples]),
+        "throughput": {"sequential_turns_per_s": throughput},
+    }
@@ -0,0 +1,60 @@
+"""Prompt caching: input cost and time-to-first-token over a growing thread.
+
+One thread is extended turn by turn with prompt caching disabled and enabled.
+The scripted model simulates the provider cache: prefill time grows with
+uncached input tokens, and cached tokens prefill ``CACHED_PREFILL_RATIO`` of that
+time. Input cost is in uncached input tokens, with cache reads and writes
+priced relative to them as the provider does.
+"""
+
+from django.test.utils import override_settings
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import DEFAULT_RESPONSE, FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms, time_stream
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.prompt_cache import CACHE_READ_COST, CACHE_WRITE_COST, input_tokens_saved
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+RESPONSE = " ".join([DEFAULT_RESPONSE] * 4)
+INPUT_TOKEN_LATENCY = 0.05
+
+
+def run(iterations: int = 10, **_) -> dict:
+    turns = iterations * 4
+    results = {}
+    for enabled in (False, True):
+        llm = FakeChatModel(response=RESPONSE, input_token_latency=INPUT_TOKEN_LATENCY, prompt_cache=True)
+        graph = GraphBuilder(llm).build_graph(InMemorySaver())
+        streamer = ResponseStreamer(graph, StateManager(graph))
+        user = benchmark_user(1)
+
+        with override_settings(CHATBOT_PROMPT_CACHING=enabled):
+            timings = [time_stream(streamer.stream_response(f"Question {turn}", user)) for turn in range(turns)]
+
+        counters = llm.counters
+        results["enabled" if enabled else "disabled"] = {
+            "turns": turns,
+            "ttft_last_quarter": summarize_ms([t.ttft for t in timings[-turns // 4 :]]),
+            "domain": _cost(counters, "domain"),
+            "safety": _cost(counters, "safety"),
+        }
+
+    disabled, enabled = results["disabled"]["domain"], results["enabled"]["domain"]
+    results["domain_input_cost_saved_pct"] = round((1 - enabled["input_cost"] / disabled["input_cost"]) * 100, 1)
+    return results
+
+
+def _cost(counters, kind: str) -> dict:
+    input_tokens = counters[f"{kind}_input_tokens"]
+    cache_read = counters[f"{kind}_cache_read_tokens"]
+    cache_write = counters[f"{kind}_cache_write_tokens"]
+    uncached = input_tokens - cache_read - cache_write
+    return {
+        "input_tokens": input_tokens,
+        "cache_read_tokens": cache_read,
+        "cache_write_tokens": cache_write,
+        "input_cost": round(uncached + cache_read * CACHE_READ_COST + cache_write * CACHE_WRITE_COST),
+        "input_tokens_saved": round(input_tokens_saved(cache_read, cache_write)),
+    }
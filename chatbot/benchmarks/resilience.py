@@ -0,0 +1,152 @@
+"""Safety check tail latency and failures against a flaky model, with and without the resilience layer.
+
+The scripted safety model answers in about ``SAFETY_LATENCY`` seconds, but
+``SPIKE_RATE`` of its calls take ``SPIKE`` seconds longer and ``ERROR_RATE`` of
+them fail. ``CONCURRENCY`` messages are checked at once by the streaming safety
+agent, ``CHECKS`` per iteration, under each policy in ``POLICIES``: none, a
+deadline, and a deadline with hedging. Reported are the safety phase, the
+checks that reached no verdict and fell to the failure policy, and the model
+calls sent per check.
+
+The outage run then makes every call hang for ``SPIKE`` seconds for
+``OUTAGE_CHECKS`` checks before the model recovers, with the deadline alone and
+with the circuit breaker: the safety phase during the outage, the calls still
+sent to the failing model, and, with a message checked every
+``RECOVERY_INTERVAL`` seconds after recovery, the time until one reaches a
+verdict again.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test.utils import override_settings
+from langchain_core.messages import HumanMessage
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import summarize_ms
+from chatbot.models import SafetyEvent
+from chatbot.services.agents.safety_agent import safety_agent
+from chatbot.services.resilience import CircuitBreaker, Resilience
+
+SAFETY_LATENCY = 0.1
+SAFETY_TOKEN_INTERVAL = 0.005
+SPIKE = 2.0
+SPIKE_RATE = 0.02
+ERROR_RATE = 0.01
+DEADLINE = 1.0
+
+CONCURRENCY = 16
+CHECKS = 50
+OUTAGE_CHECKS = 100
+RESET_TIMEOUT = 0.5
+RECOVERY_INTERVAL = 0.05
+SEED = 7
+
+MESSAGE = "What is LangGraph?"
+CONFIG = {"configurable": {"thread_id": "benchmark"}}
+
+POLICIES = {
+    "none": lambda: None,
+    "deadline": lambda: Resilience("safety", deadline=DEADLINE),
+    "deadline_hedged": lambda: Resilience("safety", deadline=DEADLINE, hedge=True),
+}
+
+OUTAGE_POLICIES = {
+    "deadline": lambda: Resilience("safety", deadline=DEADLINE),
+    "deadline_breaker": lambda: Resilience(
+        "safety", deadline=DEADLINE, breaker=CircuitBreaker("safety", failure_threshold=5, reset_timeout=RESET_TIMEOUT)
+    ),
+}
+
+SETTINGS = {
+    "CHATBOT_SAFETY_STREAMING": True,
+    "CHATBOT_SAFETY_REASONING": False,
+    "CHATBOT_SAFETY_FAILURE_POLICY": "closed",
+}
+
+
+class _EventLog:
+    """Collects the source of every verdict the safety agent records."""
+
+    def __init__(self):
+        self.sources = []
+
+    def record(self, user_id, thread_id, verdict, source, latency_ms=None):
+        self.sources.append(source)
+
+    def unchecked(self) -> int:
+        return self.sources.count(SafetyEvent.SOURCE_UNAVAILABLE)
+
+
+def run(iterations: int = 10, **_) -> dict:
+    # Every injected failure would otherwise be logged as an error
+    logger = logging.getLogger("chatbot")
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        with override_settings(**SETTINGS):
+            return _run(iterations)
+    finally:
+        logger.setLevel(level)
+
+
+def _run(iterations: int) -> dict:
+    results = {"flaky_model": {}, "outage": {}}
+    for name, policy in POLICIES.items():
+        llm = _model(latency_spike_rate=SPIKE_RATE, error_rate=ERROR_RATE)
+        events = _EventLog()
+        samples = _check(llm, policy(), events, iterations * CHECKS)
+        results["flaky_model"][name] = {
+            "safety_phase": summarize_ms(samples),
+            "unchecked": events.unchecked(),
+            "model_calls_per_check": round(llm.counters["safety_calls"] / len(samples), 3),
+        }
+
+    for name, policy in OUTAGE_POLICIES.items():
+        llm = _model(latency_spike_rate=1.0)
+        resilience = policy()
+        outage = _check(llm, resilience, _EventLog(), OUTAGE_CHECKS)
+        outage_calls = llm.counters["safety_calls"]
+        llm.latency_spike_rate = 0.0
+        results["outage"][name] = {
+            "safety_phase": summarize_ms(outage),
+            "model_calls": outage_calls,
+            "recovery_ms": round(_recovery(llm, resilience) * 1000, 2),
+        }
+    return results
+
+
+def _model(**faults) -> FakeChatModel:
+    return FakeChatModel(
+        safety_latency=SAFETY_LATENCY,
+        safety_token_interval=SAFETY_TOKEN_INTERVAL,
+        latency_spike=SPIKE,
+        seed=SEED,
+        **faults,
+    )
+
+
+def _recovery(llm, resilience) -> float:
+    """Seconds until a message checked every ``RECOVERY_INTERVAL`` reaches a verdict again."""
+    events = _EventLog()
+    state = {"messages": [HumanMessage(content=MESSAGE)]}
+    start = time.perf_counter()
+    while True:
+        safety_agent(state, llm, config=CONFIG, event_writer=events, resilience=resilience)
+        if events.sources[-1] != SafetyEvent.SOURCE_UNAVAILABLE:
+            return time.perf_counter() - start
+        time.sleep(RECOVERY_INTERVAL)
+
+
+def _check(llm, resilience, events: _EventLog, checks: int) -> list[float]:
+    """Safety phase of ``checks`` messages checked ``CONCURRENCY`` at a time, in seconds."""
+    state = {"messages": [HumanMessage(content=MESSAGE)]}
+
+    def check(_):
+        start = time.perf_counter()
+        safety_agent(state, llm, config=CONFIG, event_writer=events, resilience=resilience)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        return list(pool.map(check, range(checks)))
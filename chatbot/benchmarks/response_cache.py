@@ -0,0 +1,136 @@
+"""First-turn questions answered by the model vs. from the response cache.
+
+Every turn is the first message of a fresh thread. A round asks ``QUESTIONS``,
+then, once they are answered, the same questions re-cased and re-punctuated
+(``repeat``), with a word added or swapped (``paraphrase``), with one word
+changing their meaning (``different``) and with a jailbreak marker the safety
+check rejects (``rejected``); each group is sent concurrently, against a cache
+emptied between rounds. Modes are no cache, exact matches only, exact and
+near-duplicate matches, and the latter with speculative execution. Reported
+are the hit rate and hits per group (hits on ``different`` are false hits),
+time to first chunk and total time of hits and misses, the mean gap between
+chunks of each, which the replay keeps at the live cadence, domain model calls
+per turn and the chunks streamed to rejected messages, which must be none.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import mean
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_cache import ResponseCache
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+SAFETY_LATENCY = 0.05
+FIRST_TOKEN_LATENCY = 0.25
+TOKEN_INTERVAL = 0.005
+
+QUESTIONS = (
+    "How do I reset my password if I no longer have access to my email?",
+    "How do I enable two-factor authentication on my account?",
+    "Can you explain how checkpoints work in LangGraph?",
+    "What happens to my conversation history when I clear the chat?",
+)
+GROUPS = {
+    "repeat": (
+        "how do I reset my password if I no longer have access to my email",
+        "How do I enable two-factor authentication on my account",
+        "can you explain how checkpoints work in langgraph?!",
+        "What happens to my conversation history when I clear the chat ?",
+    ),
+    "paraphrase": (
+        "How do I reset my password if I no longer have access to my email account?",
+        "How can I enable two-factor authentication on my account?",
+        "Can you please explain how checkpoints work in LangGraph?",
+        "What happens to all my conversation history when I clear the chat?",
+    ),
+    "different": (
+        "How do I reset my username if I no longer have access to my email?",
+        "How do I disable two-factor authentication on my account?",
+        "Can you explain how threads work in LangGraph?",
+        "What happens to my conversation history when I delete my account?",
+    ),
+    "rejected": tuple(f"jailbreak: {question}" for question in QUESTIONS),
+}
+
+MODES = {
+    "off": {"cache": False},
+    "exact": {"cache": True, "threshold": None},
+    "near": {"cache": True, "threshold": 0.8},
+    "near_speculative": {"cache": True, "threshold": 0.8, "speculative": True},
+}
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for name, mode in MODES.items():
+        llm = FakeChatModel(
+            safety_latency=SAFETY_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, token_interval=TOKEN_INTERVAL
+        )
+        hits, misses, rejected = [], [], []
+        group_hits = dict.fromkeys(GROUPS, 0)
+        user_ids = iter(range(1_000_000))
+
+        for _ in range(iterations):
+            cache = ResponseCache(threshold=mode.get("threshold")) if mode["cache"] else None
+            speculative = mode.get("speculative", False)
+            graph = GraphBuilder(llm, speculative=speculative, response_cache=cache).build_graph(InMemorySaver())
+            state_manager = StateManager(graph)
+            streamer = ResponseStreamer(graph, state_manager, speculative=speculative)
+
+            misses += _ask(streamer, state_manager, QUESTIONS, user_ids)
+            for group, questions in GROUPS.items():
+                turns = _ask(streamer, state_manager, questions, user_ids)
+                if group == "rejected":
+                    rejected += turns
+                    continue
+                group_hits[group] += sum(turn["cached"] for turn in turns)
+                hits += [turn for turn in turns if turn["cached"]]
+                misses += [turn for turn in turns if not turn["cached"]]
+
+        answered = len(hits) + len(misses)
+        results[name] = {
+            "hit_rate": round(len(hits) / answered, 3),
+            "hits_per_group": {group: hits / iterations for group, hits in group_hits.items() if group != "rejected"},
+            "hit_ttft": summarize_ms([turn["ttft"] for turn in hits]) if hits else None,
+            "miss_ttft": summarize_ms([turn["ttft"] for turn in misses]),
+            "hit_total": summarize_ms([turn["total"] for turn in hits]) if hits else None,
+            "miss_total": summarize_ms([turn["total"] for turn in misses]),
+            "hit_chunk_gap_ms": _mean_gap_ms(hits),
+            "miss_chunk_gap_ms": _mean_gap_ms(misses),
+            "domain_calls_per_turn": round(llm.counters["domain_calls"] / (answered + len(rejected)), 3),
+            "chunks_streamed_to_rejected": sum(turn["chunks"] for turn in rejected),
+        }
+    return results
+
+
+def _ask(streamer: ResponseStreamer, state_manager: StateManager, questions, user_ids) -> list[dict]:
+    """Send each question on a new thread, concurrently, and time the turns."""
+    users = [benchmark_user(next(user_ids)) for _ in questions]
+    with ThreadPoolExecutor(max_workers=len(questions)) as pool:
+        return list(pool.map(lambda question, user: _turn(streamer, state_manager, question, user), questions, users))
+
+
+def _turn(streamer: ResponseStreamer, state_manager: StateManager, question: str, user) -> dict:
+    start = time.perf_counter()
+    arrivals = [time.perf_counter() for _ in streamer.stream_response(question, user)]
+    total = time.perf_counter() - start
+
+    answer = state_manager.get_conversation_history(user)[-1]
+    return {
+        "ttft": (arrivals[0] if arrivals else start + total) - start,
+        "total": total,
+        "gaps": [later - earlier for earlier, later in zip(arrivals, arrivals[1:])],
+        "chunks": len(arrivals),
+        "cached": answer.type == "ai" and bool(answer.response_metadata.get("cached")),
+    }
+
+
+def _mean_gap_ms(turns: list[dict]):
+    gaps = [gap for turn in turns for gap in turn["gaps"]]
+    return round(mean(gaps) * 1000, 2) if gaps else None
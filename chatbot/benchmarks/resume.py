@@ -0,0 +1,116 @@
+"""A client connection dropping mid-response, retried vs. resumed with ``Last-Event-ID``.
+
+Each turn is streamed through the SSE framing until ``DROP_AFTER`` chunks have
+arrived, when the connection drops, and the client reconnects
+``RECONNECT_DELAY`` seconds later. Retrying sends the message again, so the graph
+answers it a second time; resuming replays the chunks produced in the meantime
+from the turn's buffer and follows the rest of the generation. Reported are the
+LLM calls and output tokens per turn, the time until the client holds the whole
+response, whether the text it assembled is the response stored in the thread,
+and how many turns can still be resumed once the grace period has passed.
+"""
+
+import json
+import time
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+from chatbot.services import sse
+from chatbot.services.admission import ReplayUnavailable, StreamHub
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+MESSAGE = "What is LangGraph?"
+DROP_AFTER = 10
+RECONNECT_DELAY = 0.2
+RESUME_GRACE = 0.1
+
+SAFETY_LATENCY = 0.05
+FIRST_TOKEN_LATENCY = 0.1
+TOKEN_INTERVAL = 0.01
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for mode in ("retry", "resume"):
+        llm = FakeChatModel(
+            safety_latency=SAFETY_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, token_interval=TOKEN_INTERVAL
+        )
+        graph = GraphBuilder(llm).build_graph(InMemorySaver())
+        state_manager = StateManager(graph)
+        streamer = ResponseStreamer(graph, state_manager)
+        hub = StreamHub(dedupe=False, resumable=True, resume_grace=RESUME_GRACE)
+
+        durations, intact, turn_ids = [], 0, []
+        for turn in range(iterations):
+            user = benchmark_user(turn)
+            start = time.perf_counter()
+            if mode == "retry":
+                text = _retry(streamer, user)
+            else:
+                text, turn_id = _resume(streamer, hub, user)
+                turn_ids.append(turn_id)
+            durations.append(time.perf_counter() - start)
+            intact += text == state_manager.get_conversation_history(user)[-1].text()
+
+        time.sleep(RESUME_GRACE * 2)
+        counters = llm.counters
+        results[mode] = {
+            "llm_calls_per_turn": (counters["safety_calls"] + counters["domain_calls"]) / iterations,
+            "output_tokens_per_turn": counters["domain_tokens"] / iterations,
+            "complete_response": summarize_ms(durations),
+            "intact_responses": intact,
+            "resumable_after_grace": sum(
+                _resumable(hub, benchmark_user(turn).id, turn_id) for turn, turn_id in enumerate(turn_ids)
+            ),
+        }
+    return results
+
+
+def _retry(streamer: ResponseStreamer, user) -> str:
+    """Drop the connection, then send the message again."""
+    events = sse.event_stream(streamer.stream_response(MESSAGE, user))
+    _read(events, DROP_AFTER)
+    events.close()
+    time.sleep(RECONNECT_DELAY)
+    text, _ = _read(sse.event_stream(streamer.stream_response(MESSAGE, user)))
+    return text
+
+
+def _resume(streamer: ResponseStreamer, hub: StreamHub, user) -> tuple[str, str]:
+    """Drop the connection, then reconnect with the ID of the last event received."""
+    shared = hub.open(user.id, MESSAGE, lambda shared: streamer.stream_response(MESSAGE, user, shared.timings))
+    events = sse.event_stream(shared.follow(), turn_id=shared.turn_id)
+    received, last_event_id = _read(events, DROP_AFTER)
+    events.close()
+    time.sleep(RECONNECT_DELAY)
+    turn_id, sent = sse.parse_event_id(last_event_id)
+    resumed = hub.resume(user.id, turn_id, sent)
+    text, _ = _read(sse.event_stream(resumed.follow(start=sent), turn_id=turn_id, start=sent))
+    return received + text, turn_id
+
+
+def _read(events, chunks: int = None) -> tuple[str, str]:
+    """Text of the chunk events read, up to ``chunks`` of them, and the last event ID."""
+    text, last_event_id, read = "", None, 0
+    for event in events:
+        for line in event.splitlines():
+            if line.startswith("id: "):
+                last_event_id = line[4:]
+            elif line.startswith("data: "):
+                text += json.loads(line[6:]).get("chunk", "")
+        read += sse.CHUNK_PREFIX in event
+        if read == chunks:
+            break
+    return text, last_event_id
+
+
+def _resumable(hub: StreamHub, user_id, turn_id: str) -> bool:
+    try:
+        hub.resume(user_id, turn_id, 0)
+    except ReplayUnavailable:
+        return False
+    return True
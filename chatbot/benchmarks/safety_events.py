@@ -0,0 +1,114 @@
+"""Safety event log: cost on the request path and report latency over a large table.
+
+The request path cost of queueing an event for the background writer is compared
+with inserting it synchronously. The log is then filled with events spread over
+``DAYS`` days and many users, and the report is timed grouped by violation type
+and by user, with and without the composite indexes, and against the obvious
+query that truncates ``created_at`` per row in SQL.
+"""
+
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from chatbot.benchmarks.harness import test_databases
+from chatbot.models import SafetyEvent
+from chatbot.services.safety_events import SafetyEventWriter, safety_event, safety_event_report
+from chatbot.services.verdicts import SafetyVerdict
+
+DAYS = 30
+USERS = 1000
+INSERT_BATCH = 5000
+HOT_PATH_EVENTS = 2000
+REPORT_RUNS = 3
+
+VERDICTS = [SafetyVerdict("APPROVE")] * 90 + [
+    SafetyVerdict("REJECT", "JAILBREAK", "Tries to override instructions."),
+    SafetyVerdict("REJECT", "HARMFUL", "Asks for harmful instructions."),
+] * 5
+
+
+def run(iterations: int = 10, **_) -> dict:
+    events = iterations * 50_000
+    with tempfile.TemporaryDirectory() as tmp, test_databases(tmp):
+        results = {"hot_path": _hot_path_cost()}
+
+        start = time.perf_counter()
+        _fill(events)
+        results["fill"] = {"events": events, "events_per_s": round(events / (time.perf_counter() - start))}
+
+        results["report_indexed"] = _report_times()
+        for index in SafetyEvent._meta.indexes:
+            with connection.schema_editor() as editor:
+                editor.remove_index(SafetyEvent, index)
+        results["report_unindexed"] = _report_times()
+    return results
+
+
+def _hot_path_cost() -> dict:
+    """Request path microseconds per event: queued for the writer vs. inserted synchronously."""
+    writer = SafetyEventWriter(batch_size=500, flush_interval=0.05)
+    verdict = VERDICTS[-1]
+
+    start = time.perf_counter()
+    for i in range(HOT_PATH_EVENTS):
+        writer.record(None, f"user_{i}", verdict, "llm", 1.0)
+    queued = time.perf_counter() - start
+    writer.flush()
+
+    start = time.perf_counter()
+    for i in range(HOT_PATH_EVENTS):
+        safety_event(None, f"user_{i}", verdict, "llm", 1.0, timezone.now()).save()
+    synchronous = time.perf_counter() - start
+
+    SafetyEvent.objects.all().delete()
+    return {
+        "queued_us": round(queued / HOT_PATH_EVENTS * 1e6, 2),
+        "synchronous_insert_us": round(synchronous / HOT_PATH_EVENTS * 1e6, 2),
+        "writer": writer.stats(),
+    }
+
+
+def _fill(events: int):
+    rng = random.Random(0)
+    now = timezone.now()
+    for offset in range(0, events, INSERT_BATCH):
+        batch = []
+        for _ in range(min(INSERT_BATCH, events - offset)):
+            user_id = rng.randrange(USERS)
+            created_at = now - timedelta(seconds=rng.randrange(DAYS * 86400))
+            batch.append(safety_event(user_id, f"user_{user_id}", rng.choice(VERDICTS), "llm", 1.0, created_at))
+        SafetyEvent.objects.bulk_create(batch)
+
+
+def _report_times() -> dict:
+    since = timezone.now() - timedelta(days=7)
+    user_id = 7
+    reports = {
+        "by_type_ms": lambda: safety_event_report(since, bucket="day", group="violation_type"),
+        "by_user_ms": lambda: safety_event_report(since, bucket="week", group="user"),
+        "one_user_ms": lambda: safety_event_report(since, bucket="day", user_id=user_id),
+        "by_type_trunc_created_at_ms": lambda: list(
+            SafetyEvent.objects.filter(created_at__gte=since)
+            .annotate(truncated=TruncDay("created_at"))
+            .values_list("truncated", "violation_type")
+            .annotate(count=Count("*"))
+            .order_by()
+        ),
+    }
+    return {name: _best_of(report) for name, report in reports.items()}
+
+
+def _best_of(report) -> float:
+    times = []
+    for _ in range(REPORT_RUNS):
+        start = time.perf_counter()
+        report()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 1)
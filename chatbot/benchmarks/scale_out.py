@@ -0,0 +1,127 @@
+"""Several worker processes sharing conversations through the Django checkpoint backend.
+
+``WORKERS`` processes, each with its own ``ChatbotService`` as under gunicorn,
+store checkpoints in one SQLite database through ``DjangoCheckpointSaver`` and
+send turns round-robin to ``USERS`` conversations, so every conversation gets
+concurrent requests from different processes. Afterwards each conversation is
+read back and checked: every message sent must be there exactly once, user and
+assistant messages must alternate, and the message index must agree with the
+checkpoint. This is run with and without per-thread leases.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+import django
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms, test_databases
+
+WORKERS = 4
+USERS = 2
+SAFETY_LATENCY = 0.02
+FIRST_TOKEN_LATENCY = 0.05
+TOKEN_INTERVAL = 0.002
+
+
+def run(iterations: int = 10, **_) -> dict:
+    from django.db import connection
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, test_databases(tmp):
+        db_path = connection.settings_dict["NAME"]
+        for offset, locks in enumerate((False, True)):
+            user_ids = [offset * 1000 + user for user in range(USERS)]
+            samples = _run_workers(db_path, locks, user_ids, iterations)
+            start = min(sample["start"] for sample in samples)
+            end = max(sample["end"] for sample in samples)
+            turns = WORKERS * iterations
+            results["thread_locks" if locks else "no_locks"] = {
+                "turns": turns,
+                "turns_per_s": round(turns / (end - start), 2),
+                "ttft": summarize_ms([ttft for sample in samples for ttft in sample["ttft"]]),
+                "errors": sum(sample["errors"] for sample in samples),
+                **_check_threads(user_ids, [sample["sent"] for sample in samples]),
+            }
+    return results
+
+
+def _run_workers(db_path: str, locks: bool, user_ids: list, turns: int) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(WORKERS)
+    queue = context.Queue()
+    workers = [
+        context.Process(target=_worker, args=(db_path, locks, index, user_ids, turns, barrier, queue))
+        for index in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    samples = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return samples
+
+
+def _worker(db_path: str, locks: bool, index: int, user_ids: list, turns: int, barrier, queue):
+    django.setup()
+    logging.getLogger("chatbot").setLevel(logging.CRITICAL)
+
+    from django.conf import settings
+
+    settings.DATABASES["default"]["NAME"] = db_path
+    settings.DATABASES["default"]["OPTIONS"] = {"transaction_mode": "IMMEDIATE", "timeout": 30}
+    settings.CHATBOT_CHECKPOINT_BACKEND = "django"
+    settings.CHATBOT_THREAD_LOCKS = locks
+    settings.CHATBOT_SAFETY_EVENTS = False
+    settings.CHATBOT_SAFETY_PREFILTER = False
+    settings.CHATBOT_SAFETY_CACHE_BACKEND = None
+
+    from chatbot.services.chatbot_service import ChatbotService
+
+    llm = FakeChatModel(
+        safety_latency=SAFETY_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, token_interval=TOKEN_INTERVAL
+    )
+    chatbot = ChatbotService(llm=llm)
+
+    sample = {"ttft": [], "errors": 0, "sent": {}}
+    barrier.wait()
+    sample["start"] = time.time()
+    for turn in range(turns):
+        user_id = user_ids[(turn + index) % len(user_ids)]
+        message = f"Question {turn} from worker {os.getpid()}"
+        start = time.perf_counter()
+        first = None
+        for text in chatbot.stream_response(message, benchmark_user(user_id)):
+            first = first or time.perf_counter()
+            sample["errors"] += text.startswith("Error:")
+        sample["ttft"].append((first or time.perf_counter()) - start)
+        sample["sent"].setdefault(user_id, []).append(message)
+    sample["end"] = time.time()
+    queue.put(sample)
+
+
+def _check_threads(user_ids: list, sent: list[dict]) -> dict:
+    """Compare what each conversation holds with what was sent to it."""
+    from chatbot.models import ConversationMessage
+    from chatbot.services.checkpoint_storage import DjangoCheckpointSaver
+    from chatbot.services.graph_builder import GraphBuilder
+    from chatbot.services.state_manager import StateManager
+
+    state_manager = StateManager(GraphBuilder(FakeChatModel()).build_graph(DjangoCheckpointSaver.from_settings()))
+    lost = out_of_order = index_mismatches = 0
+    for user_id in user_ids:
+        user = benchmark_user(user_id)
+        messages = state_manager.get_conversation_history(user)
+        expected = [message for worker in sent for message in worker.get(user_id, [])]
+        received = [message.text() for message in messages if message.type == "human"]
+        lost += len(set(expected) - set(received))
+        out_of_order += sum(
+            message.type == ("human" if position % 2 else "ai") for position, message in enumerate(messages)
+        )
+        indexed = ConversationMessage.objects.filter(thread_id=state_manager.get_thread_id(user)).count()
+        # A thread nobody paged through is not indexed yet; it is rebuilt on first read
+        index_mismatches += indexed not in (0, len(messages))
+    return {"lost_messages": lost, "out_of_order_messages": out_of_order, "index_mismatches": index_mismatches}
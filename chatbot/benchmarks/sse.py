@@ -0,0 +1,99 @@
+"""Events, bytes on the wire and server CPU per streamed response.
+
+Compares one event per model chunk framed with ``json.dumps`` (the original
+wire format) against the precomputed framing, chunk coalescing and gzip. The
+model streams a long answer word by word at a steady rate. CPU is process time
+per response, which includes the graph run, so the framing stage is also timed
+on its own by replaying the chunks a response produced.
+"""
+
+import json
+import time
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.benchmarks.fake_llm import DEFAULT_RESPONSE, FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user
+from chatbot.services import sse
+from chatbot.services.graph_builder import GraphBuilder
+from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.state_manager import StateManager
+
+RESPONSE = " ".join([DEFAULT_RESPONSE] * 4)
+TOKEN_INTERVAL = 0.002
+FLUSH_CHARS = 512
+FLUSH_INTERVAL = 0.05
+REPLAYS = 200
+
+# name: (coalesce, framing, gzip)
+MODES = {
+    "per_chunk_json_dumps": (False, "json", False),
+    "per_chunk": (False, "sse", False),
+    "per_chunk_gzip": (False, "sse", True),
+    "coalesced": (True, "sse", False),
+    "coalesced_gzip": (True, "sse", True),
+}
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    for name, (coalesce, framing, gzip) in MODES.items():
+        graph = GraphBuilder(FakeChatModel(response=RESPONSE, token_interval=TOKEN_INTERVAL)).build_graph(
+            InMemorySaver()
+        )
+        streamer = ResponseStreamer(
+            graph,
+            StateManager(graph),
+            flush_chars=FLUSH_CHARS if coalesce else 0,
+            flush_interval=FLUSH_INTERVAL if coalesce else 0.0,
+        )
+
+        events = wire_bytes = cpu = 0
+        chunks = []
+        for i in range(iterations):
+            chunks = []
+            start = time.process_time()
+            for data in _wire(
+                _recorded(streamer.stream_response("What is LangGraph?", benchmark_user(i)), chunks), framing, gzip
+            ):
+                wire_bytes += len(data)
+            cpu += time.process_time() - start
+            events += len(chunks) + 1
+
+        results[name] = {
+            "events_per_response": round(events / iterations, 1),
+            "bytes_per_response": round(wire_bytes / iterations),
+            "cpu_ms_per_response": round(cpu / iterations * 1000, 2),
+            "framing_cpu_us_per_response": round(_framing_cost(chunks, framing, gzip) * 1e6, 1),
+        }
+    return results
+
+
+def _recorded(chunks, into: list):
+    for chunk in chunks:
+        into.append(chunk)
+        yield chunk
+
+
+def _wire(chunks, framing: str, gzip: bool):
+    """The response body as sent: framed events, gzipped when enabled."""
+    if framing == "json":
+        events = _json_dumps_events(chunks)
+    else:
+        events = sse.event_stream(chunks)
+    return sse.gzip_stream(events) if gzip else (event.encode() for event in events)
+
+
+def _json_dumps_events(chunks):
+    for chunk in chunks:
+        yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+    yield f"data: {json.dumps({'complete': True})}\n\n"
+
+
+def _framing_cost(chunks, framing: str, gzip: bool) -> float:
+    """CPU seconds to frame (and compress) one response's chunks."""
+    start = time.process_time()
+    for _ in range(REPLAYS):
+        for _data in _wire(iter(chunks), framing, gzip):
+            pass
+    return (time.process_time() - start) / REPLAYS
@@ -0,0 +1,92 @@
+"""First-request latency on a cold worker vs. one warmed up at startup.
+
+Every sample runs in a fresh process, so nothing is shared between samples.
+The cold path times building the model client and the ``ChatbotService`` and
+then the first turn. The warm path runs ``ChatbotService.warm_up`` first and
+times only the first turn. The model answers instantly, so the numbers cover
+only the startup work. The optional provider ping cannot be measured offline.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+
+from chatbot.benchmarks.fake_llm import FakeChatModel
+from chatbot.benchmarks.harness import benchmark_user, summarize_ms
+
+
+def run(iterations: int = 10, **_) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(tmp,),
+            max_tasks_per_child=1,
+        ) as pool:
+            for mode in ("cold", "warm"):
+                samples = [pool.submit(_first_request, mode).result() for _ in range(iterations)]
+                results[mode] = {phase: summarize_ms([sample[phase] for sample in samples]) for phase in samples[0]}
+
+    results["first_request_gain_p50_ms"] = round(
+        results["cold"]["first_request"]["p50_ms"] - results["warm"]["first_request"]["p50_ms"], 2
+    )
+    return results
+
+
+def _init_worker(tmp: str):
+    # The model client is only constructed, never called
+    os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+    django.setup()
+    logging.getLogger("chatbot").setLevel(logging.ERROR)
+
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.ANTHROPIC_API_KEY = os.environ["ANTHROPIC_API_KEY"]
+    settings.CHATBOT_CHECKPOINT_PATH = str(Path(tmp) / f"checkpoints-{os.getpid()}.sqlite")
+    settings.DATABASES["default"]["NAME"] = ":memory:"
+    call_command("migrate", verbosity=0)
+
+
+def _first_request(mode: str) -> dict:
+    from chatbot.services.chatbot_service import ChatbotService
+    from chatbot.services.graph_builder import LLMFactory
+
+    timings = {}
+    start = time.perf_counter()
+    LLMFactory.create_llm()
+    timings["client_init"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chatbot = ChatbotService(llm=FakeChatModel())
+    timings["service_init"] = time.perf_counter() - start
+
+    if mode == "warm":
+        start = time.perf_counter()
+        chatbot.warm_up()
+        timings["warm_up"] = time.perf_counter() - start
+
+    user = benchmark_user(1)
+    start = time.perf_counter()
+    for _ in chatbot.stream_response("What is LangGraph?", user):
+        pass
+    timings["first_turn"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in chatbot.stream_response("And how are checkpoints stored?", user):
+        pass
+    timings["second_turn"] = time.perf_counter() - start
+
+    # What the first user waits for: everything not done ahead of time by warm-up
+    timings["first_request"] = timings["first_turn"]
+    if mode == "cold":
+        timings["first_request"] += timings["client_init"] + timings["service_init"]
+    return timings
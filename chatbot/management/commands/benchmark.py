@@ -0,0 +1,40 @@
+import json
+import logging
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.benchmarks import SCENARIOS
+from chatbot.benchmarks.harness import compare_to_baseline
+
+
+class Command(BaseCommand):
+    help = "Run an offline benchmark scenario against the fake LLM."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=sorted(SCENARIOS))
+        parser.add_argument("--iterations", type=int, default=10, help="Iterations per measured configuration")
+        parser.add_argument("--concurrency", type=int, default=200, help="Concurrent streams for load scenarios")
+        parser.add_argument("--output", help="Also write the results as JSON to this path")
+        parser.add_argument("--baseline", help="Fail if results regress against this earlier --output file")
+        parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change allowed against the baseline")
+
+    def handle(self, *args, **options):
+        # Per-message agent logging would dominate the output and the timings
+        logging.getLogger("chatbot").setLevel(logging.ERROR)
+
+        scenario = import_module(SCENARIOS[options["scenario"]])
+        results = scenario.run(iterations=options["iterations"], concurrency=options["concurrency"])
+
+        report = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report + "\n")
+        self.stdout.write(report)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                regressions = compare_to_baseline(results, json.load(f), options["tolerance"])
+            if regressions:
+                raise CommandError("Regressed against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
@@ -0,0 +1,54 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.services.checkpoint_compaction import CheckpointCompactor
+from chatbot.services.checkpoint_storage import PooledSqliteSaver
+from chatbot.services.message_index import MessageIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Trim old checkpoints, delete cleared or idle threads and vacuum the checkpoint database, "
+        "converting it to incremental auto-vacuum on first use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, help="Checkpoints to keep per thread (CHATBOT_CHECKPOINT_KEEP_LATEST)")
+        parser.add_argument(
+            "--idle-ttl", type=int, help="Delete threads idle for this many seconds (CHATBOT_CHECKPOINT_IDLE_TTL)"
+        )
+        parser.add_argument(
+            "--vacuum-pages", type=int, help="Free pages to release per run (CHATBOT_CHECKPOINT_VACUUM_PAGES)"
+        )
+        parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+
+    def handle(self, *args, **options):
+        if getattr(settings, "CHATBOT_CHECKPOINT_BACKEND", "sqlite") != "sqlite":
+            raise CommandError("Compaction only applies to the sqlite checkpoint backend")
+        saver = PooledSqliteSaver.from_settings()
+        compactor = CheckpointCompactor.from_settings(saver, on_thread_deleted=MessageIndex().clear, full_vacuum=True)
+        if options["keep"] is not None:
+            compactor.keep_latest = options["keep"]
+        if options["idle_ttl"] is not None:
+            compactor.idle_ttl = options["idle_ttl"]
+        if options["vacuum_pages"] is not None:
+            compactor.vacuum_pages = options["vacuum_pages"]
+
+        try:
+            report = compactor.compact()
+        finally:
+            saver.close()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {report.threads_deleted} threads, {report.checkpoints_deleted} checkpoints and "
+                f"{report.writes_deleted} writes; reclaimed {report.bytes_reclaimed} bytes "
+                f"({report.bytes_before} -> {report.bytes_after})"
+            )
+        )
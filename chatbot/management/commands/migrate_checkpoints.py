@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.services.checkpoint_serde import (
+    CheckpointMigrator,
+    CompactSerializer,
+    CompressionDictionary,
+    DictionaryStore,
+    get_checkpoint_serde,
+)
+from chatbot.services.checkpoint_storage import PooledSqliteSaver, get_checkpointer
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite stored checkpoints with the configured serializer (CHATBOT_CHECKPOINT_SERIALIZER), "
+        "optionally training a new compression dictionary on them first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--train",
+            action="store_true",
+            help="Train a compression dictionary on the stored checkpoints into CHATBOT_CHECKPOINT_DICTIONARY_DIR",
+        )
+        parser.add_argument("--samples", type=int, default=2000, help="Blobs to train the dictionary on")
+        parser.add_argument("--dictionary-size", type=int, default=64 * 1024, help="Dictionary size in bytes")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows rewritten per transaction")
+        parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+
+    def handle(self, *args, **options):
+        directory = getattr(settings, "CHATBOT_CHECKPOINT_DICTIONARY_DIR", None)
+        if options["train"] and not directory:
+            raise CommandError("Set CHATBOT_CHECKPOINT_DICTIONARY_DIR to train a dictionary")
+
+        saver = get_checkpointer()
+        try:
+            migrator = CheckpointMigrator(
+                saver, CompactSerializer.from_settings(), saver.serde, batch_size=options["batch_size"]
+            )
+            if options["train"]:
+                dictionary = self._train(migrator, options)
+                path = DictionaryStore(directory).save(dictionary)
+                self.stdout.write(f"Trained {dictionary.name} ({len(dictionary.data)} bytes) into {path}")
+                # Write with the new dictionary, if the configured serializer compresses at all
+                migrator.reader = CompactSerializer.from_settings()
+                migrator.writer = get_checkpoint_serde() or saver.serde
+            report = migrator.migrate()
+        finally:
+            if isinstance(saver, PooledSqliteSaver):
+                saver.close()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rewrote {report.checkpoints} checkpoints and {report.writes} writes; "
+                f"blobs {report.bytes_before} -> {report.bytes_after} bytes"
+            )
+        )
+
+    def _train(self, migrator: CheckpointMigrator, options) -> CompressionDictionary:
+        samples = migrator.samples(options["samples"])
+        if not samples:
+            raise CommandError("There are no stored checkpoints to train a dictionary on")
+        try:
+            return CompressionDictionary.train(
+                samples,
+                options["dictionary_size"],
+                level=getattr(settings, "CHATBOT_CHECKPOINT_COMPRESSION_LEVEL", 3),
+            )
+        except Exception as e:
+            raise CommandError(f"Could not train a dictionary on {len(samples)} blobs: {e}")
@@ -0,0 +1,69 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.models import ConversationMessage
+from chatbot.services.bulk_screening import BulkScreener
+
+
+class Command(BaseCommand):
+    help = "Screen stored user messages, or a JSONL file of messages, with the safety check in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="JSONL file to write results to; also the checkpoint a rerun resumes from")
+        parser.add_argument(
+            "--input", help='JSONL file of {"id", "text", "tenant"} records (default: stored user messages)'
+        )
+        parser.add_argument("--tenant", help="Tenant recorded for stored messages or input records without one")
+        parser.add_argument("--restart", action="store_true", help="Overwrite the output instead of resuming")
+        parser.add_argument(
+            "--batch-size", type=int, help="Messages per LLM request (CHATBOT_BULK_SCREENING_BATCH_SIZE)"
+        )
+        parser.add_argument("--workers", type=int, help="Concurrent LLM requests (CHATBOT_BULK_SCREENING_WORKERS)")
+        parser.add_argument(
+            "--requests-per-minute",
+            type=int,
+            help="LLM request rate limit, 0 for none (CHATBOT_BULK_SCREENING_REQUESTS_PER_MINUTE)",
+        )
+
+    def handle(self, *args, **options):
+        screener = BulkScreener.from_settings(
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            requests_per_minute=options["requests_per_minute"],
+        )
+
+        start = time.perf_counter()
+        counts = screener.screen_to_file(
+            self._records(options["input"], options["tenant"]), options["output"], resume=not options["restart"]
+        )
+        elapsed = time.perf_counter() - start
+
+        screened = sum(counts.values()) - counts["SKIPPED"]
+        rate = screened / elapsed * 60 if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Screened {screened} messages in {elapsed:.1f}s ({rate:.0f}/min): {counts['APPROVE']} approved, "
+                f"{counts['REJECT']} rejected, {counts['ERROR']} failed; {counts['SKIPPED']} already screened"
+            )
+        )
+        if counts["ERROR"]:
+            self.stdout.write(self.style.WARNING("Rerun the command to retry the failed messages."))
+
+    def _records(self, path, tenant):
+        if path is None:
+            messages = ConversationMessage.objects.filter(role=ConversationMessage.ROLE_USER).order_by("pk")
+            for pk, content in messages.values_list("pk", "content").iterator(chunk_size=2000):
+                yield {"id": str(pk), "text": content, "tenant": tenant}
+            return
+
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    yield {"id": str(record["id"]), "text": record["text"], "tenant": record.get("tenant") or tenant}
+                except (ValueError, KeyError, TypeError) as e:
+                    raise CommandError(f"{path}:{number}: expected a JSON object with id and text ({e})")
@@ -0,0 +1,30 @@
+# Generated by Django 6.1.2 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationMessage",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("thread_id", models.CharField(max_length=255)),
+                ("position", models.PositiveIntegerField()),
+                ("message_id", models.CharField(blank=True, max_length=255)),
+                ("role", models.CharField(choices=[("user", "User"), ("assistant", "Assistant")], max_length=16)),
+                ("content", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["thread_id", "position"],
+                "constraints": [
+                    models.UniqueConstraint(fields=("thread_id", "position"), name="unique_message_position")
+                ],
+            },
+        ),
+    ]
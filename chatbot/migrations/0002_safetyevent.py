@@ -0,0 +1,53 @@
+# Generated by Django 6.1.2 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SafetyEvent",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("thread_id", models.CharField(max_length=255)),
+                ("status", models.CharField(max_length=16)),
+                ("violation_type", models.CharField(max_length=32)),
+                ("reasoning", models.TextField(blank=True)),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[("llm", "LLM"), ("cached", "Cached"), ("prefilter", "Pre-filter")], max_length=16
+                    ),
+                ),
+                ("latency_ms", models.FloatField(null=True)),
+                ("prompt_hash", models.CharField(max_length=16)),
+                ("created_at", models.DateTimeField()),
+                ("hour", models.DateTimeField()),
+                ("day", models.DateField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["day", "violation_type"], name="safety_event_day_type"),
+                    models.Index(fields=["day", "user"], name="safety_event_day_user"),
+                    models.Index(fields=["user", "day"], name="safety_event_user_day"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.1.2 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0002_safetyevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThreadLease",
+            fields=[
+                ("thread_id", models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ("owner", models.CharField(max_length=64)),
+                ("expires_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="GraphCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("thread_id", models.CharField(max_length=255)),
+                ("checkpoint_ns", models.CharField(blank=True, default="", max_length=255)),
+                ("checkpoint_id", models.CharField(max_length=64)),
+                ("parent_checkpoint_id", models.CharField(max_length=64, null=True)),
+                ("type", models.CharField(max_length=32, null=True)),
+                ("checkpoint", models.BinaryField()),
+                ("metadata", models.BinaryField(null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("thread_id", "checkpoint_ns", "checkpoint_id"), name="unique_graph_checkpoint"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="GraphCheckpointWrite",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("thread_id", models.CharField(max_length=255)),
+                ("checkpoint_ns", models.CharField(blank=True, default="", max_length=255)),
+                ("checkpoint_id", models.CharField(max_length=64)),
+                ("task_id", models.CharField(max_length=64)),
+                ("idx", models.IntegerField()),
+                ("channel", models.CharField(max_length=255)),
+                ("type", models.CharField(max_length=32, null=True)),
+                ("value", models.BinaryField(null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"),
+                        name="unique_graph_checkpoint_write",
+                    )
+                ],
+            },
+        ),
+    ]
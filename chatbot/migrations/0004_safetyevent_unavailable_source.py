@@ -0,0 +1,25 @@
+# Generated by Django 6.1.2 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0003_graph_checkpoints"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="safetyevent",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("llm", "LLM"),
+                    ("cached", "Cached"),
+                    ("prefilter", "Pre-filter"),
+                    ("unavailable", "Model unavailable"),
+                ],
+                max_length=16,
+            ),
+        ),
+    ]
@@ -1 +1,149 @@
-# This file intentionally left empty - all models removed for LangGraph-only approach
+from django.conf import settings
+from django.db import models
+
+# Conversation state lives in the LangGraph checkpointer, a local SQLite file or,
+# with the "django" checkpoint backend, the checkpoint tables here. The other
+# models are a secondary index over it, per-thread leases serializing turns and
+# an append-only log of safety verdicts.
+
+
+class ConversationMessage(models.Model):
+    """Per-thread index of conversation messages used to page through history.
+
+    Rows are appended as turns are checkpointed, so the chat page and history
+    endpoint can read a page of messages without deserializing the thread's whole
+    checkpoint. The checkpoint remains the source of truth: a thread with no rows
+    is rebuilt from it on first read.
+    """
+
+    ROLE_USER = "user"
+    ROLE_ASSISTANT = "assistant"
+    ROLE_CHOICES = [(ROLE_USER, "User"), (ROLE_ASSISTANT, "Assistant")]
+
+    thread_id = models.CharField(max_length=255)
+    position = models.PositiveIntegerField()
+    message_id = models.CharField(max_length=255, blank=True)
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["thread_id", "position"]
+        constraints = [
+            models.UniqueConstraint(fields=["thread_id", "position"], name="unique_message_position"),
+        ]
+
+    def __str__(self):
+        return f"{self.thread_id}[{self.position}] {self.role}"
+
+
+class SafetyEvent(models.Model):
+    """Safety verdict for one checked user message, kept for compliance reporting.
+
+    Events are written in batches by a background writer (see
+    ``chatbot.services.safety_events``), never on the request path. ``hour`` is
+    the start of the UTC hour the event happened in, so reports group on a plain
+    indexed column and fold hours into days or weeks afterwards. The user is not a
+    database-level foreign key: events outlive deleted users, and batch inserts
+    skip the constraint check.
+    """
+
+    SOURCE_LLM = "llm"
+    SOURCE_CACHED = "cached"
+    SOURCE_PREFILTER = "prefilter"
+    # No verdict: the safety model failed or timed out and the failure policy decided
+    SOURCE_UNAVAILABLE = "unavailable"
+    SOURCE_CHOICES = [
+        (SOURCE_LLM, "LLM"),
+        (SOURCE_CACHED, "Cached"),
+        (SOURCE_PREFILTER, "Pre-filter"),
+        (SOURCE_UNAVAILABLE, "Model unavailable"),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    thread_id = models.CharField(max_length=255)
+    status = models.CharField(max_length=16)
+    violation_type = models.CharField(max_length=32)
+    reasoning = models.TextField(blank=True)
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES)
+    latency_ms = models.FloatField(null=True)
+    prompt_hash = models.CharField(max_length=16)
+    created_at = models.DateTimeField()
+    hour = models.DateTimeField()
+    day = models.DateField()
+
+    class Meta:
+        # Covering indexes for the day and week reports by violation type and by
+        # user, and for one user's events
+        indexes = [
+            models.Index(fields=["day", "violation_type"], name="safety_event_day_type"),
+            models.Index(fields=["day", "user"], name="safety_event_day_user"),
+            models.Index(fields=["user", "day"], name="safety_event_user_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.thread_id} {self.status} {self.violation_type}"
+
+
+class GraphCheckpoint(models.Model):
+    """LangGraph checkpoint stored by ``DjangoCheckpointSaver``; mirrors the SQLite saver's table."""
+
+    thread_id = models.CharField(max_length=255)
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default="")
+    checkpoint_id = models.CharField(max_length=64)
+    parent_checkpoint_id = models.CharField(max_length=64, null=True)
+    type = models.CharField(max_length=32, null=True)
+    checkpoint = models.BinaryField()
+    metadata = models.BinaryField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread_id", "checkpoint_ns", "checkpoint_id"], name="unique_graph_checkpoint"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.thread_id} {self.checkpoint_id}"
+
+
+class GraphCheckpointWrite(models.Model):
+    """Pending write of a graph task against a ``GraphCheckpoint``."""
+
+    thread_id = models.CharField(max_length=255)
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default="")
+    checkpoint_id = models.CharField(max_length=64)
+    task_id = models.CharField(max_length=64)
+    idx = models.IntegerField()
+    channel = models.CharField(max_length=255)
+    type = models.CharField(max_length=32, null=True)
+    value = models.BinaryField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"],
+                name="unique_graph_checkpoint_write",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.thread_id} {self.checkpoint_id} {self.task_id}[{self.idx}]"
+
+
+class ThreadLease(models.Model):
+    """Exclusive lease on a conversation thread held for the length of one turn.
+
+    Held by whichever worker process is running a turn on the thread, so a second
+    request for the same thread waits instead of interleaving with it. A lease
+    past ``expires_at`` was left behind by a crashed worker and may be taken over.
+    """
+
+    thread_id = models.CharField(max_length=255, primary_key=True)
+    owner = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.thread_id} until {self.expires_at}"
@@ -0,0 +1,597 @@
+"""Admission control, request coalescing and resumable turns for streamed chat responses.
+
+Every response a worker generates holds one of ``max_concurrent`` generation
+slots. A request arriving while all slots are taken waits in a bounded FIFO
+queue; when the queue is full, the wait times out or the user already has
+``max_per_user`` responses in flight or queued, it is rejected with
+``AdmissionRejected`` before any model call, and the view answers 429.
+
+An identical message from the same user arriving while the first is still being
+generated (a double submit or a retry) is not admitted again: it attaches to the
+response in flight and receives it from the start. Responses are therefore
+produced by a background thread, or task under ASGI, and published to every
+request attached to them, independently of any one client connection.
+
+The same decoupling makes turns resumable: each turn has an ID and numbered
+chunks kept in a bounded ring buffer, so a client whose connection dropped
+reconnects with ``Last-Event-ID``, receives the chunks it missed and keeps
+following the generation without the graph being invoked again. A turn stays
+available for ``resume_grace`` seconds after it is checkpointed. Limits, the
+coalescing index and turn buffers are per worker process, so a reconnect must
+reach the worker that produced the turn.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from itertools import islice
+from typing import Optional
+
+from chatbot.services.metrics import (
+    STREAM_BACKPRESSURE_WAIT,
+    STREAM_CANCELLATIONS,
+    STREAM_QUEUE_DEPTH,
+    STREAM_QUEUE_WAIT,
+    STREAM_REJECTIONS,
+    STREAM_RESUMES,
+    STREAMS_COALESCED,
+    STREAMS_IN_FLIGHT,
+)
+from chatbot.services.utils import normalize_message
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a stream request is not admitted; answered with 429 and ``Retry-After``."""
+
+    def __init__(self, reason: str, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ReplayUnavailable(Exception):
+    """Raised when a turn cannot be resumed: unknown, expired, or the chunks asked for are no longer buffered."""
+
+
+class _Waiter:
+    __slots__ = ("notify", "granted", "queued_at")
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.queued_at = time.perf_counter()
+
+
+class AdmissionController:
+    """Per-user and per-worker limits on concurrently generated responses.
+
+    Slots are handed to queued requests in arrival order as they are released, so
+    a request that waited is never overtaken by one that arrived later.
+    """
+
+    def __init__(self, max_per_user: int = 2, max_concurrent: int = 32, max_queue: int = 64, queue_timeout=10.0):
+        self.max_per_user = max_per_user
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._per_user = Counter()
+        self._waiters = deque()
+
+    def acquire(self, user_id):
+        """Take a generation slot for ``user_id``, waiting in the queue if needed."""
+        event = threading.Event()
+        waiter = self._reserve(user_id, event.set)
+        if waiter is not None and not event.wait(self.queue_timeout) and self._abandon(waiter, user_id):
+            self._reject("queue_timeout", "The server is busy, please try again shortly.")
+
+    async def aacquire(self, user_id):
+        """Async variant of ``acquire``; waits in the queue without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._reserve(user_id, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(event.wait(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter, user_id):
+                self._reject("queue_timeout", "The server is busy, please try again shortly.")
+        except asyncio.CancelledError:
+            # The client went away while queued; give back a slot granted meanwhile
+            if not self._abandon(waiter, user_id):
+                self.release(user_id)
+            raise
+
+    def release(self, user_id):
+        """Return a slot, handing it to the longest-waiting request if any."""
+        with self._lock:
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+                STREAM_QUEUE_WAIT.observe(time.perf_counter() - waiter.queued_at)
+            else:
+                self._active -= 1
+            self._update_gauges()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": self._active, "queued": len(self._waiters), "users": len(self._per_user)}
+
+    def _reserve(self, user_id, notify) -> Optional[_Waiter]:
+        """Take a slot now and return None, or queue the request and return its waiter."""
+        with self._lock:
+            if self._per_user[user_id] >= self.max_per_user:
+                self._reject("user_limit", "You already have a response in progress, please wait for it to finish.")
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                waiter = None
+            elif len(self._waiters) >= self.max_queue:
+                self._reject("queue_full", "The server is busy, please try again shortly.")
+            else:
+                waiter = _Waiter(notify)
+                self._waiters.append(waiter)
+            self._per_user[user_id] += 1
+            self._update_gauges()
+            return waiter
+
+    def _abandon(self, waiter: _Waiter, user_id) -> bool:
+        """Leave the queue after a timeout; False if a slot was granted in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            self._update_gauges()
+            return True
+
+    def _reject(self, reason: str, message: str):
+        STREAM_REJECTIONS.inc(reason=reason)
+        raise AdmissionRejected(reason, message, retry_after=max(int(self.queue_timeout), 1))
+
+    def _update_gauges(self):
+        STREAMS_IN_FLIGHT.set(self._active)
+        STREAM_QUEUE_DEPTH.set(len(self._waiters))
+
+
+class SharedStream:
+    """One turn's response text as it is generated, readable by any number of requests.
+
+    Chunks are numbered from 1 in publishing order and the last ``max_chunks`` are
+    kept, so a reader can start after any chunk still buffered: attached requests
+    from the start, a reconnecting client after the last chunk it received. Sync
+    readers wait on a condition; async readers are woken through their event loop,
+    whichever thread publishes.
+
+    With ``max_lag``, publishing waits while the slowest reader is that many
+    chunks behind, so the producer is held back rather than readers falling ever
+    further behind; a reader holding it back for ``stall_timeout`` seconds is cut
+    off. ``on_idle`` is called with a reason (disconnect, stalled) when the last
+    reader leaves before the turn is done, and ``abort`` is set once the turn
+    should stop generating.
+    """
+
+    def __init__(self, user_id=None, max_chunks: Optional[int] = None, max_lag=None, stall_timeout=None):
+        self.turn_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.published = 0
+        self.done = False
+        self.timings = {}
+        self.expires_at = None
+        self.max_lag = max_lag
+        self.stall_timeout = stall_timeout
+        self.abort = threading.Event()
+        self.on_idle = None
+        self._chunks = deque(maxlen=max_chunks)
+        self._condition = threading.Condition()
+        self._async_waiters = set()
+        self._positions = {}
+        self._dropped = set()
+        self._producer_waiter = None
+
+    @property
+    def readers(self) -> int:
+        with self._condition:
+            return len(self._positions)
+
+    def publish(self, chunk: str):
+        with self._condition:
+            if self._lagging():
+                started = time.perf_counter()
+                self._condition.wait_for(lambda: not self._lagging(), self.stall_timeout)
+                STREAM_BACKPRESSURE_WAIT.observe(time.perf_counter() - started)
+                self._drop_stalled()
+            self._append(chunk)
+
+    async def apublish(self, chunk: str):
+        """Async variant of ``publish``; waits for slow readers without blocking the event loop."""
+        if self.max_lag is not None:
+            loop = asyncio.get_running_loop()
+            event = asyncio.Event()
+            started = time.perf_counter()
+            waited = False
+            while True:
+                with self._condition:
+                    if not self._lagging():
+                        break
+                    event.clear()
+                    self._producer_waiter = (loop, event)
+                waited = True
+                left = self._stall_left(started)
+                try:
+                    await asyncio.wait_for(event.wait(), None if left is None else max(left, 0))
+                except asyncio.TimeoutError:
+                    with self._condition:
+                        self._drop_stalled()
+            if waited:
+                STREAM_BACKPRESSURE_WAIT.observe(time.perf_counter() - started)
+        with self._condition:
+            self._producer_waiter = None
+            self._append(chunk)
+
+    def close(self):
+        with self._condition:
+            self.done = True
+            self._notify()
+
+    def buffered(self, start: int) -> bool:
+        """Whether a reader can start after chunk ``start``, i.e. every later chunk is still buffered."""
+        with self._condition:
+            return self.published - len(self._chunks) <= start <= self.published
+
+    def follow(self, timings=None, start: int = 0):
+        """Yield every chunk after the first ``start`` as it becomes available."""
+        reader = self._join(start)
+        position = start
+        try:
+            while True:
+                with self._condition:
+                    while position == self.published and not self.done and reader not in self._dropped:
+                        self._condition.wait()
+                    chunks, done = self._read(reader, position), self.done
+                if chunks is None:
+                    return
+                position += len(chunks)
+                yield from chunks
+                if done:
+                    break
+        finally:
+            self._leave(reader)
+        if timings is not None:
+            timings.update(self.timings)
+
+    async def afollow(self, timings=None, start: int = 0):
+        """Async variant of ``follow``."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        reader = self._join(start)
+        position = start
+        try:
+            while True:
+                with self._condition:
+                    chunks, done = self._read(reader, position), self.done
+                    if chunks == [] and not done:
+                        event.clear()
+                        self._async_waiters.add(waiter)
+                if chunks is None:
+                    return
+                if not chunks and not done:
+                    await event.wait()
+                    continue
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if done:
+                    break
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+            self._leave(reader)
+        if timings is not None:
+            timings.update(self.timings)
+
+    def _join(self, start: int) -> object:
+        reader = object()
+        with self._condition:
+            self._positions[reader] = start
+        return reader
+
+    def _leave(self, reader):
+        with self._condition:
+            # A reader cut off as stalled has already been accounted for
+            idle = self._positions.pop(reader, None) is not None and not self._positions and not self.done
+            self._dropped.discard(reader)
+            self._wake_producer()
+        if idle and self.on_idle is not None:
+            self.on_idle("disconnect")
+
+    def _read(self, reader, position: int) -> Optional[list]:
+        """Chunks after ``position``, or None if some were dropped from the buffer before being read.
+
+        A reader falling that far behind, or stalling generation for too long, is
+        cut off; its client reconnects and is told the turn can no longer be
+        resumed. Called with the lock held; returning chunks moves the reader on.
+        """
+        first = self.published - len(self._chunks)
+        if reader in self._dropped:
+            return None
+        if position < first:
+            logger.warning(f"Reader of turn {self.turn_id} fell {first - position} chunks behind the buffer")
+            return None
+        chunks = list(islice(self._chunks, position - first, None))
+        if chunks:
+            self._positions[reader] = position + len(chunks)
+            self._wake_producer()
+        return chunks
+
+    def _append(self, chunk: str):
+        self._chunks.append(chunk)
+        self.published += 1
+        self._notify()
+
+    def _lagging(self) -> bool:
+        """Whether the slowest reader is ``max_lag`` chunks behind; called with the lock held."""
+        return (
+            self.max_lag is not None
+            and bool(self._positions)
+            and self.published - min(self._positions.values()) >= self.max_lag
+        )
+
+    def _stall_left(self, started: float) -> Optional[float]:
+        return None if self.stall_timeout is None else self.stall_timeout - (time.perf_counter() - started)
+
+    def _drop_stalled(self):
+        """Cut off the readers still ``max_lag`` chunks behind; called with the lock held."""
+        stalled = [reader for reader, position in self._positions.items() if self.published - position >= self.max_lag]
+        if not stalled:
+            return
+        logger.warning(f"Cut off {len(stalled)} stalled readers of turn {self.turn_id}")
+        for reader in stalled:
+            del self._positions[reader]
+            self._dropped.add(reader)
+        self._notify()
+        if not self._positions and self.on_idle is not None:
+            self.on_idle("stalled")
+
+    def _wake_producer(self):
+        """Let a producer waiting for slow readers check again; called with the lock held."""
+        if self.max_lag is None:
+            return
+        self._condition.notify_all()
+        if self._producer_waiter is not None:
+            loop, event = self._producer_waiter
+            loop.call_soon_threadsafe(event.set)
+
+    def _notify(self):
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+
+class StreamHub:
+    """Admits stream requests and runs each admitted response once for every request asking for it.
+
+    ``open`` and ``aopen`` take ``produce``, a function of the ``SharedStream``
+    returning the response text stream, and return the stream to follow; the
+    producer fills in its ``timings`` and stops generating once its ``abort``
+    event is set. Requests are only limited when an ``admission`` controller is
+    given. Identical messages from the same user are coalesced while the first is
+    in flight when ``dedupe`` is set, and turns can be continued with ``resume``
+    when ``resumable`` is.
+
+    Generation waits for readers more than ``max_lag`` chunks behind, cutting off
+    those stalled for ``stall_timeout`` seconds. With ``cancel_grace`` set, a turn
+    left without readers is aborted after that many seconds unless a client has
+    reconnected to it meanwhile.
+    """
+
+    def __init__(
+        self,
+        admission: Optional[AdmissionController] = None,
+        dedupe: bool = True,
+        resumable: bool = False,
+        replay_chunks: Optional[int] = None,
+        resume_grace: float = 60.0,
+        max_lag: Optional[int] = None,
+        stall_timeout: Optional[float] = None,
+        cancel_grace: Optional[float] = None,
+    ):
+        self.admission = admission
+        self.dedupe = dedupe
+        self.resumable = resumable
+        self.replay_chunks = replay_chunks
+        self.resume_grace = resume_grace
+        self.max_lag = max_lag
+        self.stall_timeout = stall_timeout
+        self.cancel_grace = cancel_grace
+        self._lock = threading.Lock()
+        self._streams: dict[tuple, SharedStream] = {}
+        self._turns: dict[str, SharedStream] = {}
+        self._tasks = set()
+
+    @classmethod
+    def from_settings(cls) -> Optional["StreamHub"]:
+        """Build the hub configured in settings, or None if neither admission control nor resuming is enabled."""
+        from django.conf import settings
+
+        admission_control = getattr(settings, "CHATBOT_ADMISSION_CONTROL", False)
+        resumable = getattr(settings, "CHATBOT_STREAM_RESUME", False)
+        if not (admission_control or resumable):
+            return None
+        admission = None
+        if admission_control:
+            admission = AdmissionController(
+                max_per_user=getattr(settings, "CHATBOT_MAX_STREAMS_PER_USER", 2),
+                max_concurrent=getattr(settings, "CHATBOT_MAX_CONCURRENT_STREAMS", 32),
+                max_queue=getattr(settings, "CHATBOT_STREAM_QUEUE_SIZE", 64),
+                queue_timeout=getattr(settings, "CHATBOT_STREAM_QUEUE_TIMEOUT", 10),
+            )
+        return cls(
+            admission,
+            dedupe=getattr(settings, "CHATBOT_STREAM_DEDUPE", True),
+            resumable=resumable,
+            replay_chunks=getattr(settings, "CHATBOT_STREAM_REPLAY_CHUNKS", 2048),
+            resume_grace=getattr(settings, "CHATBOT_STREAM_RESUME_GRACE", 60),
+            max_lag=getattr(settings, "CHATBOT_STREAM_BUFFER_CHUNKS", None) or None,
+            stall_timeout=getattr(settings, "CHATBOT_STREAM_STALL_TIMEOUT", None),
+            cancel_grace=(
+                getattr(settings, "CHATBOT_STREAM_CANCEL_GRACE", 5)
+                if getattr(settings, "CHATBOT_STREAM_CANCEL_ON_DISCONNECT", False)
+                else None
+            ),
+        )
+
+    def open(self, user_id, message: str, produce) -> SharedStream:
+        """Attach to an identical response in flight, or admit a new one and start it in a thread."""
+        key = (user_id, normalize_message(message))
+        if shared := self._attach(key):
+            return shared
+        if self.admission is not None:
+            self.admission.acquire(user_id)
+        shared, started = self._start(key, user_id)
+        if not started:
+            return shared
+        threading.Thread(
+            target=self._produce, args=(key, user_id, shared, produce), name="chat-stream", daemon=True
+        ).start()
+        return shared
+
+    async def aopen(self, user_id, message: str, produce) -> SharedStream:
+        """Async variant of ``open``; the response is generated by a task on the running loop."""
+        key = (user_id, normalize_message(message))
+        if shared := self._attach(key):
+            return shared
+        if self.admission is not None:
+            await self.admission.aacquire(user_id)
+        shared, started = self._start(key, user_id)
+        if not started:
+            return shared
+        task = asyncio.create_task(self._aproduce(key, user_id, shared, produce))
+        # The event loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return shared
+
+    def resume(self, user_id, turn_id: str, start: int) -> SharedStream:
+        """The turn to follow after its first ``start`` chunks, for a client reconnecting to it.
+
+        Raises ``ReplayUnavailable`` unless the turn belongs to ``user_id``, has not
+        expired and still buffers every chunk after ``start``.
+        """
+        with self._lock:
+            self._expire()
+            shared = self._turns.get(turn_id)
+        if shared is None or shared.user_id != user_id or not shared.buffered(start):
+            STREAM_RESUMES.inc(outcome="unavailable")
+            raise ReplayUnavailable("This response is no longer available, reload the page to see it.")
+        STREAM_RESUMES.inc(outcome="resumed")
+        return shared
+
+    def _attach(self, key) -> Optional[SharedStream]:
+        if not self.dedupe:
+            return None
+        with self._lock:
+            shared = self._streams.get(key)
+        # A response that has already dropped its first chunks cannot be followed from the start
+        if shared is None or not shared.buffered(0):
+            return None
+        STREAMS_COALESCED.inc()
+        return shared
+
+    def _start(self, key, user_id) -> tuple[SharedStream, bool]:
+        """Register a new turn under ``key``, unless an identical one started while this request queued.
+
+        Returns the stream to follow and whether the caller must produce it.
+        """
+        with self._lock:
+            existing = self._streams.get(key) if self.dedupe else None
+            if existing is None or not existing.buffered(0):
+                shared = SharedStream(user_id, self.replay_chunks, self.max_lag, self.stall_timeout)
+                if self.cancel_grace is not None:
+                    shared.on_idle = lambda reason: self._abandoned(shared, reason)
+                if self.dedupe:
+                    self._streams[key] = shared
+                if self.resumable:
+                    self._expire()
+                    self._turns[shared.turn_id] = shared
+                return shared, True
+        self._release(user_id)
+        STREAMS_COALESCED.inc()
+        return existing, False
+
+    def _produce(self, key, user_id, shared: SharedStream, produce):
+        from django.db import connections
+
+        try:
+            for chunk in produce(shared):
+                shared.publish(chunk)
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            shared.publish(f"Error: {str(e)}")
+        finally:
+            self._finish(key, user_id, shared)
+            # Connections opened by this thread are not closed at the end of a request
+            connections.close_all()
+
+    async def _aproduce(self, key, user_id, shared: SharedStream, produce):
+        try:
+            async for chunk in produce(shared):
+                await shared.apublish(chunk)
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            await shared.apublish(f"Error: {str(e)}")
+        finally:
+            self._finish(key, user_id, shared)
+
+    def _finish(self, key, user_id, shared: SharedStream):
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            # The turn is checkpointed by now; reconnects can still replay it until it expires
+            shared.expires_at = time.monotonic() + self.resume_grace
+        shared.close()
+        self._release(user_id)
+
+    def _abandoned(self, shared: SharedStream, reason: str):
+        """Abort the turn after the grace period unless a reader has come back meanwhile."""
+
+        def cancel():
+            if not shared.readers and not shared.done and not shared.abort.is_set():
+                STREAM_CANCELLATIONS.inc(reason=reason)
+                shared.abort.set()
+
+        if not self.cancel_grace:
+            cancel()
+            return
+        timer = threading.Timer(self.cancel_grace, cancel)
+        timer.daemon = True
+        timer.start()
+
+    def _release(self, user_id):
+        if self.admission is not None:
+            self.admission.release(user_id)
+
+    def _expire(self):
+        """Drop finished turns past their grace period; called with the lock held."""
+        now = time.monotonic()
+        expired = [
+            turn_id
+            for turn_id, shared in self._turns.items()
+            if shared.expires_at is not None and shared.expires_at <= now
+        ]
+        for turn_id in expired:
+            del self._turns[turn_id]
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage
+from langgraph.config import get_stream_writer
+
+from chatbot.services.metrics import timed
+from chatbot.services.response_cache import RESPONSE_CHUNK_KEY, CacheHit
+from chatbot.services.state import State
+from chatbot.services.utils import get_abort_event, get_cancel_event
+
+
+def cache_agent(state: State, response_cache, config=None, speculative=False) -> State:
+    """Answer a first-turn question from the response cache, replaying the cached chunks at their recorded pace.
+
+    The chunks go out as custom stream events, which the response streamer sends
+    like the domain agent's tokens. On a miss the domain agent answers. With ``speculative`` the answer is parked in
+    ``speculative_response`` for ``commit_speculative_response``, like a
+    generated one. The replay stops once nobody reads it any more or, in a
+    speculative run, once the message is rejected.
+    """
+    hit = _lookup(state, response_cache, config)
+    if hit is None:
+        return _miss(speculative)
+
+    stop_events = [event for event in (get_abort_event(config), get_cancel_event(config)) if event is not None]
+    writer = get_stream_writer()
+    with timed(config, "replay", "cache"):
+        for chunk, gap in zip(hit.response.chunks, hit.response.gaps):
+            if any(event.is_set() for event in stop_events):
+                break
+            if gap * response_cache.pacing > 0:
+                time.sleep(gap * response_cache.pacing)
+            writer({RESPONSE_CHUNK_KEY: chunk})
+    return _answer(hit, speculative)
+
+
+async def acache_agent(state: State, response_cache, config=None, speculative=False) -> State:
+    """Async variant of ``cache_agent``."""
+    hit = _lookup(state, response_cache, config)
+    if hit is None:
+        return _miss(speculative)
+
+    stop_events = [event for event in (get_abort_event(config), get_cancel_event(config)) if event is not None]
+    writer = get_stream_writer()
+    with timed(config, "replay", "cache"):
+        for chunk, gap in zip(hit.response.chunks, hit.response.gaps):
+            if any(event.is_set() for event in stop_events):
+                break
+            if gap * response_cache.pacing > 0:
+                await asyncio.sleep(gap * response_cache.pacing)
+            writer({RESPONSE_CHUNK_KEY: chunk})
+    return _answer(hit, speculative)
+
+
+def _lookup(state: State, response_cache, config):
+    question = response_cache.question(state)
+    if question is None:
+        return None
+    with timed(config, "lookup", "cache"):
+        return response_cache.lookup(question)
+
+
+def _miss(speculative: bool) -> State:
+    """Nothing, or for speculative runs a cleared draft, which the domain agent takes as its cue to generate."""
+    return {"speculative_response": None} if speculative else {}
+
+
+def _answer(hit: CacheHit, speculative: bool) -> State:
+    """The cached answer, kept whole even if the replay stopped early: it costs nothing to store."""
+    response = AIMessage(
+        content=hit.response.text,
+        response_metadata={"cached": hit.tier, "similarity": round(hit.similarity, 3)},
+    )
+    return {"speculative_response": response} if speculative else {"messages": [response]}
@@ -0,0 +1,54 @@
+from langchain_core.messages import HumanMessage
+
+from chatbot.constants import CONVERSATION_SUMMARY_PROMPT
+from chatbot.services.metrics import record_usage, timed
+from chatbot.services.prompt_cache import system_prompt
+from chatbot.services.state import State
+
+
+def context_agent(state: State, llm, context_window, config=None) -> State:
+    """Fold messages that have fallen out of the context window into the running summary.
+
+    Only messages newly outside the window are sent to the model, together with the
+    existing summary, so the cost of each summarization is bounded by the budget.
+    """
+    update = _pending_fold(state, context_window)
+    if update is None:
+        return {}
+
+    summary_messages, boundary_id, summarized_tokens = update
+    with timed(config, "summarize", "context"):
+        response = llm.invoke(summary_messages)
+    record_usage(config, "context", response)
+    return {"summary": response.text(), "summarized_through": boundary_id, "summarized_tokens": summarized_tokens}
+
+
+async def acontext_agent(state: State, llm, context_window, config=None) -> State:
+    """Async variant of ``context_agent``."""
+    update = _pending_fold(state, context_window)
+    if update is None:
+        return {}
+
+    summary_messages, boundary_id, summarized_tokens = update
+    with timed(config, "summarize", "context"):
+        response = await llm.ainvoke(summary_messages)
+    record_usage(config, "context", response)
+    return {"summary": response.text(), "summarized_through": boundary_id, "summarized_tokens": summarized_tokens}
+
+
+def _pending_fold(state: State, context_window):
+    """Return the summarization prompt, new boundary id and summarized token count, or None if the window fits."""
+    messages = state["messages"]
+    start = context_window.unsummarized_start(messages, state.get("summarized_through"))
+    end = context_window.overflow_end(messages, start)
+    if end <= start:
+        return None
+
+    transcript = "\n".join(f"{message.type}: {message.text()}" for message in messages[start:end])
+    summary_messages = [
+        system_prompt(CONVERSATION_SUMMARY_PROMPT),
+        HumanMessage(
+            content=f"<summary>{state.get('summary') or ''}</summary>\n\n<conversation>\n{transcript}\n</conversation>"
+        ),
+    ]
+    return summary_messages, messages[end - 1].id, context_window.summarized_tokens(state, start, end)
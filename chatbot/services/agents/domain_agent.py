@@ -1,5 +1,211 @@
+import asyncio
+import time
+from contextlib import aclosing, closing
+from itertools import chain
+from typing import Optional
+
+from langchain_core.messages import AIMessage, message_chunk_to_message
+
+from chatbot.constants import SAFETY_STATUS_REJECT, TRUNCATED_MARKER
+from chatbot.services.metrics import record_context_savings, record_usage, timed
+from chatbot.services.prompt_cache import cache_conversation
+from chatbot.services.resilience import acall, call
 from chatbot.services.state import State
+from chatbot.services.utils import get_abort_event, get_cancel_event
+
+
+def domain_agent(state: State, llm, config=None, context_window=None, resilience=None, response_cache=None) -> State:
+    """Answer the conversation, within the node's deadline and circuit breaker when ``resilience`` is set.
+
+    The deadline bounds the wait for the first token; the rest of the response
+    streams for as long as the model keeps sending it. The response is cut
+    short once the run's abort event is set, when nobody reads it any more;
+    what was generated is kept, marked as truncated. A complete answer to a
+    first-turn question goes into ``response_cache`` when one is given; this
+    node only runs once the message was approved.
+    """
+    abort_event, trace = get_abort_event(config), []
+    messages = _prompt_messages(state, context_window, config)
+    with timed(config, "generation", "chatbot"):
+        response = _generate(llm, messages, abort_event=abort_event, trace=trace, resilience=resilience)
+    record_usage(config, "chatbot", response)
+    if (question := _cacheable(state, response_cache, response, trace)) is not None:
+        response_cache.store(question, trace)
+    return {"messages": [response or AIMessage(content="")]}
+
+
+async def adomain_agent(
+    state: State, llm, config=None, context_window=None, resilience=None, response_cache=None
+) -> State:
+    abort_event, trace = get_abort_event(config), []
+    messages = _prompt_messages(state, context_window, config)
+    with timed(config, "generation", "chatbot"):
+        response = await _agenerate(llm, messages, abort_event=abort_event, trace=trace, resilience=resilience)
+    record_usage(config, "chatbot", response)
+    if (question := _cacheable(state, response_cache, response, trace)) is not None:
+        response_cache.store(question, trace)
+    return {"messages": [response or AIMessage(content="")]}
+
+
+def speculative_domain_agent(
+    state: State, llm, config=None, context_window=None, resilience=None, response_cache=None
+) -> State:
+    """Generate a response while the safety check is still running.
+
+    The response is parked in ``speculative_response`` rather than appended to the
+    conversation; ``commit_speculative_response`` publishes it once both branches
+    have finished. Generation stops as soon as the run's cancellation event is set,
+    and is cut short like ``domain_agent``'s once its abort event is. Nothing is
+    generated when the cache node already answered; a new answer for the cache is
+    held there until the verdict is known.
+    """
+    if state.get("speculative_response") is not None:
+        return {}
+    cancel_event, abort_event, trace = get_cancel_event(config), get_abort_event(config), []
+    messages = _prompt_messages(state, context_window, config)
+
+    with timed(config, "generation", "chatbot"):
+        response = _generate(llm, messages, cancel_event, abort_event, trace, resilience)
+
+    record_usage(config, "chatbot", response)
+    if (question := _cacheable(state, response_cache, response, trace)) is not None:
+        response_cache.hold(state["messages"][-1].id, question, trace)
+    return {"speculative_response": response}
+
+
+async def aspeculative_domain_agent(
+    state: State, llm, config=None, context_window=None, resilience=None, response_cache=None
+) -> State:
+    """Async variant of ``speculative_domain_agent``."""
+    if state.get("speculative_response") is not None:
+        return {}
+    cancel_event, abort_event, trace = get_cancel_event(config), get_abort_event(config), []
+    messages = _prompt_messages(state, context_window, config)
+
+    with timed(config, "generation", "chatbot"):
+        response = await _agenerate(llm, messages, cancel_event, abort_event, trace, resilience)
+
+    record_usage(config, "chatbot", response)
+    if (question := _cacheable(state, response_cache, response, trace)) is not None:
+        response_cache.hold(state["messages"][-1].id, question, trace)
+    return {"speculative_response": response}
+
+
+def _generate(llm, messages, cancel_event=None, abort_event=None, trace=None, resilience=None) -> Optional[AIMessage]:
+    """Stream a response; None if cancelled or empty, truncated if aborted.
+
+    Only opening the stream and waiting for its first chunk go through
+    ``resilience``. Leaving the loop closes the model stream, which stops the
+    provider generating. Each chunk's text and arrival time are appended to
+    ``trace`` if given.
+    """
+    chunks, first = call(resilience, lambda: _open_stream(llm, messages), discard=_close_stream)
+    response = None
+    with closing(chunks):
+        for chunk in chain([first] if first is not None else [], chunks):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            if trace is not None:
+                trace.append((chunk.text(), time.perf_counter()))
+            response = chunk if response is None else response + chunk
+            if abort_event is not None and abort_event.is_set():
+                return _truncated(response)
+    return message_chunk_to_message(response) if response is not None else None
+
+
+async def _agenerate(
+    llm, messages, cancel_event=None, abort_event=None, trace=None, resilience=None
+) -> Optional[AIMessage]:
+    """Async variant of ``_generate``."""
+    chunks, first = await acall(resilience, lambda: _aopen_stream(llm, messages))
+    response = None
+    async with aclosing(_aresume(chunks, first)) as stream:
+        async for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            if trace is not None:
+                trace.append((chunk.text(), time.perf_counter()))
+            response = chunk if response is None else response + chunk
+            if abort_event is not None and abort_event.is_set():
+                return _truncated(response)
+    return message_chunk_to_message(response) if response is not None else None
+
+
+def _open_stream(llm, messages):
+    """Start streaming a response and return the stream with its first chunk, None if it is empty."""
+    chunks = llm.stream(messages)
+    try:
+        return chunks, next(chunks, None)
+    except BaseException:
+        chunks.close()
+        raise
+
+
+async def _aopen_stream(llm, messages):
+    """Async variant of ``_open_stream``; a cancelled attempt closes its stream."""
+    chunks = llm.astream(messages)
+    try:
+        return chunks, await anext(chunks, None)
+    except (Exception, asyncio.CancelledError):
+        await chunks.aclose()
+        raise
+
+
+async def _aresume(chunks, first):
+    """The chunks of a stream opened by ``_aopen_stream``, from its first one; closing this closes the stream."""
+    async with aclosing(chunks):
+        if first is None:
+            return
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+
+def _close_stream(opened):
+    """Close the stream of an attempt that got its first chunk after the deadline, so the model stops."""
+    opened[0].close()
+
+
+def _truncated(response) -> AIMessage:
+    """The part of a response generated before it was cut short, marked as truncated.
+
+    It keeps the streamed message's ID, so the marker is stored but not streamed.
+    """
+    return AIMessage(
+        content=response.text() + TRUNCATED_MARKER,
+        id=response.id,
+        response_metadata={**response.response_metadata, "truncated": True},
+    )
+
+
+def commit_speculative_response(state: State, response_cache=None) -> State:
+    """Join node for speculative execution: keep the draft only if the message was approved.
+
+    An answer the domain agent held for ``response_cache`` is cached only then.
+    """
+    response = state.get("speculative_response")
+    approved = state.get("safety_status") != SAFETY_STATUS_REJECT and response is not None
+    if response_cache is not None:
+        question = next(message for message in reversed(state["messages"]) if message.type == "human")
+        response_cache.release(question.id, approved)
+    if not approved:
+        return {"speculative_response": None}
+
+    return {"messages": [response], "speculative_response": None}
+
+
+def _cacheable(state: State, response_cache, response, trace) -> Optional[str]:
+    """The question to cache ``response`` under: a complete answer, as streamed, to a first-turn question."""
+    if response_cache is None or response is None or response.response_metadata.get("truncated"):
+        return None
+    if "".join(text for text, _ in trace) != response.text():
+        return None
+    return response_cache.question(state)
 
 
-def domain_agent(state: State, llm) -> State:
-    return {"messages": [llm.invoke(state["messages"])]}
+def _prompt_messages(state: State, context_window, config=None):
+    """Conversation to send to the model, limited to the context window when one is configured."""
+    if context_window is None:
+        return cache_conversation(state["messages"])
+    record_context_savings(config, context_window.tokens_saved(state))
+    return cache_conversation(context_window.prompt_messages(state))
@@ -1,60 +1,340 @@
+import asyncio
 import logging
+import threading
+import time
+from typing import Optional
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage
 
 from chatbot.constants import (
+    SAFETY_FAILURE_OPEN,
     SAFETY_PROMPT,
     SAFETY_REJECTION_MESSAGE,
     SAFETY_STATUS_APPROVE,
     SAFETY_STATUS_REJECT,
+    SAFETY_UNAVAILABLE_MESSAGE,
+    USER_ID_KEY,
 )
+from chatbot.services.metrics import SAFETY_FAILURES, record_usage, timed
+from chatbot.services.prompt_cache import system_prompt
+from chatbot.services.resilience import acall, call
 from chatbot.services.state import State
-from chatbot.services.utils import extract_xml
+from chatbot.services.utils import get_cancel_event
+from chatbot.services.verdicts import SafetyVerdict, VerdictStreamParser
 
 logger = logging.getLogger(__name__)
 
 
-def safety_agent(state: State, llm) -> State:
+def safety_agent(
+    state: State, llm, config=None, verdict_cache=None, prefilter=None, event_writer=None, resilience=None
+) -> State:
     """
     Safety agent node that uses LLM to detect and filter harmful messages.
+
+    The verdict is recorded in ``safety_status``. When the domain agent is running
+    speculatively, a rejection also sets the run's cancellation event so the
+    in-flight generation is abandoned. Clear-cut messages are decided locally by
+    ``prefilter`` without an LLM call, and verdicts are served from ``verdict_cache``
+    when one is configured and the message has been assessed before. Every verdict
+    is queued on ``event_writer``, when configured, for the safety event log.
+
+    With ``CHATBOT_SAFETY_STREAMING`` the safety response is streamed and the node
+    returns as soon as the verdict is decided, before the model has written its
+    reasoning.
+
+    The model call runs through ``resilience``, when set, for the node's deadline,
+    hedging and circuit breaker. When no verdict can be reached, from a failed,
+    late or refused call alike, ``CHATBOT_SAFETY_FAILURE_POLICY`` decides: "open"
+    (the default) lets the message through unchecked, "closed" turns it away. Either way the
+    failure is logged as a safety event and never cached.
     """
+    last_message = _message_to_check(state)
+    if last_message is None:
+        return {}
+    started = time.perf_counter()
+
+    if prefilter is not None and (verdict := prefilter.classify(last_message.text())):
+        _record_event(event_writer, config, verdict, "prefilter", started)
+        return _verdict_update(last_message, verdict, config, source="prefilter")
+
+    if verdict_cache is not None and (verdict := verdict_cache.get(last_message.text())):
+        _record_event(event_writer, config, verdict, "cached", started)
+        return _verdict_update(last_message, verdict, config, source="cached")
+
+    try:
+        # Get LLM assessment
+        with timed(config, "safety_llm", "safety"):
+            if _streaming_enabled():
+                verdict = _stream_verdict(llm, last_message, config, event_writer, started, resilience)
+            else:
+                messages = _safety_check_messages(last_message)
+                response = call(resilience, lambda: llm.invoke(messages))
+                record_usage(config, "safety", response)
+                verdict = SafetyVerdict.from_xml(response.content)
+                _record_event(event_writer, config, verdict, "llm", started)
+        if verdict_cache is not None:
+            verdict_cache.set(last_message.text(), verdict)
+        return _verdict_update(last_message, verdict, config)
+
+    except Exception as e:
+        logger.error(f"Error in safety check: {str(e)}")
+        return _failure_update(last_message, e, config, event_writer, started)
+
+
+async def asafety_agent(
+    state: State, llm, config=None, verdict_cache=None, prefilter=None, event_writer=None, resilience=None
+) -> State:
+    """Async variant of ``safety_agent`` used when the graph runs under ``astream``."""
+    last_message = _message_to_check(state)
+    if last_message is None:
+        return {}
+    started = time.perf_counter()
+
+    if prefilter is not None and (verdict := prefilter.classify(last_message.text())):
+        _record_event(event_writer, config, verdict, "prefilter", started)
+        return _verdict_update(last_message, verdict, config, source="prefilter")
+
+    if verdict_cache is not None and (verdict := await verdict_cache.aget(last_message.text())):
+        _record_event(event_writer, config, verdict, "cached", started)
+        return _verdict_update(last_message, verdict, config, source="cached")
+
+    try:
+        with timed(config, "safety_llm", "safety"):
+            if _streaming_enabled():
+                verdict = await _astream_verdict(llm, last_message, config, event_writer, started, resilience)
+            else:
+                messages = _safety_check_messages(last_message)
+                response = await acall(resilience, lambda: llm.ainvoke(messages))
+                record_usage(config, "safety", response)
+                verdict = SafetyVerdict.from_xml(response.content)
+                _record_event(event_writer, config, verdict, "llm", started)
+        if verdict_cache is not None:
+            await verdict_cache.aset(last_message.text(), verdict)
+        return _verdict_update(last_message, verdict, config)
+
+    except Exception as e:
+        logger.error(f"Error in safety check: {str(e)}")
+        return _failure_update(last_message, e, config, event_writer, started)
+
+
+def _message_to_check(state: State):
+    """Return the last message if it is a user message, otherwise None."""
     # Get the last user message
     messages = state["messages"]
     if not messages:
-        return state
+        return None
 
     last_message = messages[-1]
 
     # Only check user messages
     if last_message.type != "human":
-        return state
+        return None
+
+    return last_message
 
-    # Use LLM to assess safety
-    safety_check_messages = [
-        SystemMessage(content=SAFETY_PROMPT),
+
+def _safety_check_messages(last_message):
+    """Build the prompt used to assess a single user message."""
+    return [
+        system_prompt(SAFETY_PROMPT),
         HumanMessage(content=f"User message to analyze: {last_message.content}"),
     ]
 
+
+def _streaming_enabled() -> bool:
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_SAFETY_STREAMING", False)
+
+
+def _keep_reasoning(event_writer, config) -> bool:
+    """Whether to read the reasoning after an early verdict; only the safety event log stores it."""
+    from django.conf import settings
+
+    return event_writer is not None and bool(config) and getattr(settings, "CHATBOT_SAFETY_REASONING", True)
+
+
+class _VerdictRead:
+    """A safety response streamed up to its verdict; ``ended`` if the response ended first."""
+
+    __slots__ = ("stream", "parser", "response", "verdict", "ended")
+
+    def __init__(self, stream, parser, response, verdict, ended):
+        self.stream = stream
+        self.parser = parser
+        self.response = response
+        self.verdict = verdict
+        self.ended = ended
+
+
+def _read_verdict(llm, messages) -> _VerdictRead:
+    """Stream the safety response until the verdict is decided."""
+    parser = VerdictStreamParser()
+    stream = llm.stream(messages)
+    response = None
     try:
-        # Get LLM assessment
-        response = llm.invoke(safety_check_messages)
-        response_content = response.content
+        for chunk in stream:
+            response = chunk if response is None else response + chunk
+            if (verdict := parser.feed(chunk.text())) is not None:
+                return _VerdictRead(stream, parser, response, verdict, ended=False)
+    except BaseException:
+        stream.close()
+        raise
+    return _VerdictRead(stream, parser, response, parser.result(), ended=True)
 
-        # Extract XML fields
-        status = (extract_xml(response_content, "status") or SAFETY_STATUS_APPROVE).upper()
 
-        # Simple safety check without compliance tracking for now
-        if status == SAFETY_STATUS_APPROVE:
-            logger.info(f"✅ APPROVED: {last_message.content[:100]}...")
+async def _aread_verdict(llm, messages) -> _VerdictRead:
+    """Async variant of ``_read_verdict``."""
+    parser = VerdictStreamParser()
+    stream = llm.astream(messages)
+    response = None
+    try:
+        async for chunk in stream:
+            response = chunk if response is None else response + chunk
+            if (verdict := parser.feed(chunk.text())) is not None:
+                return _VerdictRead(stream, parser, response, verdict, ended=False)
+    except BaseException:
+        await stream.aclose()
+        raise
+    return _VerdictRead(stream, parser, response, parser.result(), ended=True)
 
-        elif status == SAFETY_STATUS_REJECT:
-            logger.warning(f"🚫 REJECTED: {last_message.content[:100]}...")
-            return {"messages": [AIMessage(content=SAFETY_REJECTION_MESSAGE)]}
 
-        # Message approved, pass through
-        return state
+def _close_read(read: _VerdictRead):
+    """Stop the generation of a response that lost a hedge or came in past the deadline."""
+    read.stream.close()
 
-    except Exception as e:
-        logger.error(f"Error in safety check: {str(e)}")
-        # On error, default to accepting to avoid blocking legitimate requests
-        return state
+
+def _aclose_read(read: _VerdictRead):
+    _background(read.stream.aclose())
+
+
+def _stream_verdict(llm, last_message, config, event_writer, started: float, resilience=None) -> SafetyVerdict:
+    """Stream the safety response and return as soon as the verdict is decided.
+
+    The rest of the response, the reasoning, is read by a background thread for the
+    safety event log when it is kept, and otherwise abandoned by closing the stream,
+    which stops generation. Usage arrives with the last chunk, so an abandoned
+    response's tokens are not counted. Hedged attempts race to the verdict.
+    """
+    messages = _safety_check_messages(last_message)
+    read = call(resilience, lambda: _read_verdict(llm, messages), discard=_close_read)
+    if read.ended:
+        record_usage(config, "safety", read.response)
+        _record_event(event_writer, config, read.verdict, "llm", started)
+        return read.verdict
+
+    decided = time.perf_counter()
+    verdict, stream, parser = read.verdict, read.stream, read.parser
+    if not _keep_reasoning(event_writer, config):
+        stream.close()
+        _record_event(event_writer, config, verdict, "llm", started, decided)
+        return verdict
+
+    def read_reasoning():
+        response = read.response
+        try:
+            for chunk in stream:
+                response += chunk
+                parser.feed(chunk.text())
+            record_usage(config, "safety", response)
+            _record_event(event_writer, config, parser.result(), "llm", started, decided)
+        except Exception as e:
+            logger.error(f"Error reading safety reasoning: {str(e)}")
+            _record_event(event_writer, config, verdict, "llm", started, decided)
+
+    threading.Thread(target=read_reasoning, name="safety-reasoning", daemon=True).start()
+    return verdict
+
+
+async def _astream_verdict(llm, last_message, config, event_writer, started: float, resilience=None) -> SafetyVerdict:
+    """Async variant of ``_stream_verdict``; the reasoning is read by a background task."""
+    messages = _safety_check_messages(last_message)
+    read = await acall(resilience, lambda: _aread_verdict(llm, messages), discard=_aclose_read)
+    if read.ended:
+        record_usage(config, "safety", read.response)
+        _record_event(event_writer, config, read.verdict, "llm", started)
+        return read.verdict
+
+    decided = time.perf_counter()
+    verdict, stream, parser = read.verdict, read.stream, read.parser
+    if not _keep_reasoning(event_writer, config):
+        await stream.aclose()
+        _record_event(event_writer, config, verdict, "llm", started, decided)
+        return verdict
+
+    async def read_reasoning():
+        response = read.response
+        try:
+            async for chunk in stream:
+                response += chunk
+                parser.feed(chunk.text())
+            record_usage(config, "safety", response)
+            _record_event(event_writer, config, parser.result(), "llm", started, decided)
+        except Exception as e:
+            logger.error(f"Error reading safety reasoning: {str(e)}")
+            _record_event(event_writer, config, verdict, "llm", started, decided)
+
+    _background(read_reasoning())
+    return verdict
+
+
+def _background(coroutine):
+    """Run a coroutine as a task of its own, kept referenced until it is done."""
+    # The event loop only keeps weak references to tasks
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+_background_tasks = set()
+
+
+def _record_event(
+    event_writer, config, verdict: SafetyVerdict, source: str, started: float, decided: Optional[float] = None
+):
+    """Queue a verdict for the safety event log; the writer stores it off the request path.
+
+    The latency runs from ``started`` to ``decided``, or to now when not given.
+    """
+    if event_writer is None or not config:
+        return
+    configurable = config.get("configurable", {})
+    latency_ms = ((decided or time.perf_counter()) - started) * 1000
+    event_writer.record(configurable.get(USER_ID_KEY), configurable.get("thread_id", ""), verdict, source, latency_ms)
+
+
+def _failure_update(last_message, error: Exception, config, event_writer, started: float) -> State:
+    """State update for a message no verdict could be reached for, by ``CHATBOT_SAFETY_FAILURE_POLICY``."""
+    from django.conf import settings
+
+    policy = getattr(settings, "CHATBOT_SAFETY_FAILURE_POLICY", SAFETY_FAILURE_OPEN)
+    SAFETY_FAILURES.inc(policy=policy)
+    status = SAFETY_STATUS_APPROVE if policy == SAFETY_FAILURE_OPEN else SAFETY_STATUS_REJECT
+    _record_event(event_writer, config, SafetyVerdict(status, "UNAVAILABLE", str(error)), "unavailable", started)
+
+    if status == SAFETY_STATUS_APPROVE:
+        logger.warning(f"⚠️ UNCHECKED (fail open): {last_message.content[:100]}...")
+        return {"safety_status": SAFETY_STATUS_APPROVE}
+
+    logger.warning(f"🚫 UNCHECKED (fail closed): {last_message.content[:100]}...")
+    if cancel_event := get_cancel_event(config):
+        cancel_event.set()
+    return {"messages": [AIMessage(content=SAFETY_UNAVAILABLE_MESSAGE)], "safety_status": SAFETY_STATUS_REJECT}
+
+
+def _verdict_update(last_message, verdict: SafetyVerdict, config, source: Optional[str] = None) -> State:
+    """Turn a safety verdict into a state update."""
+    source = f" ({source})" if source else ""
+
+    # Simple safety check without compliance tracking for now
+    if verdict.status == SAFETY_STATUS_APPROVE:
+        logger.info(f"✅ APPROVED{source}: {last_message.content[:100]}...")
+
+    elif verdict.status == SAFETY_STATUS_REJECT:
+        logger.warning(f"🚫 REJECTED{source}: {last_message.content[:100]}...")
+        if cancel_event := get_cancel_event(config):
+            cancel_event.set()
+        return {"messages": [AIMessage(content=SAFETY_REJECTION_MESSAGE)], "safety_status": SAFETY_STATUS_REJECT}
+
+    # Message approved, pass through
+    return {"safety_status": SAFETY_STATUS_APPROVE}
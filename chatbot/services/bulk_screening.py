@@ -0,0 +1,288 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from langchain_core.messages import HumanMessage
+
+from chatbot.constants import SAFETY_BATCH_INSTRUCTIONS, SAFETY_PROMPT
+from chatbot.services.prompt_cache import system_prompt
+from chatbot.services.utils import extract_all_xml, extract_xml
+from chatbot.services.verdicts import SafetyVerdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+
+@dataclass(frozen=True)
+class ScreeningResult:
+    """Safety verdict, or the error that prevented one, for a single screened message."""
+
+    tenant: str
+    id: str
+    verdict: Optional[SafetyVerdict] = None
+    source: str = "llm"
+    error: Optional[str] = None
+
+    @property
+    def outcome(self) -> str:
+        return self.verdict.status if self.verdict else "ERROR"
+
+    def as_dict(self) -> dict:
+        result = {"tenant": self.tenant, "id": self.id}
+        if self.verdict is None:
+            return {**result, "error": self.error}
+        return {
+            **result,
+            "status": self.verdict.status,
+            "violation_type": self.verdict.violation_type,
+            "reasoning": self.verdict.reasoning,
+            "source": self.source,
+        }
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` acquisitions per second, shared by worker threads.
+
+    Callers that find the bucket empty reserve the next free slot before sleeping,
+    so concurrent callers are spaced out rather than woken together.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait_for = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_for:
+            time.sleep(wait_for)
+
+
+class BulkScreener:
+    """Screen large volumes of stored messages against the safety prompt.
+
+    Messages are records with an ``id``, a ``text`` and an optional ``tenant``. Each
+    tenant's messages are packed into batched requests, one ``<result>`` block per
+    message, so a request never mixes tenants; ready batches are sent round-robin
+    across tenants by a bounded pool of worker threads, spaced out by the rate
+    limiter. Messages the pre-filter or verdict cache can decide never reach the
+    LLM, and messages missing from a batched response are retried on their own.
+    """
+
+    def __init__(
+        self,
+        llm,
+        batch_size: int = 20,
+        max_batch_chars: int = 20000,
+        workers: int = 8,
+        requests_per_minute: int = 0,
+        prefilter=None,
+        verdict_cache=None,
+    ):
+        self.llm = llm
+        self.batch_size = max(batch_size, 1)
+        self.max_batch_chars = max_batch_chars
+        self.workers = max(workers, 1)
+        self.rate_limiter = RateLimiter(requests_per_minute / 60) if requests_per_minute else None
+        self.prefilter = prefilter
+        self.verdict_cache = verdict_cache
+
+    @classmethod
+    def from_settings(cls, llm=None, **overrides):
+        """Create a screener configured from Django settings; ``overrides`` replace individual settings."""
+        from django.conf import settings
+
+        from chatbot.services.graph_builder import LLMFactory
+        from chatbot.services.prefilter import get_safety_prefilter
+        from chatbot.services.safety_cache import get_verdict_cache
+
+        options = {
+            "batch_size": getattr(settings, "CHATBOT_BULK_SCREENING_BATCH_SIZE", 20),
+            "max_batch_chars": getattr(settings, "CHATBOT_BULK_SCREENING_MAX_BATCH_CHARS", 20000),
+            "workers": getattr(settings, "CHATBOT_BULK_SCREENING_WORKERS", 8),
+            "requests_per_minute": getattr(settings, "CHATBOT_BULK_SCREENING_REQUESTS_PER_MINUTE", 0),
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(
+            llm or LLMFactory.create_llm("screening"),
+            prefilter=get_safety_prefilter(),
+            verdict_cache=get_verdict_cache("screening"),
+            **options,
+        )
+
+    def screen(self, records: Iterable[dict]) -> Iterator[ScreeningResult]:
+        """Screen ``records`` as they are read, yielding results in completion order.
+
+        At most two batches per worker are in flight and one more per worker waits
+        to be sent, so memory stays bounded however long the input is.
+        """
+        pending = defaultdict(list)
+        ready = {}
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-screening") as pool:
+
+            def submit_ready():
+                while ready and len(in_flight) < self.workers * 2:
+                    # Re-inserting a tenant moves it behind the others: round-robin
+                    tenant = next(iter(ready))
+                    batches = ready.pop(tenant)
+                    in_flight.add(pool.submit(self._screen_batch, tenant, batches.popleft()))
+                    if batches:
+                        ready[tenant] = batches
+
+            def completed(block: bool):
+                done, _ = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    yield from future.result()
+                submit_ready()
+
+            for record in records:
+                tenant = str(record.get("tenant") or DEFAULT_TENANT)
+                if local := self._screen_locally(tenant, record):
+                    yield local
+                    continue
+
+                batch = pending[tenant]
+                batch.append(record)
+                if len(batch) >= self.batch_size or sum(len(r["text"]) for r in batch) >= self.max_batch_chars:
+                    ready.setdefault(tenant, deque()).append(pending.pop(tenant))
+                    submit_ready()
+                    backlog = sum(len(batches) for batches in ready.values())
+                    yield from completed(block=backlog >= self.workers)
+
+            for tenant, batch in pending.items():
+                ready.setdefault(tenant, deque()).append(batch)
+            submit_ready()
+            while in_flight:
+                yield from completed(block=True)
+
+    def screen_to_file(self, records: Iterable[dict], path, resume: bool = True) -> Counter:
+        """Screen ``records`` into a JSONL file, one result per line.
+
+        The file is the run's checkpoint: with ``resume`` the messages it already
+        holds a verdict for are skipped and new results are appended, so an
+        interrupted run picks up where it stopped and failed messages are retried.
+        Returns counts per outcome, plus ``SKIPPED``.
+        """
+        path = Path(path)
+        done = _screened_keys(path) if resume else set()
+        counts = Counter(SKIPPED=0)
+
+        def unscreened():
+            for record in records:
+                if (str(record.get("tenant") or DEFAULT_TENANT), str(record["id"])) in done:
+                    counts["SKIPPED"] += 1
+                else:
+                    yield record
+
+        with path.open("a" if resume else "w", encoding="utf-8") as f:
+            if resume and f.tell() and not _ends_with_newline(path):
+                f.write("\n")
+            for result in self.screen(unscreened()):
+                f.write(json.dumps(result.as_dict()) + "\n")
+                f.flush()
+                counts[result.outcome] += 1
+        return counts
+
+    def _screen_locally(self, tenant: str, record: dict) -> Optional[ScreeningResult]:
+        """Verdict from the pre-filter or the verdict cache, if either can decide the message."""
+        text = record["text"]
+        if self.prefilter is not None and (verdict := self.prefilter.classify(text)):
+            return ScreeningResult(tenant, str(record["id"]), verdict, source="prefilter")
+        if self.verdict_cache is not None and (verdict := self.verdict_cache.get(text)):
+            return ScreeningResult(tenant, str(record["id"]), verdict, source="cached")
+        return None
+
+    def _screen_batch(self, tenant: str, batch: list[dict]) -> list[ScreeningResult]:
+        if len(batch) == 1:
+            return [self._screen_one(tenant, batch[0])]
+
+        try:
+            response = self._invoke(_batch_prompt([record["text"] for record in batch]))
+        except Exception as e:
+            logger.error(f"Error screening a batch of {len(batch)} messages for {tenant}: {str(e)}")
+            return [ScreeningResult(tenant, str(record["id"]), error=str(e)) for record in batch]
+
+        blocks = extract_all_xml(response.content, "result")
+        results = []
+        for index, record in enumerate(batch, 1):
+            block = blocks.get(str(index))
+            if block is None or extract_xml(block, "status") is None:
+                results.append(self._screen_one(tenant, record))
+            else:
+                results.append(self._verdict_result(tenant, record, block))
+        return results
+
+    def _screen_one(self, tenant: str, record: dict) -> ScreeningResult:
+        """Screen a message on its own, with the same prompt as the interactive safety check."""
+        try:
+            response = self._invoke(_single_prompt(record["text"]))
+        except Exception as e:
+            logger.error(f"Error screening message {record['id']} for {tenant}: {str(e)}")
+            return ScreeningResult(tenant, str(record["id"]), error=str(e))
+        if extract_xml(response.content, "status") is None:
+            return ScreeningResult(tenant, str(record["id"]), error="Response has no <status>")
+        return self._verdict_result(tenant, record, response.content)
+
+    def _invoke(self, messages):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.llm.invoke(messages)
+
+    def _verdict_result(self, tenant: str, record: dict, content: str) -> ScreeningResult:
+        verdict = SafetyVerdict.from_xml(content)
+        if self.verdict_cache is not None:
+            self.verdict_cache.set(record["text"], verdict)
+        return ScreeningResult(tenant, str(record["id"]), verdict)
+
+
+def _single_prompt(text: str):
+    return [system_prompt(SAFETY_PROMPT), HumanMessage(content=f"User message to analyze: {text}")]
+
+
+def _batch_prompt(texts: list[str]):
+    """Prompt assessing ``texts`` in one request; ids are positions, and text is escaped so it cannot close its tag."""
+    messages = "\n\n".join(f'<message id="{index}">{escape(text)}</message>' for index, text in enumerate(texts, 1))
+    return [
+        system_prompt(f"{SAFETY_PROMPT}\n\n{SAFETY_BATCH_INSTRUCTIONS}"),
+        HumanMessage(content=f"User messages to analyze:\n\n{messages}"),
+    ]
+
+
+def _screened_keys(path: Path) -> set[tuple[str, str]]:
+    """(tenant, id) of the messages a results file holds a verdict for; unreadable lines are ignored."""
+    if not path.exists():
+        return set()
+    keys = set()
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "status" in result:
+                keys.add((result["tenant"], result["id"]))
+    return keys
+
+
+def _ends_with_newline(path: Path) -> bool:
+    with path.open("rb") as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
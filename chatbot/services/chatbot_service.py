@@ -1,21 +1,179 @@
-from chatbot.services.graph_builder import GraphBuilder, LLMFactory
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.messages import HumanMessage
+
+from chatbot.services import sse
+from chatbot.services.admission import ReplayUnavailable, StreamHub
+from chatbot.services.checkpoint_compaction import CheckpointCompactor, CompactionScheduler
+from chatbot.services.checkpoint_storage import PooledSqliteSaver, get_checkpointer
+from chatbot.services.context_window import ContextWindow
+from chatbot.services.graph_builder import AsyncGraphProvider, GraphBuilder, LLMFactory
+from chatbot.services.llm_clients import NodeModels
+from chatbot.services.message_index import MessageIndex
+from chatbot.services.prefilter import get_safety_prefilter
+from chatbot.services.response_cache import get_response_cache
 from chatbot.services.response_streamer import ResponseStreamer
+from chatbot.services.safety_cache import get_verdict_cache
+from chatbot.services.safety_events import get_safety_event_writer
 from chatbot.services.state_manager import StateManager
+from chatbot.services.thread_locks import ThreadLocks
+
+logger = logging.getLogger(__name__)
+
+# Thread read during warm-up to open the checkpoint database; it is never written
+WARM_UP_THREAD_ID = "__warm_up__"
+
+
+@dataclass(frozen=True)
+class TurnStream:
+    """Response text stream of a turn, starting after its first ``start`` chunks.
+
+    ``turn_id`` is None when the turn cannot be resumed.
+    """
+
+    turn_id: Optional[str]
+    start: int
+    chunks: object
 
 
 class ChatbotService:
     """Main chatbot service orchestrating conversation management."""
 
-    def __init__(self):
-        # Initialize components
-        self.llm = LLMFactory.create_llm()
-        self.graph = GraphBuilder(self.llm).build_graph()
-        self.state_manager = StateManager(self.graph)
-        self.response_streamer = ResponseStreamer(self.graph, self.state_manager)
+    def __init__(self, llm=None, checkpointer=None):
+        from django.conf import settings
+
+        speculative = getattr(settings, "CHATBOT_SPECULATIVE_EXECUTION", False)
 
-    def stream_response(self, user_message: str, user):
+        # Initialize components; an injected model serves every node
+        self.models = NodeModels.uniform(llm) if llm is not None else LLMFactory.create_node_models()
+        self.llm = self.models.get("chatbot")
+
+        # With the SQLite backend sync requests share a connection pool and async
+        # requests open their own aiosqlite connection to the same file. The Django
+        # backend, or an injected checkpointer, serves both.
+        if checkpointer is None:
+            checkpointer = get_checkpointer()
+            pooled = isinstance(checkpointer, PooledSqliteSaver)
+        else:
+            pooled = False
+        self.graph = GraphBuilder(
+            self.models,
+            speculative=speculative,
+            context_window=ContextWindow.from_settings(),
+            verdict_cache=get_verdict_cache(),
+            prefilter=get_safety_prefilter(),
+            event_writer=get_safety_event_writer(),
+            response_cache=get_response_cache(),
+        ).build_graph(checkpointer)
+        self.async_graph = (
+            AsyncGraphProvider(self.graph, db_path=checkpointer.path, busy_timeout_ms=checkpointer.busy_timeout_ms)
+            if pooled
+            else AsyncGraphProvider(self.graph)
+        )
+        self.message_index = MessageIndex() if getattr(settings, "CHATBOT_MESSAGE_INDEX", False) else None
+
+        # Optional periodic checkpoint compaction for the pooled database
+        self.compaction = None
+        interval = getattr(settings, "CHATBOT_CHECKPOINT_COMPACTION_INTERVAL", None)
+        if pooled and interval:
+            compactor = CheckpointCompactor.from_settings(
+                checkpointer, on_thread_deleted=self.message_index.clear if self.message_index is not None else None
+            )
+            self.compaction = CompactionScheduler(compactor, interval)
+            self.compaction.start()
+
+        self.state_manager = StateManager(
+            self.graph, self.async_graph, self.message_index, thread_locks=ThreadLocks.from_settings()
+        )
+        self.response_streamer = ResponseStreamer(
+            self.graph,
+            self.state_manager,
+            speculative=speculative,
+            async_graph=self.async_graph,
+            flush_chars=getattr(settings, "CHATBOT_STREAM_FLUSH_CHARS", 0),
+            flush_interval=getattr(settings, "CHATBOT_STREAM_FLUSH_MS", 0) / 1000,
+            cancel_on_disconnect=getattr(settings, "CHATBOT_STREAM_CANCEL_ON_DISCONNECT", False),
+            buffer_chunks=getattr(settings, "CHATBOT_STREAM_BUFFER_CHUNKS", 0),
+        )
+        self.stream_hub = StreamHub.from_settings()
+
+    def warm_up(self, ping=False):
+        """Do the first-use work now instead of on the first request.
+
+        Reading a thread opens the checkpoint database and creates its tables. With
+        ``ping``, a one-token completion also establishes the HTTP connection (DNS,
+        TLS and the client's connection pool) to the model provider for each node's
+        client; these are billed requests.
+        """
+        self.graph.get_state({"configurable": {"thread_id": WARM_UP_THREAD_ID}})
+        if ping:
+            for llm in self.models.distinct():
+                llm.invoke([HumanMessage(content="ping")], max_tokens=1)
+
+    def stream_response(self, user_message: str, user, timings=None, abort=None):
         """Stream a response from the chatbot for a user message."""
-        return self.response_streamer.stream_response(user_message, user)
+        return self.response_streamer.stream_response(user_message, user, timings, abort)
+
+    def astream_response(self, user_message: str, user, timings=None, abort=None):
+        """Stream a response asynchronously; for use from async views under ASGI."""
+        return self.response_streamer.astream_response(user_message, user, timings, abort)
+
+    def open_stream(self, user_message: str, user, timings=None) -> TurnStream:
+        """Admit a stream request and return its turn.
+
+        With admission control enabled this raises ``AdmissionRejected`` right away
+        when the request is over a limit, may wait in the queue for a generation
+        slot, and attaches to an identical response already in flight instead of
+        generating another.
+        """
+        if self.stream_hub is None:
+            return TurnStream(None, 0, self.stream_response(user_message, user, timings))
+        shared = self.stream_hub.open(
+            user.id, user_message, lambda shared: self.stream_response(user_message, user, shared.timings, shared.abort)
+        )
+        return TurnStream(self._resumable_id(shared), 0, shared.follow(timings))
+
+    async def aopen_stream(self, user_message: str, user, timings=None) -> TurnStream:
+        """Async variant of ``open_stream``."""
+        if self.stream_hub is None:
+            return TurnStream(None, 0, self.astream_response(user_message, user, timings))
+        shared = await self.stream_hub.aopen(
+            user.id,
+            user_message,
+            lambda shared: self.astream_response(user_message, user, shared.timings, shared.abort),
+        )
+        return TurnStream(self._resumable_id(shared), 0, shared.afollow(timings))
+
+    def resume_stream(self, user, last_event_id: str, timings=None) -> TurnStream:
+        """Continue a turn after the last event a reconnecting client received.
+
+        Replays the buffered chunks it missed, then follows the generation if it is
+        still running; the graph is not invoked again. Raises ``ReplayUnavailable``
+        if the turn cannot be resumed.
+        """
+        turn_id, start, shared = self._resume(user, last_event_id)
+        return TurnStream(turn_id, start, shared.follow(timings, start))
+
+    def aresume_stream(self, user, last_event_id: str, timings=None) -> TurnStream:
+        """Async variant of ``resume_stream``."""
+        turn_id, start, shared = self._resume(user, last_event_id)
+        return TurnStream(turn_id, start, shared.afollow(timings, start))
+
+    def _resume(self, user, last_event_id: str):
+        if self.stream_hub is None or not self.stream_hub.resumable:
+            raise ReplayUnavailable("Responses cannot be resumed, reload the page to see it.")
+        try:
+            turn_id, start = sse.parse_event_id(last_event_id)
+        except ValueError:
+            raise ReplayUnavailable(f"Invalid Last-Event-ID: {last_event_id}")
+        return turn_id, start, self.stream_hub.resume(user.id, turn_id, start)
+
+    def _resumable_id(self, shared) -> Optional[str]:
+        return shared.turn_id if self.stream_hub.resumable else None
 
     def get_conversation_state(self, user):
         """Get the current LangGraph state for a user's conversation thread."""
@@ -25,18 +183,71 @@ class ChatbotService:
         """Get conversation history from LangGraph state."""
         return self.state_manager.get_conversation_history(user, limit)
 
+    async def aget_conversation_history(self, user, limit=None):
+        """Async variant of ``get_conversation_history``."""
+        return await self.state_manager.aget_conversation_history(user, limit)
+
+    def get_history_page(self, user, before=None, limit=50):
+        """Get one page of conversation history and the cursor for the page before it."""
+        return self.state_manager.get_history_page(user, before, limit)
+
+    async def aget_history_page(self, user, before=None, limit=50):
+        """Async variant of ``get_history_page``."""
+        return await self.state_manager.aget_history_page(user, before, limit)
+
     def clear_conversation(self, user):
         """Clear all messages from a user's conversation."""
         return self.state_manager.clear_conversation(user)
 
+    async def aclear_conversation(self, user):
+        """Async variant of ``clear_conversation``."""
+        return await self.state_manager.aclear_conversation(user)
+
 
 # Global chatbot instance (initialized once)
 _chatbot_instance = None
+_chatbot_lock = threading.Lock()
+
+# Warm-up progress, reported by the readiness endpoint
+_warm_up = {"status": "cold", "seconds": None, "pinged": False, "error": None}
 
 
 def get_chatbot():
-    """Get or create the global chatbot instance."""
+    """Get or create the global chatbot instance.
+
+    Concurrent first calls build a single instance: the others wait for it.
+    """
     global _chatbot_instance
     if _chatbot_instance is None:
-        _chatbot_instance = ChatbotService()
+        with _chatbot_lock:
+            if _chatbot_instance is None:
+                _chatbot_instance = ChatbotService()
     return _chatbot_instance
+
+
+def warm_up(ping=False):
+    """Build the global chatbot and do its first-use work ahead of the first request.
+
+    Errors are logged and reported through ``get_readiness`` instead of raised; the
+    first request will then retry the build lazily.
+    """
+    _warm_up.update(status="warming", error=None)
+    start = time.perf_counter()
+    try:
+        get_chatbot().warm_up(ping=ping)
+    except Exception as e:
+        logger.error(f"Chatbot warm-up failed: {str(e)}")
+        _warm_up.update(status="cold", error=str(e))
+        return
+
+    _warm_up.update(status="warm", seconds=round(time.perf_counter() - start, 3), pinged=ping)
+    logger.info(f"Chatbot warmed up in {_warm_up['seconds']}s")
+
+
+def get_readiness():
+    """Whether this worker's chatbot is built: "warm", "warming" or "cold"."""
+    readiness = dict(_warm_up)
+    if readiness["status"] == "cold" and _chatbot_instance is not None:
+        # Built lazily by a request rather than by warm-up
+        readiness["status"] = "warm"
+    return readiness
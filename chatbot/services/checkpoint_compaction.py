@@ -0,0 +1,231 @@
+import logging
+import threading
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from chatbot.constants import CLEARED_METADATA_KEY
+from chatbot.services.thread_locks import ThreadBusyError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompactionReport:
+    """Outcome of one compaction pass."""
+
+    threads_deleted: int = 0
+    checkpoints_deleted: int = 0
+    writes_deleted: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    deleted_threads: list[str] = field(default_factory=list)
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return max(self.bytes_before - self.bytes_after, 0)
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "bytes_reclaimed": self.bytes_reclaimed}
+
+
+class CheckpointCompactor:
+    """Bounds the size of a ``SqliteSaver`` checkpoint database.
+
+    Every checkpoint written by the SQLite saver is a full snapshot of the thread's
+    state, so only the newest one is needed to resume a conversation. A pass:
+
+    - hard-deletes threads whose latest checkpoint was written by a user clearing
+      the conversation (marked in its metadata) or is older than ``idle_ttl``
+      seconds;
+    - keeps the newest ``keep_latest`` checkpoints of every other thread, along
+      with their pending writes, and deletes the rest;
+    - returns up to ``vacuum_pages`` free pages to the filesystem (all of them
+      when None) and truncates the WAL.
+
+    Threads are processed one at a time in short transactions, so live requests
+    are only briefly blocked on the write lock. A thread is only deleted if no
+    checkpoint was written after the one checked, and, with ``thread_locks``,
+    while holding its lease; a thread with a turn running is left for the next
+    pass. ``on_thread_deleted`` is called with the ID of every deleted thread,
+    e.g. to drop derived indexes.
+
+    Incremental vacuuming needs ``auto_vacuum=INCREMENTAL``, which a database
+    created before it was configured only gets from a full ``VACUUM``. That
+    rewrites the whole file while blocking every writer, so it only runs with
+    ``full_vacuum``, as the management command sets; periodic passes skip it.
+    """
+
+    def __init__(
+        self,
+        saver,
+        keep_latest: int = 3,
+        idle_ttl: Optional[int] = None,
+        vacuum_pages: Optional[int] = None,
+        on_thread_deleted=None,
+        thread_locks=None,
+        full_vacuum: bool = False,
+    ):
+        if keep_latest < 1:
+            raise ValueError("keep_latest must be at least 1")
+        self.saver = saver
+        self.keep_latest = keep_latest
+        self.idle_ttl = idle_ttl
+        self.vacuum_pages = vacuum_pages
+        self.on_thread_deleted = on_thread_deleted
+        self.thread_locks = thread_locks
+        self.full_vacuum = full_vacuum
+        self._warned_full_vacuum = False
+
+    @classmethod
+    def from_settings(cls, saver, on_thread_deleted=None, full_vacuum=False):
+        """Build a compactor for ``saver`` using the retention policy and thread locks in settings."""
+        from django.conf import settings
+
+        from chatbot.services.thread_locks import ThreadLocks
+
+        return cls(
+            saver,
+            keep_latest=getattr(settings, "CHATBOT_CHECKPOINT_KEEP_LATEST", 3),
+            idle_ttl=getattr(settings, "CHATBOT_CHECKPOINT_IDLE_TTL", None),
+            vacuum_pages=getattr(settings, "CHATBOT_CHECKPOINT_VACUUM_PAGES", None),
+            on_thread_deleted=on_thread_deleted,
+            thread_locks=ThreadLocks.from_settings(),
+            full_vacuum=full_vacuum,
+        )
+
+    def compact(self) -> CompactionReport:
+        """Run one compaction pass and report what it removed."""
+        report = CompactionReport(bytes_before=self.database_size())
+
+        with self.saver.cursor(transaction=False) as cur:
+            cur.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints")
+            namespaces = cur.fetchall()
+
+        expire_before = datetime.now(timezone.utc) - timedelta(seconds=self.idle_ttl) if self.idle_ttl else None
+        for thread_id in sorted({thread_id for thread_id, _ns in namespaces}):
+            if (checkpoint_id := self._expired_checkpoint(thread_id, expire_before)) is not None:
+                self._delete_thread(thread_id, checkpoint_id, report)
+
+        deleted = set(report.deleted_threads)
+        for thread_id, checkpoint_ns in namespaces:
+            if thread_id not in deleted:
+                self._trim(thread_id, checkpoint_ns, report)
+
+        self._vacuum()
+        report.bytes_after = self.database_size()
+        logger.info(
+            f"Checkpoint compaction: deleted {report.threads_deleted} threads, "
+            f"{report.checkpoints_deleted} checkpoints, reclaimed {report.bytes_reclaimed} bytes"
+        )
+        return report
+
+    def database_size(self) -> int:
+        """Size of the main database file in bytes, excluding the WAL."""
+        with self.saver.cursor(transaction=False) as cur:
+            page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def _expired_checkpoint(self, thread_id: str, expire_before: Optional[datetime]) -> Optional[str]:
+        """ID of the thread's latest checkpoint if the thread was cleared or has been idle past the TTL, else None.
+
+        A thread without messages is not necessarily cleared: a new thread's first
+        checkpoint holds only the turn's input, before any node has run.
+        """
+        latest = self.saver.get_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+        if latest is None:
+            return None
+        cleared = bool(latest.metadata.get(CLEARED_METADATA_KEY))
+        idle = expire_before is not None and datetime.fromisoformat(latest.checkpoint["ts"]) < expire_before
+        return latest.config["configurable"]["checkpoint_id"] if cleared or idle else None
+
+    def _delete_thread(self, thread_id: str, checkpoint_id: str, report: CompactionReport):
+        """Delete a thread whose latest checkpoint is still ``checkpoint_id``, holding its lease if locks are used."""
+        try:
+            with self.thread_locks.hold(thread_id, timeout=0) if self.thread_locks is not None else nullcontext():
+                with self.saver.cursor() as cur:
+                    # One statement, so a checkpoint written since the check keeps the thread
+                    cur.execute(
+                        "DELETE FROM checkpoints WHERE thread_id = ? AND NOT EXISTS "
+                        "(SELECT 1 FROM checkpoints WHERE thread_id = ? AND checkpoint_id > ?)",
+                        (thread_id, thread_id, checkpoint_id),
+                    )
+                    if not cur.rowcount:
+                        return
+                    report.checkpoints_deleted += cur.rowcount
+                    cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                    report.writes_deleted += cur.rowcount
+        except ThreadBusyError:
+            logger.info(f"Not deleting {thread_id}: a turn is running on it")
+            return
+        report.threads_deleted += 1
+        report.deleted_threads.append(thread_id)
+        if self.on_thread_deleted is not None:
+            self.on_thread_deleted(thread_id)
+
+    def _trim(self, thread_id: str, checkpoint_ns: str, report: CompactionReport):
+        """Delete everything older than the thread's ``keep_latest``-th newest checkpoint."""
+        with self.saver.cursor() as cur:
+            cur.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                (thread_id, checkpoint_ns, self.keep_latest - 1),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return
+            params = (thread_id, checkpoint_ns, row[0])
+            cur.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params
+            )
+            report.checkpoints_deleted += cur.rowcount
+            cur.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params)
+            report.writes_deleted += cur.rowcount
+
+    def _vacuum(self):
+        """Release free pages incrementally, converting the database first with ``full_vacuum``."""
+        with self.saver.cursor(transaction=False) as cur:
+            if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if not self.full_vacuum:
+                    if not self._warned_full_vacuum:
+                        self._warned_full_vacuum = True
+                        logger.warning(
+                            "Checkpoint database is not in incremental auto-vacuum mode; "
+                            "run manage.py compact_checkpoints once to convert it"
+                        )
+                else:
+                    # auto_vacuum only takes effect after a full VACUUM; this runs once per database
+                    logger.info("Switching checkpoint database to incremental auto-vacuum")
+                    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    cur.execute("VACUUM")
+            else:
+                pages = f"({int(self.vacuum_pages)})" if self.vacuum_pages else ""
+                cur.execute(f"PRAGMA incremental_vacuum{pages}").fetchall()
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+class CompactionScheduler:
+    """Runs a compactor periodically on a daemon thread."""
+
+    def __init__(self, compactor: CheckpointCompactor, interval: float):
+        self.compactor = compactor
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="checkpoint-compaction", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compactor.compact()
+            except Exception as e:
+                logger.error(f"Checkpoint compaction failed: {str(e)}")
@@ -0,0 +1,426 @@
+"""Compact, dictionary-compressed serialization of checkpoint blobs.
+
+LangGraph's default serializer stores every message as its module path, class
+name and full field dump, so a long thread repeats the same empty
+``additional_kwargs``, ``response_metadata`` and default fields once per message
+in every checkpoint. ``CompactSerializer`` stores a message as its class name,
+content, ID and only the fields that differ from their defaults, in msgpack.
+
+With a trained ``CompressionDictionary`` every blob is also compressed with it:
+zstd when ``zstandard`` is installed, zlib with a preset dictionary otherwise. A
+dictionary trained on this deployment's own payloads already holds the framing
+and metadata they share, which is what makes even a single-message write
+compress well. Compressed blobs are typed with the dictionary's ID, so blobs
+written with an earlier dictionary stay readable as long as its file is kept.
+
+Blobs written by LangGraph's serializer (``msgpack``, ``json``, ...) are read as
+before, so the serializer can be switched on for an existing database;
+``manage.py migrate_checkpoints`` rewrites the stored blobs in the new format.
+"""
+
+import hashlib
+import logging
+import threading
+import zlib
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import ormsgpack
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    ChatMessage,
+    ChatMessageChunk,
+    FunctionMessage,
+    FunctionMessageChunk,
+    HumanMessage,
+    HumanMessageChunk,
+    RemoveMessage,
+    SystemMessage,
+    SystemMessageChunk,
+    ToolMessage,
+    ToolMessageChunk,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+logger = logging.getLogger(__name__)
+
+COMPACT_TYPE = "compact"
+
+# Extension types of the compact encoding
+EXT_MESSAGE = 64
+EXT_FALLBACK = 65
+
+MESSAGE_CLASSES = {
+    cls.__name__: cls
+    for cls in (
+        AIMessage,
+        AIMessageChunk,
+        ChatMessage,
+        ChatMessageChunk,
+        FunctionMessage,
+        FunctionMessageChunk,
+        HumanMessage,
+        HumanMessageChunk,
+        RemoveMessage,
+        SystemMessage,
+        SystemMessageChunk,
+        ToolMessage,
+        ToolMessageChunk,
+    )
+}
+
+# As in LangGraph's encoding, types msgpack would silently turn into strings or
+# dicts go through the default hook, so they come back as the same type
+PACK_OPTIONS = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+    | ormsgpack.OPT_PASSTHROUGH_ENUM
+    | ormsgpack.OPT_PASSTHROUGH_UUID
+)
+
+# Blobs shorter than this are not worth a compression frame
+MIN_COMPRESS_BYTES = 64
+
+# zlib only looks back this far, so a longer preset dictionary is wasted
+ZLIB_WINDOW = 32 * 1024
+
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class CompressionDictionary:
+    """A trained compression dictionary and the codec it is used with ("zstd" or "zlib").
+
+    Compressors are kept per thread, as zstd contexts must not be shared.
+    """
+
+    def __init__(self, codec: str, data: bytes, level: int = 3):
+        if codec not in ("zstd", "zlib"):
+            raise ValueError(f"Unknown compression codec: {codec!r}")
+        self.codec = codec
+        self.data = data
+        self.level = level
+        self.id = hashlib.sha256(data).hexdigest()[:12]
+        self.name = f"{codec}:{self.id}"
+        self._local = threading.local()
+        if codec == "zstd":
+            import zstandard
+
+            self._zstd_data = zstandard.ZstdCompressionDict(data)
+            self._zstd_data.precompute_compress(level=level)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.codec == "zlib":
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.data)
+            return compressor.compress(data) + compressor.flush()
+        if not hasattr(self._local, "compressor"):
+            import zstandard
+
+            self._local.compressor = zstandard.ZstdCompressor(dict_data=self._zstd_data)
+        return self._local.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.codec == "zlib":
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=self.data)
+            return decompressor.decompress(data) + decompressor.flush()
+        if not hasattr(self._local, "decompressor"):
+            import zstandard
+
+            self._local.decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_data)
+        return self._local.decompressor.decompress(data)
+
+    @classmethod
+    def train(cls, samples: list[bytes], size: int = 64 * 1024, codec: Optional[str] = None, level: int = 3):
+        """Train a dictionary of up to ``size`` bytes on sample blobs, with zstd when it is installed."""
+        codec = codec or ("zstd" if zstd_available() else "zlib")
+        if codec == "zstd":
+            import zstandard
+
+            data = zstandard.train_dictionary(size, samples).as_bytes()
+        else:
+            data = _zlib_dictionary(samples, min(size, ZLIB_WINDOW))
+        return cls(codec, data, level)
+
+
+def _zlib_dictionary(samples: list[bytes], size: int) -> bytes:
+    """Preset zlib dictionary: the samples' most common 64-byte blocks, the most common last.
+
+    Deflate codes nearer matches more cheaply, so the most useful strings go at the end.
+    """
+    blocks = Counter(sample[i : i + 64] for sample in samples for i in range(0, len(sample) - 63, 32))
+    chosen, total = [], 0
+    for block, _ in blocks.most_common():
+        if total + len(block) > size:
+            break
+        chosen.append(block)
+        total += len(block)
+    return b"".join(reversed(chosen))
+
+
+class DictionaryStore:
+    """Trained dictionaries kept as ``<codec>-<id>.dict`` files in a directory.
+
+    The newest is used to compress; all of them are kept for reading.
+    """
+
+    def __init__(self, directory, level: int = 3):
+        self.directory = Path(directory)
+        self.level = level
+
+    def load(self) -> list[CompressionDictionary]:
+        """Every stored dictionary, oldest first."""
+        if not self.directory.is_dir():
+            return []
+        files = sorted(self.directory.glob("*.dict"), key=lambda path: path.stat().st_mtime)
+        dictionaries = []
+        for path in files:
+            codec = path.stem.split("-", 1)[0]
+            if codec == "zstd" and not zstd_available():
+                logger.warning(f"Skipping {path.name}: zstandard is not installed")
+                continue
+            dictionaries.append(CompressionDictionary(codec, path.read_bytes(), self.level))
+        return dictionaries
+
+    def save(self, dictionary: CompressionDictionary) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{dictionary.codec}-{dictionary.id}.dict"
+        path.write_bytes(dictionary.data)
+        return path
+
+
+class CompactSerializer:
+    """Checkpoint serializer writing compact msgpack, compressed with ``compressor`` when given.
+
+    ``dictionaries`` are the ones to read with in addition to ``compressor``.
+    Objects the compact encoding has no form for are embedded as encoded by
+    LangGraph's serializer, which also reads every blob not written here.
+    """
+
+    def __init__(
+        self,
+        compressor: Optional[CompressionDictionary] = None,
+        dictionaries: tuple = (),
+        min_compress_bytes: int = MIN_COMPRESS_BYTES,
+    ):
+        self.compressor = compressor
+        self.min_compress_bytes = min_compress_bytes
+        self.fallback = JsonPlusSerializer()
+        self._dictionaries = {dictionary.name: dictionary for dictionary in dictionaries}
+        if compressor is not None:
+            self._dictionaries[compressor.name] = compressor
+
+    @classmethod
+    def from_settings(cls) -> "CompactSerializer":
+        """Build the serializer compressing with the newest dictionary in ``CHATBOT_CHECKPOINT_DICTIONARY_DIR``."""
+        from django.conf import settings
+
+        directory = getattr(settings, "CHATBOT_CHECKPOINT_DICTIONARY_DIR", None)
+        if not directory:
+            return cls()
+        dictionaries = DictionaryStore(directory, getattr(settings, "CHATBOT_CHECKPOINT_COMPRESSION_LEVEL", 3)).load()
+        return cls(dictionaries[-1] if dictionaries else None, dictionaries)
+
+    def dumps(self, obj) -> bytes:
+        return self.fallback.dumps(obj)
+
+    def loads(self, data: bytes):
+        return self.fallback.loads(data)
+
+    def dumps_typed(self, obj) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return self.fallback.dumps_typed(obj)
+        try:
+            data = self.pack(obj)
+        except ormsgpack.MsgpackEncodeError:
+            # e.g. strings that are not valid UTF-8
+            return self.fallback.dumps_typed(obj)
+        if self.compressor is None or len(data) < self.min_compress_bytes:
+            return COMPACT_TYPE, data
+        return f"{COMPACT_TYPE}+{self.compressor.name}", self.compressor.compress(data)
+
+    def loads_typed(self, data: tuple[str, bytes]):
+        type_, payload = data
+        encoding, _, dictionary = type_.partition("+")
+        if encoding != COMPACT_TYPE:
+            return self.fallback.loads_typed(data)
+        if dictionary:
+            payload = self._dictionary(dictionary).decompress(payload)
+        return ormsgpack.unpackb(payload, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+    def pack(self, obj) -> bytes:
+        """The uncompressed compact encoding of ``obj``, e.g. as a dictionary training sample."""
+        return ormsgpack.packb(obj, default=self._default, option=PACK_OPTIONS)
+
+    def _default(self, obj):
+        if MESSAGE_CLASSES.get(type(obj).__name__) is type(obj):
+            fields = obj.model_dump(exclude_defaults=True, exclude={"content", "id", "type"})
+            return ormsgpack.Ext(EXT_MESSAGE, self.pack([type(obj).__name__, obj.content, obj.id, fields]))
+        return ormsgpack.Ext(EXT_FALLBACK, ormsgpack.packb(self.fallback.dumps_typed(obj)))
+
+    def _ext_hook(self, code: int, data: bytes):
+        if code == EXT_MESSAGE:
+            name, content, id, fields = ormsgpack.unpackb(
+                data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS
+            )
+            # Validation runs in pydantic-core, which is faster than ``model_construct``
+            return MESSAGE_CLASSES[name](content=content, id=id, **fields)
+        if code == EXT_FALLBACK:
+            return self.fallback.loads_typed(tuple(ormsgpack.unpackb(data)))
+        raise ValueError(f"Unknown msgpack extension type in checkpoint: {code}")
+
+    def _dictionary(self, name: str) -> CompressionDictionary:
+        dictionary = self._dictionaries.get(name)
+        if dictionary is None:
+            raise ValueError(
+                f"Checkpoint blob compressed with unknown dictionary {name}; "
+                "is it in CHATBOT_CHECKPOINT_DICTIONARY_DIR?"
+            )
+        return dictionary
+
+
+def get_checkpoint_serde():
+    """The checkpoint serializer configured in settings; None for LangGraph's default."""
+    from django.conf import settings
+
+    serializer = getattr(settings, "CHATBOT_CHECKPOINT_SERIALIZER", "jsonplus")
+    if serializer == "jsonplus":
+        return None
+    if serializer == "compact":
+        return CompactSerializer.from_settings()
+    raise ValueError(f"Unknown CHATBOT_CHECKPOINT_SERIALIZER: {serializer!r}")
+
+
+@dataclass
+class MigrationReport:
+    """Outcome of rewriting the stored checkpoint blobs."""
+
+    checkpoints: int = 0
+    writes: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class CheckpointMigrator:
+    """Re-encodes the checkpoint and pending write blobs of a saver.
+
+    Blobs are read with ``reader``, which reads every format, and written with
+    ``writer``, in batches of ``batch_size`` rows, each in its own short
+    transaction. Works on the SQLite and Django savers.
+    """
+
+    def __init__(self, saver, reader: CompactSerializer, writer, batch_size: int = 500):
+        self.saver = saver
+        self.reader = reader
+        self.writer = writer
+        self.batch_size = batch_size
+
+    def samples(self, limit: int) -> list[bytes]:
+        """Compact encodings of up to ``limit`` stored blobs, newest first, to train a dictionary on."""
+        samples = []
+        # Half checkpoints, half pending writes, which are mostly single messages
+        for table in self._tables():
+            for _, type_, blob in table.newest(limit // 2):
+                if type_ is not None:
+                    samples.append(self.reader.pack(self.reader.loads_typed((type_, bytes(blob)))))
+        return samples
+
+    def migrate(self) -> MigrationReport:
+        report = MigrationReport()
+        for name, table in zip(("checkpoints", "writes"), self._tables()):
+            for batch in table.batches(self.batch_size):
+                updates = []
+                for key, type_, blob in batch:
+                    if type_ is None:
+                        continue
+                    blob = bytes(blob)
+                    new_type, new_blob = self.writer.dumps_typed(self.reader.loads_typed((type_, blob)))
+                    report.bytes_before += len(blob)
+                    report.bytes_after += len(new_blob)
+                    if (new_type, new_blob) != (type_, blob):
+                        updates.append((key, new_type, new_blob))
+                table.update(updates)
+                setattr(report, name, getattr(report, name) + len(updates))
+        return report
+
+    def _tables(self):
+        from chatbot.services.checkpoint_storage import DjangoCheckpointSaver
+
+        if isinstance(self.saver, DjangoCheckpointSaver):
+            return [_DjangoBlobs(self.saver._checkpoints(), "checkpoint"), _DjangoBlobs(self.saver._writes(), "value")]
+        return [_SqliteBlobs(self.saver, "checkpoints", "checkpoint"), _SqliteBlobs(self.saver, "writes", "value")]
+
+
+class _SqliteBlobs:
+    """Typed blob column of a SQLite saver table, addressed by rowid."""
+
+    def __init__(self, saver, table: str, column: str):
+        self.saver = saver
+        self.table = table
+        self.column = column
+
+    def newest(self, limit: int) -> list:
+        with self.saver.cursor(transaction=False) as cur:
+            cur.execute(f"SELECT rowid, type, {self.column} FROM {self.table} ORDER BY rowid DESC LIMIT ?", (limit,))
+            return cur.fetchall()
+
+    def batches(self, size: int):
+        last = 0
+        while True:
+            with self.saver.cursor(transaction=False) as cur:
+                cur.execute(
+                    f"SELECT rowid, type, {self.column} FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, size),
+                )
+                rows = cur.fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+    def update(self, rows: list):
+        if not rows:
+            return
+        with self.saver.cursor() as cur:
+            cur.executemany(
+                f"UPDATE {self.table} SET type = ?, {self.column} = ? WHERE rowid = ?",
+                [(type_, blob, key) for key, type_, blob in rows],
+            )
+
+
+class _DjangoBlobs:
+    """Typed blob field of a Django checkpoint model, addressed by primary key."""
+
+    def __init__(self, queryset, field: str):
+        self.queryset = queryset
+        self.field = field
+
+    def newest(self, limit: int) -> list:
+        return list(self.queryset.order_by("-pk").values_list("pk", "type", self.field)[:limit])
+
+    def batches(self, size: int):
+        last = 0
+        while True:
+            rows = list(self.queryset.filter(pk__gt=last).order_by("pk").values_list("pk", "type", self.field)[:size])
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+    def update(self, rows: list):
+        from django.db import transaction
+
+        with transaction.atomic(using=self.queryset.db):
+            for key, type_, blob in rows:
+                self.queryset.filter(pk=key).update(**{"type": type_, self.field: blob})
@@ -0,0 +1,407 @@
+import json
+import queue
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import aiosqlite
+from asgiref.sync import sync_to_async
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from chatbot.services.checkpoint_serde import get_checkpoint_serde
+from chatbot.services.metrics import timed
+
+# Applied to every checkpoint connection. WAL lets readers proceed while a writer
+# commits, and synchronous=NORMAL drops the per-commit fsync (a crash can lose the
+# last few checkpoints but never corrupts the database). auto_vacuum only applies
+# to new databases; CheckpointCompactor converts existing ones.
+SQLITE_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -8000,  # KiB, per connection
+}
+
+
+def _pragma_script(busy_timeout_ms: int) -> str:
+    pragmas = {**SQLITE_PRAGMAS, "busy_timeout": busy_timeout_ms}
+    return "".join(f"PRAGMA {name}={value};" for name, value in pragmas.items())
+
+
+def connect(path, busy_timeout_ms: int = 5000) -> sqlite3.Connection:
+    """Open a checkpoint connection with the tuned pragmas applied."""
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+    conn.executescript(_pragma_script(busy_timeout_ms))
+    return conn
+
+
+async def aconnect(path, busy_timeout_ms: int = 5000) -> aiosqlite.Connection:
+    """Async variant of ``connect`` for ``AsyncSqliteSaver``."""
+    conn = aiosqlite.connect(path, timeout=busy_timeout_ms / 1000)
+    # The saver commits every write, so the connection thread must not hold up
+    # interpreter shutdown when the server exits without closing the loop cleanly.
+    conn.daemon = True
+    await conn
+    await conn.executescript(_pragma_script(busy_timeout_ms))
+    return conn
+
+
+class TimedCheckpointMixin:
+    """Records sync checkpoint reads as ``get_state`` and writes as ``checkpoint_write`` turn phases.
+
+    Only calls made on behalf of a measured turn are timed; see ``metrics.timed``.
+    """
+
+    def get_tuple(self, config):
+        with timed(config, "get_state", "checkpointer"):
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with timed(config, "checkpoint_write", "checkpointer"):
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with timed(config, "checkpoint_write", "checkpointer"):
+            return super().put_writes(config, writes, task_id, task_path)
+
+
+class PooledSqliteSaver(TimedCheckpointMixin, SqliteSaver):
+    """``SqliteSaver`` backed by a pool of connections instead of one shared connection.
+
+    The stock saver serializes every read and write behind a single lock on a single
+    connection. Here each operation checks a connection out of the pool for its
+    duration, so reads run concurrently and writers only contend on SQLite's own
+    WAL write lock, waiting up to ``busy_timeout_ms`` for it. At most
+    ``pool_size`` connections are opened; further callers wait for one to be
+    returned.
+    """
+
+    def __init__(self, path, pool_size: int = 8, busy_timeout_ms: int = 5000, *, serde=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        super().__init__(self._open(), serde=serde)
+
+    @classmethod
+    def from_settings(cls):
+        """Build the saver for the checkpoint database configured in settings."""
+        from django.conf import settings
+
+        return cls(
+            getattr(settings, "CHATBOT_CHECKPOINT_PATH", "chatguard_checkpoints.sqlite"),
+            pool_size=getattr(settings, "CHATBOT_CHECKPOINT_POOL_SIZE", 8),
+            busy_timeout_ms=getattr(settings, "CHATBOT_CHECKPOINT_BUSY_TIMEOUT_MS", 5000),
+            serde=get_checkpoint_serde(),
+        )
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection checked out by the current thread.
+
+        ``SqliteSaver.list`` opens a second cursor on ``self.conn`` while inside
+        ``cursor()``, so this must resolve to the connection that call checked out.
+        """
+        stack = getattr(self._local, "stack", None)
+        if not stack:
+            raise RuntimeError("No checkpoint connection is checked out by this thread")
+        return stack[-1]
+
+    @conn.setter
+    def conn(self, conn: sqlite3.Connection):
+        # Assigned by SqliteSaver.__init__; the connection simply joins the pool.
+        self._idle.put(conn)
+
+    def _open(self) -> sqlite3.Connection:
+        with self._pool_lock:
+            self._opened += 1
+        return connect(self.path, self.busy_timeout_ms)
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            can_open = self._opened < self.pool_size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            return connect(self.path, self.busy_timeout_ms)
+        return self._idle.get()
+
+    def setup(self) -> None:
+        with self.lock:
+            super().setup()
+
+    @contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[sqlite3.Cursor]:
+        conn = self._checkout()
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(conn)
+        try:
+            if not self.is_setup:
+                self.setup()
+            cur = conn.cursor()
+            try:
+                yield cur
+                if transaction:
+                    conn.commit()
+            except BaseException:
+                if transaction:
+                    conn.rollback()
+                raise
+            finally:
+                cur.close()
+        finally:
+            # ``list`` is a generator, so check-ins need not be in LIFO order
+            stack.remove(conn)
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection in the pool; connections in use are left open."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class TimedAsyncSqliteSaver(AsyncSqliteSaver):
+    """``AsyncSqliteSaver`` recording the same turn phases as ``TimedCheckpointMixin``.
+
+    Only the async methods are timed; the sync ones delegate to them.
+    """
+
+    async def aget_tuple(self, config):
+        with timed(config, "get_state", "checkpointer"):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with timed(config, "checkpoint_write", "checkpointer"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with timed(config, "checkpoint_write", "checkpointer"):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+
+class DjangoCheckpointSaver(BaseCheckpointSaver[str]):
+    """Checkpoint saver storing LangGraph checkpoints in a Django database.
+
+    Checkpoints and pending writes go to the ``GraphCheckpoint`` and
+    ``GraphCheckpointWrite`` tables of the ``using`` database alias, laid out like
+    the SQLite saver's tables, so every worker process on every host configured
+    with the same ``DATABASES`` entry sees the same conversation state. Django
+    manages the connections: one per thread, opened on first use. The async
+    methods run the sync ones through ``sync_to_async``, like the message index,
+    and reads and writes are timed as the same turn phases as the SQLite savers.
+    """
+
+    def __init__(self, using: str = "default", *, serde=None):
+        super().__init__(serde=serde)
+        self.using = using
+
+    @classmethod
+    def from_settings(cls):
+        """Build the saver for the checkpoint database alias configured in settings."""
+        from django.conf import settings
+
+        return cls(getattr(settings, "CHATBOT_CHECKPOINT_DATABASE", "default"), serde=get_checkpoint_serde())
+
+    def _checkpoints(self):
+        from chatbot.models import GraphCheckpoint
+
+        return GraphCheckpoint.objects.using(self.using)
+
+    def _writes(self):
+        from chatbot.models import GraphCheckpointWrite
+
+        return GraphCheckpointWrite.objects.using(self.using)
+
+    def get_tuple(self, config):
+        with timed(config, "get_state", "checkpointer"):
+            configurable = config["configurable"]
+            rows = self._checkpoints().filter(
+                thread_id=str(configurable["thread_id"]), checkpoint_ns=configurable.get("checkpoint_ns", "")
+            )
+            if checkpoint_id := get_checkpoint_id(config):
+                rows = rows.filter(checkpoint_id=checkpoint_id)
+            row = rows.order_by("-checkpoint_id").first()
+            return self._tuple(row) if row is not None else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        rows = self._checkpoints().order_by("-checkpoint_id")
+        if config is not None:
+            configurable = config["configurable"]
+            rows = rows.filter(thread_id=str(configurable["thread_id"]))
+            if (checkpoint_ns := configurable.get("checkpoint_ns")) is not None:
+                rows = rows.filter(checkpoint_ns=checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                rows = rows.filter(checkpoint_id=checkpoint_id)
+        if before is not None:
+            rows = rows.filter(checkpoint_id__lt=get_checkpoint_id(before))
+
+        # Metadata is stored serialized, so a metadata filter is applied here
+        # rather than in the query, and ``limit`` only after it
+        if limit and not filter:
+            rows = rows[:limit]
+        matched = 0
+        for row in rows.iterator():
+            checkpoint_tuple = self._tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            matched += 1
+            if limit and matched >= limit:
+                return
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        from chatbot.models import GraphCheckpoint
+
+        with timed(config, "checkpoint_write", "checkpointer"):
+            configurable = config["configurable"]
+            type_, serialized = self.serde.dumps_typed(checkpoint)
+            row = GraphCheckpoint(
+                thread_id=str(configurable["thread_id"]),
+                checkpoint_ns=configurable["checkpoint_ns"],
+                checkpoint_id=checkpoint["id"],
+                parent_checkpoint_id=configurable.get("checkpoint_id"),
+                type=type_,
+                checkpoint=serialized,
+                # JSON, as the SQLite saver stores it
+                metadata=json.dumps(get_checkpoint_metadata(config, metadata), ensure_ascii=False).encode(
+                    "utf-8", "ignore"
+                ),
+            )
+            # INSERT OR REPLACE, in one statement
+            self._checkpoints().bulk_create(
+                [row],
+                update_conflicts=True,
+                unique_fields=["thread_id", "checkpoint_ns", "checkpoint_id"],
+                update_fields=["parent_checkpoint_id", "type", "checkpoint", "metadata"],
+            )
+            return {
+                "configurable": {
+                    "thread_id": configurable["thread_id"],
+                    "checkpoint_ns": configurable["checkpoint_ns"],
+                    "checkpoint_id": checkpoint["id"],
+                }
+            }
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        from chatbot.models import GraphCheckpointWrite
+
+        with timed(config, "checkpoint_write", "checkpointer"):
+            configurable = config["configurable"]
+            rows = []
+            for idx, (channel, value) in enumerate(writes):
+                type_, serialized = self.serde.dumps_typed(value)
+                rows.append(
+                    GraphCheckpointWrite(
+                        thread_id=str(configurable["thread_id"]),
+                        checkpoint_ns=str(configurable["checkpoint_ns"]),
+                        checkpoint_id=str(configurable["checkpoint_id"]),
+                        task_id=task_id,
+                        idx=WRITES_IDX_MAP.get(channel, idx),
+                        channel=channel,
+                        type=type_,
+                        value=serialized,
+                    )
+                )
+            # Special channels (errors, interrupts) replace earlier writes; regular
+            # writes are kept from the first attempt, as in the SQLite saver
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes):
+                conflicts = {
+                    "update_conflicts": True,
+                    "unique_fields": ["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"],
+                    "update_fields": ["channel", "type", "value"],
+                }
+            else:
+                conflicts = {"ignore_conflicts": True}
+            self._writes().bulk_create(rows, **conflicts)
+
+    def delete_thread(self, thread_id: str) -> None:
+        from django.db import transaction
+
+        with transaction.atomic(using=self.using):
+            self._checkpoints().filter(thread_id=str(thread_id)).delete()
+            self._writes().filter(thread_id=str(thread_id)).delete()
+
+    async def aget_tuple(self, config):
+        return await sync_to_async(self.get_tuple)(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoint_tuples = await sync_to_async(
+            lambda: [*self.list(config, filter=filter, before=before, limit=limit)]
+        )()
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await sync_to_async(self.put)(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await sync_to_async(self.put_writes)(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await sync_to_async(self.delete_thread)(thread_id)
+
+    def get_next_version(self, current, channel) -> str:
+        # Same version format as the SQLite saver
+        current_v = 0 if current is None else current if isinstance(current, int) else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def _tuple(self, row) -> CheckpointTuple:
+        config = {
+            "configurable": {
+                "thread_id": row.thread_id,
+                "checkpoint_ns": row.checkpoint_ns,
+                "checkpoint_id": row.checkpoint_id,
+            }
+        }
+        writes = self._writes().filter(
+            thread_id=row.thread_id, checkpoint_ns=row.checkpoint_ns, checkpoint_id=row.checkpoint_id
+        )
+        return CheckpointTuple(
+            config,
+            self.serde.loads_typed((row.type, bytes(row.checkpoint))),
+            json.loads(bytes(row.metadata)) if row.metadata is not None else {},
+            (
+                {"configurable": {**config["configurable"], "checkpoint_id": row.parent_checkpoint_id}}
+                if row.parent_checkpoint_id
+                else None
+            ),
+            [
+                (task_id, channel, self.serde.loads_typed((type_, bytes(value))))
+                for task_id, channel, type_, value in writes.order_by("task_id", "idx").values_list(
+                    "task_id", "channel", "type", "value"
+                )
+            ],
+        )
+
+
+def get_checkpointer():
+    """Build the checkpoint saver for the backend configured in settings."""
+    from django.conf import settings
+
+    backend = getattr(settings, "CHATBOT_CHECKPOINT_BACKEND", "sqlite")
+    if backend == "sqlite":
+        return PooledSqliteSaver.from_settings()
+    if backend == "django":
+        return DjangoCheckpointSaver.from_settings()
+    raise ValueError(f"Unknown CHATBOT_CHECKPOINT_BACKEND: {backend!r}")
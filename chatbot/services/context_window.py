@@ -0,0 +1,119 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from langchain_core.messages import SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from chatbot.constants import CONVERSATION_SUMMARY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ContextWindow:
+    """Token/message budget for the conversation sent to the domain agent.
+
+    Messages that fall out of the budget are folded into a running summary by the
+    context node. Once the budget is exceeded the window is trimmed to
+    ``refill_ratio`` of it, so summarization runs every few turns rather than on
+    every turn.
+    """
+
+    max_messages: Optional[int] = None
+    max_tokens: Optional[int] = None
+    refill_ratio: float = 0.5
+
+    @classmethod
+    def from_settings(cls):
+        """Build the window from Django settings, or return None when windowing is disabled."""
+        from django.conf import settings
+
+        max_messages = getattr(settings, "CHATBOT_CONTEXT_MAX_MESSAGES", None)
+        max_tokens = getattr(settings, "CHATBOT_CONTEXT_MAX_TOKENS", None)
+        if max_messages is None and max_tokens is None:
+            return None
+        return cls(max_messages=max_messages, max_tokens=max_tokens)
+
+    def unsummarized_start(self, messages, summarized_through: Optional[str]) -> int:
+        """Index of the first message not yet folded into the summary."""
+        if summarized_through is None:
+            return 0
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].id == summarized_through:
+                return index + 1
+        # The boundary message is gone (e.g. the thread was cleared)
+        return 0
+
+    def overflow_end(self, messages, start: int) -> int:
+        """Index up to which ``messages[start:]`` must be folded into the summary.
+
+        Returns ``start`` when the unsummarized messages fit the budget. Otherwise
+        returns the start of a window trimmed to ``refill_ratio`` of the budget,
+        moved forward to a user message so the window never opens mid-exchange.
+        """
+        if self._fits(messages[start:], 1.0):
+            return start
+
+        # Walk back from the newest message while the trimmed budget allows
+        end = len(messages)
+        tokens = 0
+        while end > start:
+            message_tokens = count_tokens_approximately([messages[end - 1]])
+            if not self._within(len(messages) - end + 1, tokens + message_tokens, self.refill_ratio):
+                break
+            tokens += message_tokens
+            end -= 1
+
+        # Always keep the newest message, and open the window on a user message
+        end = min(end, len(messages) - 1)
+        while end < len(messages) - 1 and messages[end].type != "human":
+            end += 1
+        return end
+
+    def prompt_messages(self, state) -> list:
+        """Messages to send to the domain agent: the running summary plus the live window."""
+        messages = state["messages"]
+        start = self.unsummarized_start(messages, state.get("summarized_through"))
+        window = messages[start:]
+        summary = state.get("summary")
+        if not summary:
+            return window
+
+        prompt = [_summary_message(summary)] + window
+        logger.info(f"Context window: {len(window)} of {len(messages)} messages")
+        return prompt
+
+    def summarized_tokens(self, state, start: int, end: int) -> int:
+        """Approximate tokens of ``messages[:end]`` once they are folded into the summary.
+
+        Builds on the count stored with the previous fold, so only the newly folded
+        messages are counted; threads summarized before the count was stored are
+        counted in full once.
+        """
+        messages = state["messages"]
+        previous = state.get("summarized_tokens") if start else 0
+        if previous is None:
+            previous = count_tokens_approximately(messages[:start])
+        return previous + count_tokens_approximately(messages[start:end])
+
+    def tokens_saved(self, state) -> int:
+        """Approximate input tokens the summary saves on this turn's prompt, 0 without a stored count."""
+        summary, summarized = state.get("summary"), state.get("summarized_tokens")
+        if not summary or summarized is None:
+            return 0
+        return max(0, summarized - count_tokens_approximately([_summary_message(summary)]))
+
+    def _fits(self, messages, ratio: float) -> bool:
+        return self._within(len(messages), count_tokens_approximately(messages), ratio)
+
+    def _within(self, message_count: int, tokens: int, ratio: float) -> bool:
+        if self.max_messages is not None and message_count > self.max_messages * ratio:
+            return False
+        if self.max_tokens is not None and tokens > self.max_tokens * ratio:
+            return False
+        return True
+
+
+def _summary_message(summary: str) -> SystemMessage:
+    return SystemMessage(content=f"{CONVERSATION_SUMMARY_PREFIX}\n\n{summary}")
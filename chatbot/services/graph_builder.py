@@ -1,27 +1,123 @@
-import sqlite3
+import asyncio
+import weakref
+from contextlib import contextmanager
+from functools import partial
 
-from langchain.chat_models import init_chat_model
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, START, StateGraph
 
-from chatbot.services.agents.domain_agent import domain_agent
-from chatbot.services.agents.safety_agent import safety_agent
+from chatbot.services.agents.cache_agent import acache_agent, cache_agent
+from chatbot.services.agents.context_agent import acontext_agent, context_agent
+from chatbot.services.agents.domain_agent import (
+    adomain_agent,
+    aspeculative_domain_agent,
+    commit_speculative_response,
+    domain_agent,
+    speculative_domain_agent,
+)
+from chatbot.services.agents.safety_agent import asafety_agent, safety_agent
+from chatbot.services.checkpoint_storage import PooledSqliteSaver, TimedAsyncSqliteSaver, aconnect
+from chatbot.services.llm_clients import LLMConfig, NodeModels
 from chatbot.services.state import State
 
 
 class GraphBuilder:
-    """Responsible for building and configuring the LangGraph conversation graph."""
+    """Responsible for building and configuring the LangGraph conversation graph.
 
-    def __init__(self, llm):
-        self.llm = llm
+    ``llm`` is either one model for every node or the ``NodeModels`` giving each
+    node its own model, concurrency limit and resilience policy. With a
+    ``response_cache``, a cache node answers repeated first-turn questions
+    before the domain agent does.
+    """
 
-    def build_graph(self):
+    def __init__(
+        self,
+        llm,
+        speculative=False,
+        context_window=None,
+        verdict_cache=None,
+        prefilter=None,
+        event_writer=None,
+        response_cache=None,
+    ):
+        self.models = llm if isinstance(llm, NodeModels) else NodeModels.uniform(llm)
+        self.speculative = speculative
+        self.context_window = context_window
+        self.verdict_cache = verdict_cache
+        self.prefilter = prefilter
+        self.event_writer = event_writer
+        self.response_cache = response_cache
+
+    def build_graph(self, checkpointer=None):
         """Build the complete conversation graph with safety and domain agents."""
         graph_builder = StateGraph(State)
-        
+
+        if self.speculative:
+            self._add_speculative_flow(graph_builder)
+        else:
+            self._add_sequential_flow(graph_builder)
+
+        # Add checkpointer for state persistence
+        if checkpointer is None:
+            checkpointer = PooledSqliteSaver.from_settings()
+
+        return graph_builder.compile(checkpointer=checkpointer)
+
+    def _node(self, node, func, afunc, **kwargs):
+        """Wrap an agent as a graph node with native sync and async entry points, on the node's model."""
+        llm = self.models.get(node)
+        func, afunc = partial(func, llm=llm, **kwargs), partial(afunc, llm=llm, **kwargs)
+        if limit := self.models.limit(node):
+            func, afunc = limit.limit(func), limit.alimit(afunc)
+        return RunnableLambda(func, afunc=afunc)
+
+    def _safety_node(self):
+        """Wrap the safety agent together with its local pre-filter, verdict cache and event writer."""
+        return self._node(
+            "safety",
+            safety_agent,
+            asafety_agent,
+            verdict_cache=self.verdict_cache,
+            prefilter=self.prefilter,
+            event_writer=self.event_writer,
+            resilience=self.models.resilience("safety"),
+        )
+
+    def _cache_node(self):
+        """Wrap the response cache lookup; it calls no model, so it has no limit of its own."""
+        options = {"response_cache": self.response_cache, "speculative": self.speculative}
+        return RunnableLambda(partial(cache_agent, **options), afunc=partial(acache_agent, **options))
+
+    def _add_domain_nodes(self, graph_builder, func, afunc):
+        """Add the domain agent, preceded by the context window node when windowing is enabled.
+
+        Returns the name of the node the domain branch starts at.
+        """
+        graph_builder.add_node(
+            "chatbot",
+            self._node(
+                "chatbot",
+                func,
+                afunc,
+                context_window=self.context_window,
+                resilience=self.models.resilience("chatbot"),
+                response_cache=self.response_cache,
+            ),
+        )
+        if self.context_window is None:
+            return "chatbot"
+
+        graph_builder.add_node(
+            "context", self._node("context", context_agent, acontext_agent, context_window=self.context_window)
+        )
+        graph_builder.add_edge("context", "chatbot")
+        return "context"
+
+    def _add_sequential_flow(self, graph_builder):
+        """Run the safety check to completion before the domain agent starts."""
         # Add nodes
-        graph_builder.add_node("safety", lambda state: safety_agent(state, self.llm))
-        graph_builder.add_node("chatbot", lambda state: domain_agent(state, self.llm))
+        graph_builder.add_node("safety", self._safety_node())
+        domain_entry = self._add_domain_nodes(graph_builder, domain_agent, adomain_agent)
 
         # Define conditional flow
         def should_continue(state):
@@ -31,28 +127,110 @@ class GraphBuilder:
                 return "end"
             return "continue"
 
-        # Define graph flow: START -> safety -> (conditional) -> chatbot/END
+        # Define graph flow: START -> safety -> (conditional) -> [cache -> (conditional) ->] [context ->] chatbot/END
         graph_builder.add_edge(START, "safety")
-        graph_builder.add_conditional_edges("safety", should_continue, {"continue": "chatbot", "end": END})
+        if self.response_cache is not None:
+            # Only approved messages reach the cache, which ends the run with a hit
+            graph_builder.add_node("cache", self._cache_node())
+            graph_builder.add_conditional_edges("safety", should_continue, {"continue": "cache", "end": END})
+            graph_builder.add_conditional_edges("cache", should_continue, {"continue": domain_entry, "end": END})
+        else:
+            graph_builder.add_conditional_edges("safety", should_continue, {"continue": domain_entry, "end": END})
         graph_builder.add_edge("chatbot", END)
 
-        # Add checkpointer for state persistence
-        conn = sqlite3.connect("chatguard_checkpoints.sqlite", check_same_thread=False)
-        checkpointer = SqliteSaver(conn)
+    def _add_speculative_flow(self, graph_builder):
+        """Run the safety check and the domain agent in parallel, joining on the verdict."""
+        graph_builder.add_node("safety", self._safety_node())
+        domain_entry = self._add_domain_nodes(graph_builder, speculative_domain_agent, aspeculative_domain_agent)
+        graph_builder.add_node("commit", partial(commit_speculative_response, response_cache=self.response_cache))
 
-        return graph_builder.compile(checkpointer=checkpointer)
+        # Define graph flow: START -> (safety | [cache ->] [context ->] chatbot) -> commit -> END
+        graph_builder.add_edge(START, "safety")
+        if self.response_cache is not None:
+            # A hit is parked like a generated draft and published only on APPROVE
+            graph_builder.add_node("cache", self._cache_node())
+            graph_builder.add_edge(START, "cache")
+            graph_builder.add_edge("cache", domain_entry)
+        else:
+            graph_builder.add_edge(START, domain_entry)
+        graph_builder.add_edge(["safety", "chatbot"], "commit")
+        graph_builder.add_edge("commit", END)
+
+
+class AsyncGraphProvider:
+    """Provides a copy of the compiled graph backed by an async checkpointer.
+
+    ``AsyncSqliteSaver`` is bound to the event loop it was created on, so one saver
+    (and one aiosqlite connection) is opened lazily per running loop. Under an ASGI
+    server there is a single loop and therefore a single connection. Graphs compiled
+    with an injected checkpointer are assumed to support async access already and
+    are returned unchanged.
+    """
+
+    def __init__(self, graph, db_path=None, busy_timeout_ms=5000):
+        self.graph = graph
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._graphs = weakref.WeakKeyDictionary()
+
+    async def get(self):
+        """Return the graph bound to an async checkpointer for the running loop."""
+        if self.db_path is None:
+            return self.graph
+
+        loop = asyncio.get_running_loop()
+        graph = self._graphs.get(loop)
+        if graph is not None:
+            return graph
+
+        conn = await aconnect(self.db_path, self.busy_timeout_ms)
+        # Another coroutine may have finished connecting while this one awaited
+        if (graph := self._graphs.get(loop)) is not None:
+            await conn.close()
+            return graph
+
+        # Same serializer as the sync saver, so both read what the other writes
+        saver = TimedAsyncSqliteSaver(conn, serde=self.graph.checkpointer.serde)
+        graph = self.graph.copy(update={"checkpointer": saver})
+        self._graphs[loop] = graph
+        return graph
 
 
 class LLMFactory:
     """Factory for creating and configuring language models."""
 
+    _override = None
+
+    @classmethod
+    @contextmanager
+    def override(cls, llm):
+        """Make ``create_llm`` return ``llm`` inside the block, e.g. a scripted model for benchmarks."""
+        previous, cls._override = cls._override, llm
+        try:
+            yield llm
+        finally:
+            cls._override = previous
+
+    @classmethod
+    def create_llm(cls, node: str = "chatbot"):
+        """Create the language model configured for ``node`` in ``CHATBOT_LLM_MODELS``."""
+        if cls._override is not None:
+            return cls._override
+        return cls._create(LLMConfig.from_settings(node))
+
+    @classmethod
+    def create_node_models(cls) -> NodeModels:
+        """Create the model of every node, with the concurrency limits configured in settings."""
+        if cls._override is not None:
+            return NodeModels.uniform(cls._override)
+        return NodeModels.from_settings(cls._create)
+
     @staticmethod
-    def create_llm():
-        """Create and configure the language model."""
+    def _create(config: LLMConfig):
         from django.conf import settings
-        
+
         api_key = getattr(settings, "ANTHROPIC_API_KEY", None)
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY not set in Django settings")
-        
-        return init_chat_model("anthropic:claude-3-5-sonnet-latest")
\ No newline at end of file
+
+        return config.create_llm()
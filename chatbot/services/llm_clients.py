@@ -0,0 +1,237 @@
+"""Per-node language model clients.
+
+The safety check, conversation summaries, the domain agent and bulk screening
+each run on a client of their own, configured in ``CHATBOT_LLM_MODELS``, so a
+small fast model can classify messages while a large one answers them. Every
+client has its own timeout, output token cap and retries, optionally an HTTP
+connection pool of its own, and a node can cap the calls it has in flight per
+worker process, so a burst on one node cannot take up the connections or the
+provider rate limit of another.
+Deadlines, hedging and circuit breaking per node are configured separately in
+``CHATBOT_LLM_RESILIENCE`` (see ``chatbot.services.resilience``).
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Optional
+
+from chatbot.services.metrics import LLM_CALLS_IN_FLIGHT, timed
+from chatbot.services.resilience import Resilience
+from chatbot.services.utils import node_settings
+
+logger = logging.getLogger(__name__)
+
+# Graph nodes calling a model, plus bulk screening
+NODES = ("safety", "context", "chatbot", "screening")
+
+DEFAULT_MODEL = "anthropic:claude-3-5-sonnet-latest"
+
+# ChatAnthropic builds its SDK clients in these cached properties and offers no
+# option to pass an HTTP client in, so MAX_CONNECTIONS is opt-in and checked
+# against them at runtime
+CLIENT_PROPERTIES = ("_client_params", "_client", "_async_client")
+
+
+@dataclass(frozen=True)
+class LLMConfig:
+    """Client options of one node, from its entry in ``CHATBOT_LLM_MODELS`` merged over ``"default"``."""
+
+    model: str = DEFAULT_MODEL
+    timeout: Optional[float] = 60
+    max_tokens: Optional[int] = None
+    max_retries: int = 2
+    max_connections: Optional[int] = None
+    max_concurrency: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls, node: str) -> "LLMConfig":
+        options = node_settings("CHATBOT_LLM_MODELS", node)
+        return cls(**{key.lower(): value for key, value in options.items()})
+
+    def create_llm(self):
+        """Create a model client with these options."""
+        from langchain.chat_models import init_chat_model
+
+        options = {"timeout": self.timeout, "max_tokens": self.max_tokens, "max_retries": self.max_retries}
+        llm = init_chat_model(self.model, **{key: value for key, value in options.items() if value is not None})
+        if self.max_connections:
+            _use_connection_pool(llm, self.max_connections)
+        return llm
+
+
+def _use_connection_pool(llm, max_connections: int):
+    """Give an Anthropic model HTTP clients of its own with at most ``max_connections`` connections.
+
+    langchain-anthropic otherwise shares one pool between every model with the same
+    base URL and timeout. Other providers keep their default pool, and so does an
+    Anthropic model whose client properties are not the ones this relies on.
+    """
+    try:
+        import anthropic
+        import httpx
+        from langchain_anthropic import ChatAnthropic
+    except ImportError:
+        return
+    if not isinstance(llm, ChatAnthropic):
+        return
+    if not all(isinstance(getattr(type(llm), name, None), cached_property) for name in CLIENT_PROPERTIES):
+        logger.warning(
+            f"{type(llm).__name__} no longer builds its clients in {', '.join(CLIENT_PROPERTIES)}; "
+            f"MAX_CONNECTIONS={max_connections} is ignored and the model shares the default connection pool"
+        )
+        return
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    params = llm._client_params
+    options = {"limits": limits, "timeout": params.get("timeout", anthropic.DEFAULT_TIMEOUT)}
+    if llm.anthropic_proxy:
+        options["proxy"] = llm.anthropic_proxy
+    # The clients are cached properties built on first use; setting them first replaces the shared pool
+    llm.__dict__["_client"] = anthropic.Client(**params, http_client=anthropic.DefaultHttpxClient(**options))
+    llm.__dict__["_async_client"] = anthropic.AsyncClient(
+        **params, http_client=anthropic.DefaultAsyncHttpxClient(**options)
+    )
+
+
+class _Waiter:
+    __slots__ = ("notify", "granted")
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class ConcurrencyLimit:
+    """Caps the calls of a node running at once in a worker, across threads and event loops.
+
+    Calls over the limit wait, in arrival order, for a running one to finish.
+    """
+
+    def __init__(self, node: str, max_concurrency: int):
+        self.node = node
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+
+    def acquire(self):
+        event = threading.Event()
+        if self._reserve(event.set) is not None:
+            event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._reserve(lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None:
+            return
+        try:
+            await event.wait()
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self._active -= 1
+            LLM_CALLS_IN_FLIGHT.set(self._active, node=self.node)
+
+    def limit(self, func):
+        """Wrap a node function so each call holds a slot; waiting is timed as the ``llm_queue`` phase."""
+
+        def run(state, config=None):
+            with timed(config, "llm_queue", self.node):
+                self.acquire()
+            try:
+                return func(state, config=config)
+            finally:
+                self.release()
+
+        return run
+
+    def alimit(self, afunc):
+        """Async variant of ``limit``."""
+
+        async def run(state, config=None):
+            with timed(config, "llm_queue", self.node):
+                await self.aacquire()
+            try:
+                return await afunc(state, config=config)
+            finally:
+                self.release()
+
+        return run
+
+    def _reserve(self, notify) -> Optional[_Waiter]:
+        """Take a slot now and return None, or queue the call and return its waiter."""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                LLM_CALLS_IN_FLIGHT.set(self._active, node=self.node)
+                return None
+            waiter = _Waiter(notify)
+            self._waiters.append(waiter)
+            return waiter
+
+
+class NodeModels:
+    """The model client, optional concurrency limit and optional resilience policy of each node.
+
+    Nodes configured identically share one client. A limit covers a node's run in
+    the graph; safety reasoning still read after the verdict is outside it, and so
+    are calls abandoned by the node's resilience policy.
+    """
+
+    def __init__(self, models: dict, limits: Optional[dict] = None, resilience: Optional[dict] = None):
+        self.models = models
+        self.limits = limits or {}
+        self.policies = resilience or {}
+
+    @classmethod
+    def uniform(cls, llm) -> "NodeModels":
+        """Every node on the same model without limits, e.g. an injected model in benchmarks."""
+        return cls({node: llm for node in NODES})
+
+    @classmethod
+    def from_settings(cls, create_llm) -> "NodeModels":
+        """Build the clients configured in settings, creating each with ``create_llm(config)``."""
+        configs = {node: LLMConfig.from_settings(node) for node in NODES}
+        clients = {}
+        for config in configs.values():
+            if config not in clients:
+                clients[config] = create_llm(config)
+        models = {node: clients[config] for node, config in configs.items()}
+        limits = {
+            node: ConcurrencyLimit(node, config.max_concurrency)
+            for node, config in configs.items()
+            if config.max_concurrency
+        }
+        policies = {node: policy for node in NODES if (policy := Resilience.from_settings(node)) is not None}
+        return cls(models, limits, policies)
+
+    def get(self, node: str):
+        return self.models[node]
+
+    def limit(self, node: str) -> Optional[ConcurrencyLimit]:
+        return self.limits.get(node)
+
+    def resilience(self, node: str) -> Optional[Resilience]:
+        return self.policies.get(node)
+
+    def distinct(self) -> list:
+        """Each client once, e.g. to open their connections at startup."""
+        return list({id(llm): llm for llm in self.models.values()}.values())
@@ -0,0 +1,94 @@
+import logging
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+from chatbot.models import ConversationMessage
+from chatbot.services.utils import message_role
+
+logger = logging.getLogger(__name__)
+
+
+class MessageIndex:
+    """Reads and maintains the ``ConversationMessage`` index of each thread.
+
+    Pages are addressed by message position: ``page(thread_id, before=p)`` returns
+    the newest messages older than position ``p`` and a cursor for the page before
+    it. When an update cannot be applied cleanly (a failed turn, or two turns on
+    the same thread racing for positions) the thread's rows are dropped so the
+    next read rebuilds them from the checkpoint. Turns are only appended to a
+    thread that is already indexed: an empty index says nothing about the
+    messages checkpointed before the turn, so it is left for that rebuild.
+    """
+
+    def page(self, thread_id: str, before: Optional[int] = None, limit: int = 50):
+        """Return ``(messages, next_cursor)``, oldest first, as ``position``/``role``/``content`` dicts.
+
+        ``next_cursor`` is the ``before`` value for the preceding page, or None when
+        this page reaches the start of the conversation.
+        """
+        rows = ConversationMessage.objects.filter(thread_id=thread_id)
+        if before is not None:
+            rows = rows.filter(position__lt=before)
+        page = list(rows.order_by("-position").values("position", "role", "content")[: limit + 1])
+
+        next_cursor = page[limit - 1]["position"] if len(page) > limit else None
+        return page[:limit][::-1], next_cursor
+
+    def is_empty(self, thread_id: str) -> bool:
+        return not ConversationMessage.objects.filter(thread_id=thread_id).exists()
+
+    def append(self, thread_id: str, messages):
+        """Index messages appended to a thread by one turn, unless the thread is not indexed yet."""
+        rows = [self._row(thread_id, 0, message) for message in messages]
+        if not rows:
+            return
+        try:
+            with transaction.atomic():
+                last = ConversationMessage.objects.filter(thread_id=thread_id).aggregate(last=Max("position"))["last"]
+                if last is None:
+                    return
+                for position, row in enumerate(rows, last + 1):
+                    row.position = position
+                ConversationMessage.objects.bulk_create(rows)
+        except IntegrityError:
+            logger.warning(f"Message index conflict on {thread_id}; it will be rebuilt from the checkpoint")
+            self.clear(thread_id)
+
+    def rebuild(self, thread_id: str, messages):
+        """Replace a thread's rows with the given full message list."""
+        with transaction.atomic():
+            ConversationMessage.objects.filter(thread_id=thread_id).delete()
+            ConversationMessage.objects.bulk_create(
+                [self._row(thread_id, position, message) for position, message in enumerate(messages)]
+            )
+
+    def clear(self, thread_id: str):
+        ConversationMessage.objects.filter(thread_id=thread_id).delete()
+
+    async def apage(self, thread_id: str, before: Optional[int] = None, limit: int = 50):
+        return await sync_to_async(self.page)(thread_id, before, limit)
+
+    async def ais_empty(self, thread_id: str) -> bool:
+        return await sync_to_async(self.is_empty)(thread_id)
+
+    async def aappend(self, thread_id: str, messages):
+        await sync_to_async(self.append)(thread_id, messages)
+
+    async def arebuild(self, thread_id: str, messages):
+        await sync_to_async(self.rebuild)(thread_id, messages)
+
+    async def aclear(self, thread_id: str):
+        await sync_to_async(self.clear)(thread_id)
+
+    @staticmethod
+    def _row(thread_id: str, position: int, message) -> ConversationMessage:
+        return ConversationMessage(
+            thread_id=thread_id,
+            position=position,
+            message_id=message.id or "",
+            role=message_role(message),
+            content=message.text(),
+        )
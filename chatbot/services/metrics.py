@@ -0,0 +1,332 @@
+"""In-process latency histograms and token counters in Prometheus text format.
+
+Metrics are per worker process, like the safety cache counters, so every worker
+must be scraped to get the full picture. Recording a phase is a ``perf_counter``
+pair, a bisect and a locked increment, cheap enough to leave on in production.
+``CHATBOT_METRICS_ENABLED = False`` turns it off entirely.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from operator import itemgetter
+from typing import Optional
+
+from chatbot.constants import TURN_METRICS_KEY
+from chatbot.services.prompt_cache import input_tokens_saved
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames):
+    """Return a function mapping label keyword arguments to the tuple of label values."""
+    if len(labelnames) > 1:
+        return itemgetter(*labelnames)
+    if labelnames:
+        name = labelnames[0]
+        return lambda labels: (labels[name],)
+    return lambda labels: ()
+
+
+def _format_labels(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with a fixed set of labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._key = _label_key(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+
+
+class Gauge:
+    """Value that goes up and down, with a fixed set of labels."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._key = _label_key(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of labels."""
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._key = _label_key(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last slot is +Inf), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                labels = _format_labels((*self.labelnames, "le"), (*key, le))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {total:.6f}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PHASE_SECONDS = REGISTRY.histogram(
+    "chatguard_phase_seconds",
+    "Duration of each phase of a chat turn, by graph node ('graph' for pipeline-level phases).",
+    labelnames=("phase", "node"),
+)
+LLM_TOKENS = REGISTRY.counter(
+    "chatguard_llm_tokens_total",
+    "Tokens reported in LLM response usage metadata, by graph node and token type.",
+    labelnames=("node", "type"),
+)
+LLM_CALLS_IN_FLIGHT = REGISTRY.gauge(
+    "chatguard_llm_calls_in_flight", "Node runs holding a slot of the node's concurrency limit.", labelnames=("node",)
+)
+LLM_HEDGES = REGISTRY.counter(
+    "chatguard_llm_hedges_total",
+    "Hedged model requests, by graph node and outcome (sent, won).",
+    labelnames=("node", "outcome"),
+)
+LLM_FAILURES = REGISTRY.counter(
+    "chatguard_llm_failures_total",
+    "Model calls that failed, ran past their deadline or were refused by an open circuit, by graph node and reason.",
+    labelnames=("node", "reason"),
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "chatguard_llm_circuit_state",
+    "Circuit breaker state of a graph node: 0 closed, 1 half-open, 2 open.",
+    labelnames=("node",),
+)
+SAFETY_FAILURES = REGISTRY.counter(
+    "chatguard_safety_failures_total",
+    "Safety checks that could not reach a verdict, by the failure policy applied (open, closed).",
+    labelnames=("policy",),
+)
+TURNS = REGISTRY.counter("chatguard_turns_total", "Chat turns streamed, by outcome.", labelnames=("outcome",))
+CONTEXT_TOKENS_SAVED = REGISTRY.counter(
+    "chatguard_context_tokens_saved_total",
+    "Approximate input tokens left out of domain agent prompts by the context window, net of the summary.",
+)
+# Net prompt caching saving: saved minus write overhead, both in uncached input tokens
+PROMPT_CACHE_TOKENS_SAVED = REGISTRY.counter(
+    "chatguard_prompt_cache_tokens_saved_total",
+    "Input cost saved by reading prompt prefixes from the provider cache, in uncached input tokens, by graph node.",
+    labelnames=("node",),
+)
+PROMPT_CACHE_WRITE_OVERHEAD = REGISTRY.counter(
+    "chatguard_prompt_cache_write_overhead_tokens_total",
+    "Extra input cost of writing prompt prefixes to the provider cache, in uncached input tokens, by graph node.",
+    labelnames=("node",),
+)
+
+# Admission control in front of the response streamer (see chatbot.services.admission)
+STREAMS_IN_FLIGHT = REGISTRY.gauge("chatguard_streams_in_flight", "Responses being generated by this worker.")
+STREAM_QUEUE_DEPTH = REGISTRY.gauge("chatguard_stream_queue_depth", "Stream requests waiting for a generation slot.")
+STREAM_QUEUE_WAIT = REGISTRY.histogram(
+    "chatguard_stream_queue_wait_seconds", "Time admitted stream requests spent waiting for a generation slot."
+)
+STREAM_REJECTIONS = REGISTRY.counter(
+    "chatguard_stream_rejections_total", "Stream requests answered with 429, by reason.", labelnames=("reason",)
+)
+STREAMS_COALESCED = REGISTRY.counter(
+    "chatguard_streams_coalesced_total", "Stream requests attached to an identical response already in flight."
+)
+STREAM_RESUMES = REGISTRY.counter(
+    "chatguard_stream_resumes_total", "Reconnects with Last-Event-ID, by outcome.", labelnames=("outcome",)
+)
+STREAM_CANCELLATIONS = REGISTRY.counter(
+    "chatguard_stream_cancellations_total",
+    "Responses cut short because nobody reads them any more, by reason (disconnect, stalled).",
+    labelnames=("reason",),
+)
+STREAM_BACKPRESSURE_WAIT = REGISTRY.histogram(
+    "chatguard_stream_backpressure_wait_seconds", "Time a response generation waited for its slowest reader."
+)
+
+# Response cache for first-turn questions (see chatbot.services.response_cache)
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "chatguard_response_cache_lookups_total",
+    "Response cache lookups, by outcome (exact, near, miss).",
+    labelnames=("outcome",),
+)
+
+
+def metrics_enabled() -> bool:
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_METRICS_ENABLED", True)
+
+
+class TurnMetrics:
+    """Phase timings of a single chat turn.
+
+    Created by the response streamer for every turn while metrics are enabled and
+    carried through the graph in the run config, so agents and the checkpointer
+    can attribute their timings to the turn. Every observation also feeds the
+    process-wide histograms.
+    """
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+
+    def observe(self, phase: str, node: str, seconds: float):
+        PHASE_SECONDS.observe(seconds, phase=phase, node=node)
+        key = f"{node}.{phase}"
+        self.phases[key] = self.phases.get(key, 0.0) + seconds
+
+    def attach(self, config):
+        """Return a copy of the run config carrying this turn's metrics."""
+        return {**config, "configurable": {**config["configurable"], TURN_METRICS_KEY: self}}
+
+    def as_ms(self) -> dict:
+        return {key: round(seconds * 1000, 2) for key, seconds in self.phases.items()}
+
+
+def get_turn_metrics(config) -> Optional[TurnMetrics]:
+    """Return the turn metrics carried by a run config, or None."""
+    if not config:
+        return None
+    return config.get("configurable", {}).get(TURN_METRICS_KEY)
+
+
+class _PhaseTimer:
+    __slots__ = ("turn", "phase", "node", "start")
+
+    def __init__(self, turn: TurnMetrics, phase: str, node: str):
+        self.turn = turn
+        self.phase = phase
+        self.node = node
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.turn.observe(self.phase, self.node, time.perf_counter() - self.start)
+
+
+_NOT_TIMED = nullcontext()
+
+
+def timed(config, phase: str, node: str):
+    """Context manager timing its block as ``phase`` of ``node`` if ``config`` belongs to a measured turn.
+
+    Calls outside a turn (compaction, history reads, benchmarks driving the graph
+    directly) are not recorded.
+    """
+    turn = get_turn_metrics(config)
+    return _NOT_TIMED if turn is None else _PhaseTimer(turn, phase, node)
+
+
+def record_context_savings(config, tokens: int):
+    """Count the input tokens the context window saved on a prompt if ``config`` belongs to a measured turn."""
+    if tokens and get_turn_metrics(config) is not None:
+        CONTEXT_TOKENS_SAVED.inc(tokens)
+
+
+def record_usage(config, node: str, message):
+    """Count the tokens in a model response's ``usage_metadata`` if ``config`` belongs to a measured turn."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage or get_turn_metrics(config) is None:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), node=node, type="input")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), node=node, type="output")
+    # Prompt caching: input_tokens includes cached tokens, these say how many were read or written
+    details = usage.get("input_token_details") or {}
+    if details.get("cache_read"):
+        LLM_TOKENS.inc(details["cache_read"], node=node, type="cache_read")
+        PROMPT_CACHE_TOKENS_SAVED.inc(input_tokens_saved(details["cache_read"], 0), node=node)
+    if details.get("cache_creation"):
+        LLM_TOKENS.inc(details["cache_creation"], node=node, type="cache_write")
+        PROMPT_CACHE_WRITE_OVERHEAD.inc(-input_tokens_saved(0, details["cache_creation"]), node=node)
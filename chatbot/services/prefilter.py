@@ -0,0 +1,139 @@
+import threading
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from chatbot.constants import (
+    PREFILTER_REJECT_PHRASES,
+    PREFILTER_SAFE_MESSAGES,
+    SAFETY_STATUS_APPROVE,
+    SAFETY_STATUS_REJECT,
+)
+from chatbot.services.utils import normalize_message
+from chatbot.services.verdicts import SafetyVerdict
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton matching many phrases in a single pass over the text.
+
+    The trie and its failure links are built once, so a lookup costs O(len(text))
+    regardless of how many phrases are registered. Matches are restricted to word
+    boundaries, so "dan" does not match inside "jordan".
+    """
+
+    def __init__(self, phrases: dict[str, str]):
+        # Node 0 is the root; each node has transitions, a failure link and the
+        # (phrase, label) pairs that end at it, including those reachable via failure links.
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[tuple[str, str]]] = [[]]
+
+        for phrase, label in phrases.items():
+            self._insert(phrase, label)
+        self._link()
+
+    def _insert(self, phrase: str, label: str):
+        node = 0
+        for char in phrase:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((phrase, label))
+
+    def _link(self):
+        """Compute failure links breadth-first and merge outputs along them."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def finditer(self, text: str) -> Iterator[tuple[str, str]]:
+        """Yield ``(phrase, label)`` for every whole-word phrase occurring in ``text``."""
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for phrase, label in self._output[node]:
+                start, end = index - len(phrase) + 1, index + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    yield phrase, label
+
+    def search(self, text: str) -> Optional[tuple[str, str]]:
+        """Return the first ``(phrase, label)`` match in ``text``, or None."""
+        return next(self.finditer(text), None)
+
+
+class SafetyPrefilter:
+    """Local classification tier that runs before the LLM safety check.
+
+    Messages containing a known injection or jailbreak phrase are rejected with the
+    phrase's violation type, and short messages on the allowlist are approved.
+    Everything else is ambiguous: ``classify`` returns None and the message is
+    escalated to the LLM.
+    """
+
+    def __init__(
+        self,
+        reject_phrases: dict[str, Iterable[str]],
+        safe_messages: Iterable[str] = (),
+        max_safe_length: int = 40,
+    ):
+        self.matcher = PhraseMatcher(
+            {
+                normalize_message(phrase): violation_type
+                for violation_type, group in reject_phrases.items()
+                for phrase in group
+            }
+        )
+        self.safe_messages = frozenset(normalize_message(message) for message in safe_messages)
+        self.max_safe_length = max_safe_length
+
+    def classify(self, message: str) -> Optional[SafetyVerdict]:
+        """Return a verdict for clear-cut messages, or None to escalate to the LLM."""
+        text = normalize_message(message)
+
+        if match := self.matcher.search(text):
+            phrase, violation_type = match
+            return SafetyVerdict(
+                status=SAFETY_STATUS_REJECT,
+                violation_type=violation_type,
+                reasoning=f"Matched known {violation_type.lower()} phrase: {phrase!r}",
+            )
+
+        if len(text) <= self.max_safe_length and text in self.safe_messages:
+            return SafetyVerdict(status=SAFETY_STATUS_APPROVE, reasoning="Allowlisted message")
+
+        return None
+
+
+_prefilter = None
+_prefilter_lock = threading.Lock()
+
+
+def get_safety_prefilter() -> Optional[SafetyPrefilter]:
+    """Get the pre-filter configured in settings, or None if it is disabled."""
+    global _prefilter
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_SAFETY_PREFILTER", False):
+        return None
+
+    with _prefilter_lock:
+        if _prefilter is None:
+            _prefilter = SafetyPrefilter(
+                getattr(settings, "CHATBOT_SAFETY_PREFILTER_REJECT_PHRASES", None) or PREFILTER_REJECT_PHRASES,
+                getattr(settings, "CHATBOT_SAFETY_PREFILTER_ALLOWLIST", None) or PREFILTER_SAFE_MESSAGES,
+                max_safe_length=getattr(settings, "CHATBOT_SAFETY_PREFILTER_MAX_SAFE_LENGTH", 40),
+            )
+        return _prefilter
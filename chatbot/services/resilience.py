@@ -0,0 +1,335 @@
+"""Deadlines, hedged requests and circuit breaking around agent model calls.
+
+A ``Resilience`` policy runs one node's model call:
+
+- within the node's deadline, failing with ``DeadlineExceeded`` instead of
+  holding the request open for as long as the provider takes;
+- hedged: when the call has not finished after the recent p95 latency of the
+  node's calls, or has failed, an identical second request is sent and whichever
+  finishes first is used, cutting the tail caused by one slow request;
+- behind a circuit breaker: after ``failure_threshold`` consecutive failures the
+  node's calls fail at once with ``CircuitOpenError`` for ``reset_timeout``
+  seconds, then one probe call is let through to decide whether to close it.
+
+Sync calls run in a thread per attempt so they can be abandoned; an abandoned
+attempt finishes in the background, bounded by the client timeout, and its
+result is passed to ``discard``. Async attempts are tasks and are cancelled.
+Latencies and breaker state are per worker process.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Optional
+
+from chatbot.services.metrics import CIRCUIT_STATE, LLM_FAILURES, LLM_HEDGES
+from chatbot.services.utils import node_settings
+
+logger = logging.getLogger(__name__)
+
+# Calls observed before hedging starts, so the delay rests on a meaningful p95
+MIN_HEDGE_SAMPLES = 20
+
+# Streamed to the client token by token; a hedged duplicate would be streamed too
+UNHEDGEABLE_NODES = ("chatbot",)
+
+
+class LLMUnavailable(Exception):
+    """Raised instead of a model response when the node's call did not complete in time or is not attempted."""
+
+
+class DeadlineExceeded(LLMUnavailable):
+    """The call did not complete within the node's deadline."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    """The node's circuit breaker is open after repeated failures."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing."""
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    # Gauge values of the states
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, node: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.node = node
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; once the reset timeout has passed, one probe at a time does."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+            return self.state == self.CLOSED
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.node} closed")
+                self._set_state(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit for {self.node} opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        CIRCUIT_STATE.set(self.STATE_VALUES[state], node=self.node)
+
+
+class Resilience:
+    """Deadline, hedging and circuit breaker for the model calls of one node."""
+
+    def __init__(
+        self,
+        node: str,
+        deadline: Optional[float] = None,
+        hedge: bool = False,
+        hedge_quantile: float = 95,
+        min_hedge_delay: float = 0.05,
+        breaker: Optional[CircuitBreaker] = None,
+        window: int = 200,
+    ):
+        self.node = node
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, node: str) -> Optional["Resilience"]:
+        """Build the node's policy from ``CHATBOT_LLM_RESILIENCE``, or None if it sets none."""
+        options = node_settings("CHATBOT_LLM_RESILIENCE", node)
+        breaker = None
+        if options.get("FAILURE_THRESHOLD"):
+            breaker = CircuitBreaker(node, options["FAILURE_THRESHOLD"], options.get("RESET_TIMEOUT", 30))
+        hedge = options.get("HEDGE", False) and node not in UNHEDGEABLE_NODES
+        if not (options.get("DEADLINE") or hedge or breaker):
+            return None
+        return cls(
+            node,
+            deadline=options.get("DEADLINE"),
+            hedge=hedge,
+            hedge_quantile=options.get("HEDGE_QUANTILE", 95),
+            min_hedge_delay=options.get("MIN_HEDGE_DELAY", 0.05),
+            breaker=breaker,
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for a call before hedging it, or None while there are too few samples."""
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, max(0, round(self.hedge_quantile / 100 * len(latencies)) - 1))
+        return max(latencies[index], self.min_hedge_delay)
+
+    def call(self, fn, discard=None):
+        """Return ``fn()``, run within the deadline, hedged and guarded by the breaker.
+
+        A hedge is also sent at once when the first attempt fails. ``discard``
+        receives the result of any attempt finishing after another won or the
+        deadline passed, e.g. to close a stream it opened.
+        """
+        self._admit()
+        start = time.monotonic()
+        if self.deadline is None and not self.hedge:
+            return self._run_inline(fn, start)
+
+        attempts = [self._start(fn)]
+        hedge, hedge_at = None, self._hedge_at(start)
+        deadline_at = start + self.deadline if self.deadline else None
+        while attempts:
+            done, _ = wait(attempts, timeout=self._timeout(hedge_at, deadline_at), return_when=FIRST_COMPLETED)
+            for attempt in done:
+                attempts.remove(attempt)
+                if attempt.exception() is None:
+                    return self._won(attempt.result(), attempt is hedge, attempts, discard)
+                error = attempt.exception()
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                self._abandon(attempts, discard)
+                raise self._deadline_exceeded()
+            if self._hedge_due(hedge, hedge_at, attempts):
+                LLM_HEDGES.inc(node=self.node, outcome="sent")
+                hedge, hedge_at = self._start(fn), None
+                attempts.append(hedge)
+        self._failed("error")
+        raise error
+
+    async def acall(self, afn, discard=None):
+        """Async variant of ``call``; ``afn`` returns an awaitable and losing attempts are cancelled."""
+        self._admit()
+        start = time.monotonic()
+        if self.deadline is None and not self.hedge:
+            return await self._arun_inline(afn, start)
+
+        attempts = [self._astart(afn)]
+        hedge, hedge_at = None, self._hedge_at(start)
+        deadline_at = start + self.deadline if self.deadline else None
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts, timeout=self._timeout(hedge_at, deadline_at), return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt in done:
+                    attempts.remove(attempt)
+                    if attempt.exception() is None:
+                        return self._won(attempt.result(), attempt is hedge, attempts, discard)
+                    error = attempt.exception()
+                if deadline_at is not None and time.monotonic() >= deadline_at:
+                    raise self._deadline_exceeded()
+                if self._hedge_due(hedge, hedge_at, attempts):
+                    LLM_HEDGES.inc(node=self.node, outcome="sent")
+                    hedge, hedge_at = self._astart(afn), None
+                    attempts.append(hedge)
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+        self._failed("error")
+        raise error
+
+    def _admit(self):
+        if self.breaker is not None and not self.breaker.allow():
+            LLM_FAILURES.inc(node=self.node, reason="circuit_open")
+            raise CircuitOpenError(f"The {self.node} model is unavailable after repeated failures")
+
+    def _run_inline(self, fn, start: float):
+        try:
+            result = fn()
+        except Exception:
+            self._failed("error")
+            raise
+        self._observe(time.monotonic() - start)
+        self._succeeded()
+        return result
+
+    async def _arun_inline(self, afn, start: float):
+        try:
+            result = await afn()
+        except Exception:
+            self._failed("error")
+            raise
+        self._observe(time.monotonic() - start)
+        self._succeeded()
+        return result
+
+    def _start(self, fn) -> Future:
+        """Run an attempt in a thread of its own, in a copy of the caller's context (run config, callbacks)."""
+        future = Future()
+        context = contextvars.copy_context()
+        started = time.monotonic()
+
+        def run():
+            try:
+                future.set_result(context.run(fn))
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            self._observe(time.monotonic() - started)
+
+        threading.Thread(target=run, name=f"llm-{self.node}", daemon=True).start()
+        return future
+
+    def _astart(self, afn) -> asyncio.Task:
+        started = time.monotonic()
+
+        async def run():
+            result = await afn()
+            self._observe(time.monotonic() - started)
+            return result
+
+        return asyncio.ensure_future(run())
+
+    def _hedge_at(self, start: float) -> Optional[float]:
+        delay = self.hedge_delay()
+        if delay is None or (self.deadline is not None and delay >= self.deadline):
+            return None
+        return start + delay
+
+    @staticmethod
+    def _timeout(hedge_at: Optional[float], deadline_at: Optional[float]) -> Optional[float]:
+        moments = [moment for moment in (hedge_at, deadline_at) if moment is not None]
+        return max(min(moments) - time.monotonic(), 0) if moments else None
+
+    def _hedge_due(self, hedge, hedge_at: Optional[float], attempts: list) -> bool:
+        """Whether to send the hedge now: not sent yet, and the first attempt failed or has run past the delay."""
+        if not self.hedge or hedge is not None:
+            return False
+        return not attempts or (hedge_at is not None and time.monotonic() >= hedge_at)
+
+    def _won(self, result, hedged: bool, losers: list, discard):
+        if hedged:
+            LLM_HEDGES.inc(node=self.node, outcome="won")
+        self._abandon(losers, discard)
+        self._succeeded()
+        return result
+
+    @staticmethod
+    def _abandon(attempts: list, discard):
+        """Cancel attempts still running as tasks; pass the result of any other to ``discard`` once it has one."""
+        for attempt in attempts:
+            if isinstance(attempt, asyncio.Future) and not attempt.done():
+                attempt.cancel()
+            elif discard is not None:
+                attempt.add_done_callback(
+                    lambda future: not future.cancelled() and future.exception() is None and discard(future.result())
+                )
+
+    def _deadline_exceeded(self) -> DeadlineExceeded:
+        self._failed("deadline")
+        return DeadlineExceeded(f"The {self.node} model did not respond within {self.deadline:g}s")
+
+    def _observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _succeeded(self):
+        if self.breaker is not None:
+            self.breaker.success()
+
+    def _failed(self, reason: str):
+        LLM_FAILURES.inc(node=self.node, reason=reason)
+        if self.breaker is not None:
+            self.breaker.failure()
+
+
+def call(resilience: Optional[Resilience], fn, discard=None):
+    """``fn()`` through the node's resilience policy, or directly when it has none."""
+    return fn() if resilience is None else resilience.call(fn, discard)
+
+
+async def acall(resilience: Optional[Resilience], afn, discard=None):
+    """Async variant of ``call``."""
+    return await afn() if resilience is None else await resilience.acall(afn, discard)
@@ -0,0 +1,274 @@
+"""Response cache for first-turn questions.
+
+Many conversations open with one of a handful of questions. On a fresh thread
+(the question is the only message and there is no summary) the answer depends
+on nothing but the question, so an approved answer can be served again to the
+next user asking it. Lookups go through two tiers:
+
+- exact: the normalized question (see ``normalize_message``);
+- near-duplicate: a MinHash signature of the question's words and word pairs,
+  indexed by locality-sensitive hashing; the closest cached question whose
+  estimated Jaccard similarity reaches ``threshold`` is a hit. Word pairs keep
+  questions differing in one meaningful word ("enable" vs. "disable") apart.
+  Questions containing digits or an ``@`` (order numbers, emails, phone
+  numbers) only use the exact tier: a near duplicate differing only in the
+  identifier would be served an answer naming another user's.
+
+Fingerprints are computed locally; no embedding service is involved. The
+chunks of a cached answer are kept as the model streamed them, with the gaps
+between them, so a hit is replayed to the client the way a live answer arrives.
+Entries expire after ``ttl`` seconds and the least recently used are evicted
+beyond ``max_entries``. The cache is per worker process.
+
+The cache node only runs once the safety check has approved the message, or in
+the speculative flow publishes through the same verdict gate as a generated
+answer, and only answers to approved messages are stored.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from chatbot.services.metrics import RESPONSE_CACHE_LOOKUPS
+from chatbot.services.utils import normalize_message
+
+# Custom stream events carrying replayed response text, handled by ResponseStreamer
+RESPONSE_CHUNK_KEY = "response_chunk"
+
+# Modulus of the MinHash permutations, a Mersenne prime above every 32-bit hash
+MINHASH_PRIME = (1 << 61) - 1
+
+# Characters suggesting a question carries an identifier; such questions skip the near-duplicate tier
+IDENTIFIER_PATTERN = re.compile(r"[\d@]")
+
+
+@dataclass
+class CachedResponse:
+    """An answer as it was streamed: its chunks and the seconds before each one."""
+
+    question: str
+    chunks: list[str]
+    gaps: list[float]
+    expires_at: float
+    signature: Optional[tuple] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+@dataclass
+class CacheHit:
+    response: CachedResponse
+    tier: str
+    similarity: float
+
+
+class MinHasher:
+    """MinHash signatures of word and word-pair sets, with ``bands`` LSH band keys."""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        rows = random.Random(seed)
+        self._permutations = [
+            (rows.randrange(1, MINHASH_PRIME), rows.randrange(0, MINHASH_PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, text: str) -> tuple:
+        hashes = [_hash32(shingle) for shingle in _shingles(text)] or [0]
+        return tuple(min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in self._permutations)
+
+    def band_keys(self, signature: tuple) -> list[tuple]:
+        rows = self.num_perm // self.bands
+        return [(band, signature[band * rows : (band + 1) * rows]) for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(first: tuple, second: tuple) -> float:
+        """Estimated Jaccard similarity of the sets behind two signatures."""
+        return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def _shingles(text: str) -> set[str]:
+    words = re.findall(r"\w+", normalize_message(text))
+    return set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def _hash32(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "big")
+
+
+class ResponseCache:
+    """In-process cache of answers to first-turn questions, with exact and near-duplicate lookups."""
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1000,
+        threshold: Optional[float] = 0.8,
+        max_question_chars: int = 500,
+        pacing: float = 1.0,
+        hasher: Optional[MinHasher] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_question_chars = max_question_chars
+        self.pacing = pacing
+        self.hasher = hasher or MinHasher()
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._bands = defaultdict(set)
+        # Traces of speculative answers waiting for their verdict, by message ID
+        self._held: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self._lookups = defaultdict(int)
+
+    @classmethod
+    def from_settings(cls) -> "ResponseCache":
+        from django.conf import settings
+
+        return cls(
+            ttl=getattr(settings, "CHATBOT_RESPONSE_CACHE_TTL", 3600),
+            max_entries=getattr(settings, "CHATBOT_RESPONSE_CACHE_MAX_ENTRIES", 1000),
+            threshold=getattr(settings, "CHATBOT_RESPONSE_CACHE_SIMILARITY", 0.8),
+            max_question_chars=getattr(settings, "CHATBOT_RESPONSE_CACHE_MAX_QUESTION_CHARS", 500),
+            pacing=getattr(settings, "CHATBOT_RESPONSE_CACHE_PACING", 1.0),
+        )
+
+    def question(self, state) -> Optional[str]:
+        """The question of a first-turn, context-free state, or None if its answer must not be cached."""
+        messages = state.get("messages", [])
+        if len(messages) != 1 or messages[0].type != "human" or state.get("summary"):
+            return None
+        text = messages[0].text()
+        return text if text.strip() and len(text) <= self.max_question_chars else None
+
+    def lookup(self, question: str) -> Optional[CacheHit]:
+        """The cached answer to ``question`` or a near duplicate of it, counting the outcome."""
+        key = normalize_message(question)
+        signature = self._signature(question)
+        with self._lock:
+            hit = self._exact(key) or (self._nearest(signature) if signature is not None else None)
+            self._lookups[hit.tier if hit else "miss"] += 1
+        RESPONSE_CACHE_LOOKUPS.inc(outcome=hit.tier if hit else "miss")
+        return hit
+
+    def store(self, question: str, trace: list[tuple[str, float]]):
+        """Cache an approved answer from its ``(text, perf_counter time)`` chunks as streamed.
+
+        The first chunk is replayed at once: a hit skips the wait for the model.
+        """
+        chunks = [(text, at) for text, at in trace if text]
+        if not chunks or self.ttl <= 0:
+            return
+        gaps = [0.0] + [max(0.0, at - previous) for (_, previous), (_, at) in zip(chunks, chunks[1:])]
+        key = normalize_message(question)
+        signature = self._signature(question)
+        entry = CachedResponse(question, [text for text, _ in chunks], gaps, time.monotonic() + self.ttl, signature)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._index(key, entry)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def hold(self, message_id: str, question: str, trace: list[tuple[str, float]]):
+        """Keep a speculative answer's trace until ``release`` learns its verdict."""
+        with self._lock:
+            self._held[message_id] = (question, trace)
+            while len(self._held) > self.max_entries:
+                self._held.popitem(last=False)
+
+    def release(self, message_id: str, approved: bool):
+        """Store a held answer if its message was approved, and forget it either way."""
+        with self._lock:
+            held = self._held.pop(message_id, None)
+        if held is not None and approved:
+            self.store(*held)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self._lookups.values())
+            hits = lookups - self._lookups["miss"]
+            return {
+                "entries": len(self._entries),
+                "lookups": lookups,
+                "exact_hits": self._lookups["exact"],
+                "near_hits": self._lookups["near"],
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _signature(self, question: str) -> Optional[tuple]:
+        """The question's MinHash signature, or None if it only takes part in exact lookups."""
+        if self.threshold is None or IDENTIFIER_PATTERN.search(question):
+            return None
+        return self.hasher.signature(question)
+
+    def _exact(self, key: str) -> Optional[CacheHit]:
+        entry = self._entries.get(key)
+        if entry is None or self._expired(key, entry):
+            return None
+        self._entries.move_to_end(key)
+        return CacheHit(entry, "exact", 1.0)
+
+    def _nearest(self, signature: tuple) -> Optional[CacheHit]:
+        candidates = set().union(*(self._bands.get(band, ()) for band in self.hasher.band_keys(signature)))
+        best = None
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(key, entry):
+                continue
+            similarity = self.hasher.similarity(signature, entry.signature)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        if best is None:
+            return None
+        self._entries.move_to_end(best[0])
+        return CacheHit(self._entries[best[0]], "near", best[1])
+
+    def _expired(self, key: str, entry: CachedResponse) -> bool:
+        if entry.expires_at > time.monotonic():
+            return False
+        self._remove(key)
+        return True
+
+    def _index(self, key: str, entry: CachedResponse):
+        if entry.signature is not None:
+            for band in self.hasher.band_keys(entry.signature):
+                self._bands[band].add(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry.signature is None:
+            return
+        for band in self.hasher.band_keys(entry.signature):
+            keys = self._bands.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band]
+
+
+# Global response cache (initialized once from settings)
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the response cache configured in settings, or None if it is disabled."""
+    global _response_cache
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_RESPONSE_CACHE", False):
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache.from_settings()
+        return _response_cache
@@ -1,27 +1,358 @@
+import asyncio
+import logging
+import threading
+import time
+
+from chatbot.constants import ABORT_EVENT_KEY, CANCEL_EVENT_KEY, SAFETY_STATUS_APPROVE
+from chatbot.services.metrics import STREAM_CANCELLATIONS, TURNS, TurnMetrics, metrics_enabled
+from chatbot.services.response_cache import RESPONSE_CHUNK_KEY
+
+logger = logging.getLogger(__name__)
+
+# Token chunks for the client, plus node updates for the speculative gate and the
+# message index, and custom events carrying cached responses replayed by the
+# cache node
+STREAM_MODES = ["messages", "updates", "custom"]
+
+
 class ResponseStreamer:
-    """Handles streaming responses from the LangGraph."""
+    """Handles streaming responses from the LangGraph.
+
+    With ``flush_chars`` and ``flush_interval`` (seconds) set, response text after
+    the first chunk is coalesced and released once that many characters are
+    buffered or the oldest buffered text is that old, whichever comes first.
+    Unset, every model chunk is released as it arrives.
 
-    def __init__(self, graph, state_manager):
+    With ``cancel_on_disconnect``, closing a response stream before it ends, as
+    the server does when the client goes away, sets the turn's abort event: the
+    domain agent stops generating at its next chunk and the run checkpoints the
+    response as far as it got, marked as truncated.
+    """
+
+    def __init__(
+        self,
+        graph,
+        state_manager,
+        speculative=False,
+        async_graph=None,
+        flush_chars=0,
+        flush_interval=0.0,
+        cancel_on_disconnect=False,
+        buffer_chunks=0,
+    ):
         self.graph = graph
         self.state_manager = state_manager
+        self.speculative = speculative
+        self.async_graph = async_graph
+        self.flush_chars = flush_chars
+        self.flush_interval = flush_interval
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.buffer_chunks = buffer_chunks
+        self._tasks = set()
+
+    def stream_response(self, user_message: str, user, timings=None, abort=None):
+        """Stream a response from the chatbot for a user message.
 
-    def stream_response(self, user_message: str, user):
-        """Stream a response from the chatbot for a user message."""
+        Alongside the response tokens the run streams node updates, from which the
+        messages the turn adds to the thread are collected for the message index.
+        When ``timings`` is a dict it is filled with the turn's phase timings in
+        milliseconds once the stream ends. The thread is held for the whole turn,
+        so a concurrent turn on it waits rather than interleaving. ``abort`` is the
+        turn's abort event when its caller decides when nobody reads it any more.
+        """
+        turn = self._new_turn(abort)
         try:
             # Get thread configuration
             config = self.state_manager.get_thread_config(user)
-            
-            # Prepare messages for processing
-            messages = self.state_manager.prepare_messages_for_graph(user, user_message)
-
-            # Stream response from the graph
-            for message_chunk, metadata in self.graph.stream(
-                {"messages": messages, "user_id": user.id}, 
-                config=config, 
-                stream_mode="messages"
-            ):
-                if metadata.get("langgraph_node") == "chatbot" and message_chunk.content:
-                    yield message_chunk.content
+
+            with self.state_manager.hold_thread(user):
+                # Prepare messages for processing
+                graph_input = self.state_manager.prepare_graph_input(user, user_message)
+                turn.prepared(graph_input["messages"])
+
+                # Stream response from the graph
+                stream = self.graph.stream(graph_input, config=turn.attach(config), stream_mode=STREAM_MODES)
+                try:
+                    for mode, payload in stream:
+                        yield from turn.feed(mode, payload)
+                    yield from turn.flush()
+                except GeneratorExit:
+                    if not self.cancel_on_disconnect:
+                        raise
+                    self._finish_cancelled(turn, stream, user, timings)
+                    return
+
+                self.state_manager.record_messages(user, turn.messages)
+            turn.finish(turn.outcome(), timings)
 
         except Exception as e:
-            yield f"Error: {str(e)}"
\ No newline at end of file
+            yield from turn.flush()
+            if turn.messages:
+                self.state_manager.record_messages(user, turn.messages, complete=False)
+            turn.finish("error", timings)
+            yield f"Error: {str(e)}"
+
+    async def astream_response(self, user_message: str, user, timings=None, abort=None):
+        """Async variant of ``stream_response`` built on ``graph.astream``.
+
+        Holds no thread while waiting on the model, so a single ASGI worker can serve
+        many concurrent streams. The graph runs in a task of its own feeding a buffer
+        of up to ``buffer_chunks`` chunks (0 for no limit), which a slow client
+        leaves full, pausing the task's reads of the graph stream; a client going
+        away, which cancels or closes this stream, leaves the run to stop
+        generating and checkpoint.
+        """
+        turn = self._new_turn(abort)
+        buffer = asyncio.Queue(self.buffer_chunks)
+        run = asyncio.create_task(self._arun(turn, user_message, user, timings, buffer))
+        # The event loop only keeps weak references to tasks
+        self._tasks.add(run)
+        run.add_done_callback(self._tasks.discard)
+        ended = False
+        try:
+            while (text := await buffer.get()) is not None:
+                yield text
+            ended = True
+        finally:
+            if not ended:
+                turn.detached = True
+                if self.cancel_on_disconnect:
+                    turn.cancel("disconnect")
+                else:
+                    run.cancel()
+                # Unblock the run if it is waiting for room in the buffer; it sends nothing more
+                while not buffer.empty():
+                    buffer.get_nowait()
+
+    async def _arun(self, turn, user_message: str, user, timings, buffer: asyncio.Queue):
+        """Run the graph for ``astream_response``, putting its text into ``buffer`` and None once it ends."""
+        try:
+            graph = await self.async_graph.get()
+            config = self.state_manager.get_thread_config(user)
+            async with self.state_manager.ahold_thread(user):
+                graph_input = await self.state_manager.aprepare_graph_input(user, user_message)
+                turn.prepared(graph_input["messages"])
+
+                async for mode, payload in graph.astream(
+                    graph_input, config=turn.attach(config), stream_mode=STREAM_MODES
+                ):
+                    await turn.send(buffer, turn.feed(mode, payload))
+                await turn.send(buffer, turn.flush())
+
+                await self.state_manager.arecord_messages(user, turn.messages)
+            turn.finish(turn.outcome(), timings)
+
+        except Exception as e:
+            await turn.send(buffer, turn.flush())
+            if turn.messages:
+                await self.state_manager.arecord_messages(user, turn.messages, complete=False)
+            turn.finish("error", timings)
+            await turn.send(buffer, [f"Error: {str(e)}"])
+        await turn.send(buffer, [None])
+
+    def _finish_cancelled(self, turn, stream, user, timings):
+        """Run a turn whose client went away to its end, sending nothing, so the response is checkpointed."""
+        turn.cancel("disconnect")
+        try:
+            for mode, payload in stream:
+                turn.feed(mode, payload)
+        except Exception as e:
+            logger.error(f"Error finishing cancelled turn: {str(e)}")
+            if turn.messages:
+                self.state_manager.record_messages(user, turn.messages, complete=False)
+            turn.finish("error", timings)
+            return
+        self.state_manager.record_messages(user, turn.messages)
+        turn.finish("cancelled", timings)
+
+    def _new_turn(self, abort=None):
+        gate = _SpeculativeGate() if self.speculative else None
+        coalescer = (
+            _Coalescer(self.flush_chars, self.flush_interval) if self.flush_chars and self.flush_interval else None
+        )
+        return _Turn(gate, coalescer, abort)
+
+
+def _response_text(mode, payload):
+    """Return the response text in a stream item: a domain agent chunk or a replayed cached chunk, else None."""
+    if mode == "messages":
+        message_chunk, metadata = payload
+        if metadata.get("langgraph_node") == "chatbot" and message_chunk.content:
+            return message_chunk.content
+    elif mode == "custom" and isinstance(payload, dict):
+        return payload.get(RESPONSE_CHUNK_KEY) or None
+    return None
+
+
+class _Turn:
+    """Tracks one graph run: the text to stream, the messages the run adds to the thread
+    and, while metrics are enabled, the turn's phase timings.
+
+    Text passes through the speculative gate and then the coalescer, when the run
+    has them; ``flush`` releases whatever the coalescer still holds.
+
+    Pipeline-level phases are recorded under the ``graph`` node: ``prepare`` (up to
+    the graph run), ``ttft`` (up to the first response text) and ``turn`` (the
+    whole turn).
+
+    ``abort`` is set once nobody reads the response any more; the domain agent then
+    stops generating.
+    """
+
+    def __init__(self, gate=None, coalescer=None, abort=None):
+        self.messages = []
+        self.gate = gate
+        self.coalescer = coalescer
+        self.abort = abort if abort is not None else threading.Event()
+        # Set once the reader of an async stream has gone
+        self.detached = False
+        self.metrics = TurnMetrics() if metrics_enabled() else None
+        self.started = time.perf_counter()
+        self.streaming = False
+
+    def prepared(self, input_messages):
+        """Record the messages sent to the graph, ending the ``prepare`` phase."""
+        self.messages = list(input_messages)
+        self._observe("prepare")
+
+    def attach(self, config):
+        """Return the config to run with, carrying the abort event, the turn metrics and, for speculative runs, a
+        cancel event."""
+        config = {**config, "configurable": {**config["configurable"], ABORT_EVENT_KEY: self.abort}}
+        if self.gate is not None:
+            config = self.gate.attach(config)
+        return self.metrics.attach(config) if self.metrics is not None else config
+
+    def cancel(self, reason: str):
+        """Stop generating the response because nobody reads it any more."""
+        if not self.abort.is_set():
+            STREAM_CANCELLATIONS.inc(reason=reason)
+            self.abort.set()
+
+    def outcome(self) -> str:
+        """Outcome of a run that ended normally: "cancelled" if it was aborted on the way."""
+        return "cancelled" if self.abort.is_set() else "success"
+
+    async def send(self, buffer: asyncio.Queue, texts):
+        """Put texts into an async stream's buffer, unless its reader has gone."""
+        for text in texts:
+            if self.detached:
+                return
+            await buffer.put(text)
+
+    def feed(self, mode, payload):
+        """Consume one ``(mode, payload)`` stream item and return the text ready to send."""
+        if mode == "updates":
+            for update in payload.values():
+                if isinstance(update, dict):
+                    self.messages.extend(update.get("messages", []))
+
+        if self.gate is not None:
+            texts = self.gate.feed(mode, payload)
+        elif text := _response_text(mode, payload):
+            texts = [text]
+        else:
+            texts = []
+
+        if texts and not self.streaming:
+            self.streaming = True
+            self._observe("ttft")
+        return self.coalescer.add(texts) if self.coalescer is not None else texts
+
+    def flush(self):
+        """Return the text still held back by the coalescer."""
+        return self.coalescer.flush() if self.coalescer is not None else []
+
+    def finish(self, outcome: str, timings=None):
+        """End the ``turn`` phase and copy the turn's timings into ``timings`` if given."""
+        if self.metrics is None:
+            return
+        self._observe("turn")
+        TURNS.inc(outcome=outcome)
+        if timings is not None:
+            timings.update(self.metrics.as_ms())
+
+    def _observe(self, phase: str):
+        if self.metrics is not None:
+            self.metrics.observe(phase, "graph", time.perf_counter() - self.started)
+
+
+class _Coalescer:
+    """Batches response text into fewer, larger chunks.
+
+    The first text of a response is released immediately so time-to-first-token is
+    unaffected. Later text is buffered until ``max_chars`` characters are held or
+    the oldest buffered text is ``max_delay`` seconds old. The age is checked as
+    text arrives; the stream is not polled in between, so during a pause in
+    generation a batch waits for the next chunk or the end of the response.
+    """
+
+    def __init__(self, max_chars: int, max_delay: float):
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.parts = []
+        self.size = 0
+        self.since = 0.0
+        self.started = False
+
+    def add(self, texts):
+        """Buffer texts and return those ready to send."""
+        released = []
+        for text in texts:
+            if not self.started:
+                self.started = True
+                released.append(text)
+                continue
+            if not self.parts:
+                self.since = time.monotonic()
+            self.parts.append(text)
+            self.size += len(text)
+
+        if self.parts and (self.size >= self.max_chars or time.monotonic() - self.since >= self.max_delay):
+            released.extend(self.flush())
+        return released
+
+    def flush(self):
+        """Return the buffered text as a single chunk."""
+        if not self.parts:
+            return []
+        text = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return [text]
+
+
+class _SpeculativeGate:
+    """Releases speculative domain tokens according to the safety verdict.
+
+    Tokens produced before the verdict are buffered. On APPROVE the buffer is flushed
+    and the remaining tokens stream live; on REJECT the buffer is discarded and the
+    safety agent cancels the in-flight generation through the run's cancel event.
+    """
+
+    def __init__(self):
+        self.buffered = []
+        self.safety_status = None
+
+    def attach(self, config):
+        """Return a copy of the thread config carrying this run's cancel event."""
+        return {**config, "configurable": {**config["configurable"], CANCEL_EVENT_KEY: threading.Event()}}
+
+    def feed(self, mode, payload):
+        """Consume one ``(mode, payload)`` stream item and return the text ready to send."""
+        if mode == "updates":
+            update = payload.get("safety") or {}
+            if "safety_status" not in update:
+                return []
+            self.safety_status = update["safety_status"]
+            released = self.buffered if self.safety_status == SAFETY_STATUS_APPROVE else []
+            self.buffered = []
+            return released
+
+        text = _response_text(mode, payload)
+        if text is None:
+            return []
+        if self.safety_status is None:
+            self.buffered.append(text)
+            return []
+        return [text] if self.safety_status == SAFETY_STATUS_APPROVE else []
@@ -0,0 +1,231 @@
+import hashlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Optional
+
+from chatbot.constants import SAFETY_PROMPT, SAFETY_STATUS_REJECT
+from chatbot.services.utils import normalize_message
+from chatbot.services.verdicts import SafetyVerdict
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VerdictCache(ABC):
+    """Base class for safety verdict caches.
+
+    Keys combine a hash of the normalized message with hashes of the safety prompt
+    and of the name of the model giving the verdicts, so editing the prompt or
+    moving the check to another model invalidates every cached verdict without a
+    flush. APPROVE and REJECT verdicts have separate TTLs; a TTL of 0 disables
+    caching for that status.
+    """
+
+    def __init__(self, approve_ttl: int, reject_ttl: int, prompt: str = SAFETY_PROMPT, model: str = ""):
+        self.approve_ttl = approve_ttl
+        self.reject_ttl = reject_ttl
+        self.prompt_hash = _digest(prompt)[:16]
+        self.model = model
+        self.model_hash = _digest(model)[:16]
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def key(self, message: str) -> str:
+        return f"chatguard:safety:{self.prompt_hash}:{self.model_hash}:{_digest(normalize_message(message))}"
+
+    def get(self, message: str) -> Optional[SafetyVerdict]:
+        """Return the cached verdict for a message, counting the hit or miss.
+
+        Backend errors are logged and treated as a miss, so an unavailable cache
+        falls back to the LLM check rather than skipping it.
+        """
+        try:
+            verdict = self._get(self.key(message))
+        except Exception as e:
+            logger.warning(f"Safety cache lookup failed: {str(e)}")
+            verdict = None
+        return self._record(verdict)
+
+    async def aget(self, message: str) -> Optional[SafetyVerdict]:
+        """Async variant of ``get``."""
+        try:
+            verdict = await self._aget(self.key(message))
+        except Exception as e:
+            logger.warning(f"Safety cache lookup failed: {str(e)}")
+            verdict = None
+        return self._record(verdict)
+
+    def set(self, message: str, verdict: SafetyVerdict):
+        """Cache a verdict with the TTL for its status."""
+        ttl = self._ttl(verdict)
+        if ttl <= 0:
+            return
+        try:
+            self._set(self.key(message), verdict, ttl)
+        except Exception as e:
+            logger.warning(f"Safety cache store failed: {str(e)}")
+
+    async def aset(self, message: str, verdict: SafetyVerdict):
+        """Async variant of ``set``."""
+        ttl = self._ttl(verdict)
+        if ttl <= 0:
+            return
+        try:
+            await self._aset(self.key(message), verdict, ttl)
+        except Exception as e:
+            logger.warning(f"Safety cache store failed: {str(e)}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process."""
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "prompt_hash": self.prompt_hash,
+                "model": self.model,
+            }
+
+    def _ttl(self, verdict: SafetyVerdict) -> int:
+        return self.reject_ttl if verdict.status == SAFETY_STATUS_REJECT else self.approve_ttl
+
+    def _record(self, verdict: Optional[SafetyVerdict]) -> Optional[SafetyVerdict]:
+        with self._stats_lock:
+            if verdict is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return verdict
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[SafetyVerdict]: ...
+
+    @abstractmethod
+    def _set(self, key: str, verdict: SafetyVerdict, ttl: int): ...
+
+    async def _aget(self, key: str) -> Optional[SafetyVerdict]:
+        return self._get(key)
+
+    async def _aset(self, key: str, verdict: SafetyVerdict, ttl: int):
+        self._set(key, verdict, ttl)
+
+
+class LocalVerdictCache(VerdictCache):
+    """In-process LRU cache with per-entry expiry."""
+
+    def __init__(
+        self,
+        approve_ttl: int,
+        reject_ttl: int,
+        max_entries: int = 10000,
+        prompt: str = SAFETY_PROMPT,
+        model: str = "",
+    ):
+        super().__init__(approve_ttl, reject_ttl, prompt, model)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[SafetyVerdict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            verdict, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return verdict
+
+    def _set(self, key: str, verdict: SafetyVerdict, ttl: int):
+        with self._lock:
+            self._entries[key] = (verdict, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {**super().stats(), "entries": size}
+
+
+class DjangoVerdictCache(VerdictCache):
+    """Shared cache backed by Django's cache framework, e.g. Redis or Memcached across workers."""
+
+    def __init__(
+        self,
+        approve_ttl: int,
+        reject_ttl: int,
+        alias: str = "default",
+        prompt: str = SAFETY_PROMPT,
+        model: str = "",
+    ):
+        super().__init__(approve_ttl, reject_ttl, prompt, model)
+        self.alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+
+        return caches[self.alias]
+
+    def _get(self, key: str) -> Optional[SafetyVerdict]:
+        value = self.cache.get(key)
+        return SafetyVerdict(**value) if value else None
+
+    def _set(self, key: str, verdict: SafetyVerdict, ttl: int):
+        self.cache.set(key, asdict(verdict), timeout=ttl)
+
+    async def _aget(self, key: str) -> Optional[SafetyVerdict]:
+        value = await self.cache.aget(key)
+        return SafetyVerdict(**value) if value else None
+
+    async def _aset(self, key: str, verdict: SafetyVerdict, ttl: int):
+        await self.cache.aset(key, asdict(verdict), timeout=ttl)
+
+
+# Global verdict caches (initialized once from settings), by model name
+_verdict_caches = {}
+_verdict_cache_lock = threading.Lock()
+
+
+def get_verdict_cache(node: str = "safety") -> Optional[VerdictCache]:
+    """Get the verdict cache for the model ``node`` checks messages with, or None if caching is disabled.
+
+    Nodes configured with the same model share one cache.
+    """
+    from django.conf import settings
+
+    from chatbot.services.llm_clients import LLMConfig
+
+    backend = getattr(settings, "CHATBOT_SAFETY_CACHE_BACKEND", None)
+    if backend is None:
+        return None
+
+    model = LLMConfig.from_settings(node).model
+    with _verdict_cache_lock:
+        cache = _verdict_caches.get(model)
+        if cache is None:
+            approve_ttl = getattr(settings, "CHATBOT_SAFETY_CACHE_APPROVE_TTL", 3600)
+            reject_ttl = getattr(settings, "CHATBOT_SAFETY_CACHE_REJECT_TTL", 86400)
+            if backend == "local":
+                max_entries = getattr(settings, "CHATBOT_SAFETY_CACHE_MAX_ENTRIES", 10000)
+                cache = LocalVerdictCache(approve_ttl, reject_ttl, max_entries=max_entries, model=model)
+            elif backend == "django":
+                alias = getattr(settings, "CHATBOT_SAFETY_CACHE_ALIAS", "default")
+                cache = DjangoVerdictCache(approve_ttl, reject_ttl, alias=alias, model=model)
+            else:
+                raise ValueError(f"Unknown CHATBOT_SAFETY_CACHE_BACKEND: {backend!r}")
+            _verdict_caches[model] = cache
+        return cache
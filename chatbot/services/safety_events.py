@@ -0,0 +1,205 @@
+import atexit
+import hashlib
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.utils import timezone
+
+from chatbot.constants import SAFETY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# Identifies the prompt an event's verdict was given under
+SAFETY_PROMPT_HASH = hashlib.sha256(SAFETY_PROMPT.encode()).hexdigest()[:16]
+
+
+class SafetyEventWriter:
+    """Buffer safety events in memory and write them in batches from a background thread.
+
+    ``record`` only appends to a bounded queue, so the request path never waits
+    on the database; when the queue is full the event is dropped and counted
+    rather than blocking. The writer thread inserts up to ``batch_size`` events
+    per ``bulk_create``, at least every ``flush_interval`` seconds while events
+    are waiting, and whatever is buffered when the process exits.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self._counts = {"written": 0, "dropped": 0, "failed": 0}
+
+    def record(self, user_id, thread_id: str, verdict, source: str, latency_ms: Optional[float] = None):
+        """Queue the event for a safety verdict; never blocks."""
+        self._ensure_started()
+        created_at = timezone.now()
+        event = (user_id, thread_id, verdict, source, latency_ms, created_at)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count("dropped")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write every event recorded so far; returns False if ``timeout`` expired first."""
+        if self._thread is None:
+            return True
+        written = threading.Event()
+        try:
+            self._queue.put(written, timeout=timeout)
+        except queue.Full:
+            return False
+        return written.wait(timeout)
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return {**self._counts, "queued": self._queue.qsize()}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._counts_lock:
+            self._counts[key] += amount
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="safety-event-writer", daemon=True)
+                thread.start()
+                atexit.register(self.flush, timeout=5)
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # A flush marker ends the batch early so ``flush`` does not wait out the interval
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write([item for item in batch if not isinstance(item, threading.Event)])
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, events: list):
+        if not events:
+            return
+        from django.db import close_old_connections
+
+        from chatbot.models import SafetyEvent
+
+        close_old_connections()
+        try:
+            SafetyEvent.objects.bulk_create([safety_event(*event) for event in events], batch_size=self.batch_size)
+            self._count("written", len(events))
+        except Exception as e:
+            logger.error(f"Error writing {len(events)} safety events: {str(e)}")
+            self._count("failed", len(events))
+
+
+def safety_event(user_id, thread_id, verdict, source, latency_ms, created_at):
+    """Unsaved ``SafetyEvent`` for a verdict."""
+    from chatbot.models import SafetyEvent
+
+    return SafetyEvent(
+        user_id=user_id,
+        thread_id=thread_id,
+        status=verdict.status,
+        violation_type=verdict.violation_type,
+        reasoning=verdict.reasoning or "",
+        source=source,
+        latency_ms=latency_ms,
+        prompt_hash=SAFETY_PROMPT_HASH,
+        created_at=created_at,
+        hour=_bucket_start(created_at, "hour"),
+        day=created_at.date(),
+    )
+
+
+REPORT_BUCKETS = ("hour", "day", "week")
+# Report grouping name to SafetyEvent field
+REPORT_GROUPS = {"violation_type": "violation_type", "status": "status", "source": "source", "user": "user_id"}
+
+
+def safety_event_report(
+    since: datetime,
+    until: Optional[datetime] = None,
+    bucket: str = "day",
+    group: str = "violation_type",
+    user_id=None,
+) -> list[dict]:
+    """Event counts per time bucket and ``group`` value, newest bucket first.
+
+    The database counts events per ``hour`` or ``day`` column value, which the
+    composite indexes cover for day and week reports, and days are folded into
+    weeks here, so no timestamp is truncated row by row. ``since`` and ``until``
+    apply at the granularity of the column: whole hours, or whole days for day
+    and week buckets.
+    """
+    from django.db.models import Count
+
+    from chatbot.models import SafetyEvent
+
+    if bucket == "hour":
+        column, start, end = "hour", _bucket_start(since, "hour"), until
+    else:
+        column, start, end = "day", since.date(), until.date() if until else None
+    events = SafetyEvent.objects.filter(**{f"{column}__gte": start})
+    if end is not None:
+        events = events.filter(**{f"{column}__lt": end})
+    if user_id is not None:
+        events = events.filter(user_id=user_id)
+
+    counts = Counter()
+    for moment, value, count in events.values_list(column, REPORT_GROUPS[group]).annotate(count=Count("*")).order_by():
+        counts[_bucket_start(moment, bucket), value] += count
+
+    ordered = sorted(counts.items(), key=lambda item: (item[0][0], item[1]), reverse=True)
+    return [{"bucket": start.isoformat(), group: value, "count": count} for (start, value), count in ordered]
+
+
+def _bucket_start(moment, bucket: str):
+    """Start of the hour, day or week (from Monday) containing a datetime, or a date for days and weeks."""
+    if isinstance(moment, datetime):
+        moment = moment.replace(minute=0, second=0, microsecond=0)
+        if bucket != "hour":
+            moment = moment.replace(hour=0)
+    if bucket == "week":
+        moment -= timedelta(days=moment.weekday())
+    return moment
+
+
+_event_writer = None
+_event_writer_lock = threading.Lock()
+
+
+def get_safety_event_writer() -> Optional[SafetyEventWriter]:
+    """Get the safety event writer configured in settings, or None if event logging is disabled."""
+    global _event_writer
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_SAFETY_EVENTS", False):
+        return None
+
+    with _event_writer_lock:
+        if _event_writer is None:
+            _event_writer = SafetyEventWriter(
+                batch_size=getattr(settings, "CHATBOT_SAFETY_EVENTS_BATCH_SIZE", 500),
+                flush_interval=getattr(settings, "CHATBOT_SAFETY_EVENTS_FLUSH_MS", 1000) / 1000,
+                max_queue=getattr(settings, "CHATBOT_SAFETY_EVENTS_MAX_QUEUE", 10000),
+            )
+        return _event_writer
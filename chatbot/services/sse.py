@@ -0,0 +1,106 @@
+"""Server-sent event framing for the chat stream.
+
+Every event is a single ``data:`` line holding a compact JSON object, which is
+what the chat page parses. Chunk events are assembled from precomputed framing
+around the escaped text rather than by serializing a dict per chunk.
+
+Events of a resumable turn also carry an ``id:`` line, ``<turn ID>:<chunks
+sent>``, starting with a turn event before the first chunk; the client sends the
+last one back as ``Last-Event-ID`` when it reconnects.
+"""
+
+import json
+import zlib
+from json.encoder import encode_basestring
+from typing import Optional
+
+CHUNK_PREFIX = 'data: {"chunk":'
+EVENT_SUFFIX = "}\n\n"
+COMPLETE_EVENT = 'data: {"complete":true}\n\n'
+
+# zlib window bits selecting the gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def chunk_event(text: str, event_id: Optional[str] = None) -> str:
+    """Event carrying a piece of response text."""
+    event = CHUNK_PREFIX + encode_basestring(text) + EVENT_SUFFIX
+    return event if event_id is None else f"id: {event_id}\n{event}"
+
+
+def json_event(payload: dict) -> str:
+    """Event carrying an arbitrary JSON object."""
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+def event_id(turn_id: str, sent: int) -> str:
+    """ID of the event after which ``sent`` chunks of the turn have been sent."""
+    return f"{turn_id}:{sent}"
+
+
+def parse_event_id(value: str) -> tuple[str, int]:
+    """Turn ID and number of chunks received from a ``Last-Event-ID``; ValueError if malformed."""
+    turn_id, _, sent = value.strip().rpartition(":")
+    if not turn_id or not sent.isdigit():
+        raise ValueError(f"Invalid event ID: {value}")
+    return turn_id, int(sent)
+
+
+def event_stream(chunks, timings=None, turn_id: Optional[str] = None, start: int = 0):
+    """Frame a response text stream as events, followed by the timing and completion events.
+
+    ``timings`` is the dict the streamer fills in once the response ends; an empty
+    or missing dict sends no timing event. With a ``turn_id`` chunk events are
+    numbered from ``start + 1``, for a stream resumed after ``start`` chunks.
+    """
+    if turn_id is None:
+        for chunk in chunks:
+            yield chunk_event(chunk)
+    else:
+        yield _turn_event(turn_id, start)
+        for sent, chunk in enumerate(chunks, start + 1):
+            yield chunk_event(chunk, event_id(turn_id, sent))
+    if timings:
+        yield json_event({"timing": timings})
+    yield COMPLETE_EVENT
+
+
+async def aevent_stream(chunks, timings=None, turn_id: Optional[str] = None, start: int = 0):
+    """Async variant of ``event_stream``."""
+    if turn_id is None:
+        async for chunk in chunks:
+            yield chunk_event(chunk)
+    else:
+        yield _turn_event(turn_id, start)
+        sent = start
+        async for chunk in chunks:
+            sent += 1
+            yield chunk_event(chunk, event_id(turn_id, sent))
+    if timings:
+        yield json_event({"timing": timings})
+    yield COMPLETE_EVENT
+
+
+def _turn_event(turn_id: str, start: int) -> str:
+    """First event of a resumable turn, so the client can reconnect before any chunk arrives."""
+    return f"id: {event_id(turn_id, start)}\n" + json_event({"turn": turn_id})
+
+
+def gzip_stream(events):
+    """Gzip an event stream as one gzip member, sync-flushed after every event.
+
+    The flush makes each event decodable on arrival while the compressor keeps its
+    window, so the repeated framing costs a few bytes per event.
+    """
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    for event in events:
+        yield compressor.compress(event.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def agzip_stream(events):
+    """Async variant of ``gzip_stream``."""
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    async for event in events:
+        yield compressor.compress(event.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
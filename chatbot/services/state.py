@@ -1,5 +1,6 @@
 from typing import Annotated, Optional
 
+from langchain_core.messages import AnyMessage
 from langgraph.graph.message import add_messages
 from typing_extensions import TypedDict
 
@@ -7,3 +8,8 @@ from typing_extensions import TypedDict
 class State(TypedDict):
     messages: Annotated[list, add_messages]
     user_id: Optional[int]
+    safety_status: Optional[str]
+    speculative_response: Optional[AnyMessage]
+    summary: Optional[str]
+    summarized_through: Optional[str]
+    summarized_tokens: Optional[int]
@@ -1,16 +1,74 @@
+import logging
+from contextlib import nullcontext
+from uuid import uuid4
+
 from langchain_core.messages import HumanMessage
 from langgraph.graph.message import REMOVE_ALL_MESSAGES, RemoveMessage
 
+from chatbot.constants import CLEARED_METADATA_KEY, USER_ID_KEY
+from chatbot.services.thread_locks import ThreadBusyError
+from chatbot.services.utils import message_role
+
+logger = logging.getLogger(__name__)
+
+
+def _cleared_state():
+    """State update that empties a thread, including its running summary."""
+    return {
+        "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)],
+        "summary": None,
+        "summarized_through": None,
+        "summarized_tokens": None,
+    }
+
+
+def _cleared_config(config):
+    """Thread config whose checkpoint metadata marks the thread as cleared."""
+    return {**config, "metadata": {**config.get("metadata", {}), CLEARED_METADATA_KEY: True}}
+
+
+def _slice_page(messages, before, limit):
+    """Page through a full message list the same way ``MessageIndex.page`` does."""
+    end = len(messages) if before is None else max(min(before, len(messages)), 0)
+    start = max(end - limit, 0)
+    page = [
+        {"position": position, "role": message_role(message), "content": message.text()}
+        for position, message in enumerate(messages[start:end], start)
+    ]
+    return page, (start if start > 0 else None)
+
 
 class StateManager:
     """Manages LangGraph conversation state operations."""
 
-    def __init__(self, graph):
+    def __init__(self, graph, async_graph=None, message_index=None, thread_locks=None):
         self.graph = graph
+        self.async_graph = async_graph
+        self.message_index = message_index
+        self.thread_locks = thread_locks
+
+    def get_thread_id(self, user):
+        """Get the LangGraph thread ID of a user's conversation."""
+        return f"user_{user.id}"
 
     def get_thread_config(self, user):
         """Get LangGraph configuration for a user's thread."""
-        return {"configurable": {"thread_id": f"user_{user.id}"}}
+        return {"configurable": {"thread_id": self.get_thread_id(user), USER_ID_KEY: user.id}}
+
+    def hold_thread(self, user, timeout=None):
+        """Context manager serializing writes to a user's thread when thread locks are configured.
+
+        ``timeout`` overrides how long to wait for a running turn before ``ThreadBusyError``.
+        """
+        if self.thread_locks is None:
+            return nullcontext()
+        return self.thread_locks.hold(self.get_thread_id(user), timeout)
+
+    def ahold_thread(self, user, timeout=None):
+        """Async variant of ``hold_thread``, for use with ``async with``."""
+        if self.thread_locks is None:
+            return nullcontext()
+        return self.thread_locks.ahold(self.get_thread_id(user), timeout)
 
     def get_conversation_state(self, user):
         """Get the current LangGraph state for a user's conversation thread."""
@@ -23,18 +81,138 @@ class StateManager:
         messages = state.values.get("messages", [])
         return messages[-limit:] if limit else messages
 
+    def get_history_page(self, user, before=None, limit=50):
+        """Get one page of conversation history as ``(messages, next_cursor)``.
+
+        Pages come from the message index when one is configured; a thread that has
+        not been indexed yet is backfilled from its checkpoint on first read.
+        Without an index the page is sliced from the checkpointed history.
+
+        The backfill holds the thread, so no turn finishes between reading the
+        history and writing its rows: that turn would skip the still empty index,
+        and its messages would be missing once the older history was written.
+        While a turn is running the page is sliced from the checkpoint instead,
+        leaving the backfill to a later read.
+        """
+        if self.message_index is None:
+            return _slice_page(self.get_conversation_history(user), before, limit)
+
+        thread_id = self.get_thread_id(user)
+        if self.message_index.is_empty(thread_id):
+            try:
+                with self.hold_thread(user, timeout=0):
+                    if self.message_index.is_empty(thread_id):
+                        self.message_index.rebuild(thread_id, self.get_conversation_history(user))
+            except ThreadBusyError:
+                return _slice_page(self.get_conversation_history(user), before, limit)
+        return self.message_index.page(thread_id, before, limit)
+
+    def record_messages(self, user, messages, complete=True):
+        """Add the messages checkpointed by a turn to the message index.
+
+        An incomplete turn may have checkpointed only part of its messages, so the
+        thread's index is dropped instead and rebuilt on the next read. Index
+        failures are logged rather than raised; the checkpoint is already written.
+        """
+        if self.message_index is None:
+            return
+        thread_id = self.get_thread_id(user)
+        try:
+            if complete:
+                self.message_index.append(thread_id, messages)
+            else:
+                self.message_index.clear(thread_id)
+        except Exception as e:
+            logger.error(f"Error updating message index for {thread_id}: {str(e)}")
+
     def clear_conversation(self, user):
-        """Clear all messages from a user's conversation thread."""
-        config = self.get_thread_config(user)
-        self.graph.update_state(config, {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)]})
+        """Clear all messages from a user's conversation thread.
+
+        The clearing checkpoint is marked in its metadata, so checkpoint compaction
+        can tell a cleared thread from a new one that has no messages yet.
+        """
+        config = _cleared_config(self.get_thread_config(user))
+        with self.hold_thread(user):
+            self.graph.update_state(config, _cleared_state())
+            if self.message_index is not None:
+                self.message_index.clear(self.get_thread_id(user))
 
     def prepare_messages_for_graph(self, user, new_message_content):
-        """Prepare message list for graph processing."""
-        # Get current messages from state
-        state = self.get_conversation_state(user)
-        current_messages = state.values.get("messages", [])
-        
-        # Add new user message
-        new_messages = current_messages + [HumanMessage(content=new_message_content)]
-        
-        return new_messages
\ No newline at end of file
+        """Prepare the graph input for a new user message.
+
+        Only the new message is submitted: the checkpointer restores the thread's
+        prior messages and ``add_messages`` appends to them, so the per-turn cost no
+        longer includes loading, copying and re-merging the whole history here.
+        """
+        # An explicit ID lets the message index refer to the message before the
+        # reducer would otherwise assign one inside the graph
+        return [HumanMessage(content=new_message_content, id=str(uuid4()))]
+
+    def prepare_graph_input(self, user, new_message_content):
+        """Build the graph input for a new user message.
+
+        Besides the message, the input resets ``speculative_response``: a run that
+        stopped after its draft was checkpointed but before ``commit`` leaves it
+        behind, and the speculative domain agent would otherwise publish it as the
+        answer to this message.
+        """
+        return {
+            "messages": self.prepare_messages_for_graph(user, new_message_content),
+            "user_id": user.id,
+            "speculative_response": None,
+        }
+
+    async def aget_conversation_state(self, user):
+        """Async variant of ``get_conversation_state``."""
+        graph = await self.async_graph.get()
+        return await graph.aget_state(self.get_thread_config(user))
+
+    async def aget_conversation_history(self, user, limit=None):
+        """Async variant of ``get_conversation_history``."""
+        state = await self.aget_conversation_state(user)
+        messages = state.values.get("messages", [])
+        return messages[-limit:] if limit else messages
+
+    async def aget_history_page(self, user, before=None, limit=50):
+        """Async variant of ``get_history_page``."""
+        if self.message_index is None:
+            return _slice_page(await self.aget_conversation_history(user), before, limit)
+
+        thread_id = self.get_thread_id(user)
+        if await self.message_index.ais_empty(thread_id):
+            try:
+                async with self.ahold_thread(user, timeout=0):
+                    if await self.message_index.ais_empty(thread_id):
+                        await self.message_index.arebuild(thread_id, await self.aget_conversation_history(user))
+            except ThreadBusyError:
+                return _slice_page(await self.aget_conversation_history(user), before, limit)
+        return await self.message_index.apage(thread_id, before, limit)
+
+    async def arecord_messages(self, user, messages, complete=True):
+        """Async variant of ``record_messages``."""
+        if self.message_index is None:
+            return
+        thread_id = self.get_thread_id(user)
+        try:
+            if complete:
+                await self.message_index.aappend(thread_id, messages)
+            else:
+                await self.message_index.aclear(thread_id)
+        except Exception as e:
+            logger.error(f"Error updating message index for {thread_id}: {str(e)}")
+
+    async def aclear_conversation(self, user):
+        """Async variant of ``clear_conversation``."""
+        graph = await self.async_graph.get()
+        async with self.ahold_thread(user):
+            await graph.aupdate_state(_cleared_config(self.get_thread_config(user)), _cleared_state())
+            if self.message_index is not None:
+                await self.message_index.aclear(self.get_thread_id(user))
+
+    async def aprepare_messages_for_graph(self, user, new_message_content):
+        """Async variant of ``prepare_messages_for_graph``."""
+        return self.prepare_messages_for_graph(user, new_message_content)
+
+    async def aprepare_graph_input(self, user, new_message_content):
+        """Async variant of ``prepare_graph_input``."""
+        return self.prepare_graph_input(user, new_message_content)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Polling interval while waiting for a lease, doubling up to the maximum
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.05
+
+
+class ThreadBusyError(Exception):
+    """Raised when a thread's lease could not be acquired before the timeout."""
+
+
+class ThreadLocks:
+    """Serializes turns on a conversation thread across worker processes and hosts.
+
+    A turn holds a ``ThreadLease`` row for its thread in the ``using`` database
+    for as long as it runs, so a concurrent request for the same thread waits up
+    to ``timeout`` seconds for it and then fails with ``ThreadBusyError`` instead
+    of interleaving its checkpoints with the running turn. Taking a lease is a
+    single conditional insert or update, so no database-specific advisory locks
+    are needed. A lease is released when the turn ends and expires after ``ttl``
+    seconds, which must be longer than any turn, so a crashed worker does not
+    block its threads for good.
+    """
+
+    def __init__(self, using: str = "default", timeout: float = 30.0, ttl: float = 300.0):
+        self.using = using
+        self.timeout = timeout
+        self.ttl = ttl
+
+    @classmethod
+    def from_settings(cls) -> Optional["ThreadLocks"]:
+        """Build thread locks configured in settings, or None if they are disabled."""
+        from django.conf import settings
+
+        if not getattr(settings, "CHATBOT_THREAD_LOCKS", False):
+            return None
+        return cls(
+            using=getattr(settings, "CHATBOT_CHECKPOINT_DATABASE", "default"),
+            timeout=getattr(settings, "CHATBOT_THREAD_LOCK_TIMEOUT", 30),
+            ttl=getattr(settings, "CHATBOT_THREAD_LOCK_TTL", 300),
+        )
+
+    @contextmanager
+    def hold(self, thread_id: str, timeout: Optional[float] = None):
+        """Hold the thread's lease for the block, waiting for a running turn to finish first.
+
+        ``timeout`` overrides the configured wait; 0 fails at once if the thread is busy.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        interval = POLL_INTERVAL
+        while not self.try_acquire(thread_id, owner):
+            if time.monotonic() >= deadline:
+                raise ThreadBusyError(f"Another response is still being generated for {thread_id}")
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.release(thread_id, owner)
+
+    @asynccontextmanager
+    async def ahold(self, thread_id: str, timeout: Optional[float] = None):
+        """Async variant of ``hold``; waits without blocking the event loop."""
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        interval = POLL_INTERVAL
+        while not await sync_to_async(self.try_acquire)(thread_id, owner):
+            if time.monotonic() >= deadline:
+                raise ThreadBusyError(f"Another response is still being generated for {thread_id}")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await sync_to_async(self.release)(thread_id, owner)
+
+    def try_acquire(self, thread_id: str, owner: str) -> bool:
+        """Take the thread's lease for ``owner`` if it is free or expired."""
+        from chatbot.models import ThreadLease
+
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+        leases = ThreadLease.objects.using(self.using)
+        if leases.filter(thread_id=thread_id, expires_at__lte=now).update(owner=owner, expires_at=expires_at):
+            logger.warning(f"Took over the expired lease on {thread_id}")
+            return True
+        try:
+            # In a savepoint, so a conflict does not break an enclosing transaction
+            with transaction.atomic(using=self.using):
+                leases.create(thread_id=thread_id, owner=owner, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        return True
+
+    def release(self, thread_id: str, owner: str):
+        """Release the lease if ``owner`` still holds it; an expired and taken-over lease is left alone."""
+        from chatbot.models import ThreadLease
+
+        ThreadLease.objects.using(self.using).filter(thread_id=thread_id, owner=owner).delete()
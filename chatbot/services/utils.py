@@ -1,6 +1,10 @@
 import re
+import threading
+import unicodedata
 from typing import Optional
 
+from chatbot.constants import ABORT_EVENT_KEY, CANCEL_EVENT_KEY
+
 
 def extract_xml(content: str, tag: str) -> Optional[str]:
     """Extract content from a single XML tag.
@@ -14,3 +18,66 @@ def extract_xml(content: str, tag: str) -> Optional[str]:
     """
     match = re.search(f"<{tag}>(.*?)</{tag}>", content, re.DOTALL)
     return match.group(1).strip() if match else None
+
+
+def extract_all_xml(content: str, tag: str, attribute: str = "id") -> dict[str, str]:
+    """Extract the content of every ``<tag attribute="...">`` block.
+
+    Args:
+        content: XML string to parse
+        tag: Tag name to extract
+        attribute: Attribute identifying each block
+
+    Returns:
+        Stripped block contents keyed by attribute value; a repeated value keeps the last block
+    """
+    pattern = f'<{tag}\\s+{attribute}="([^"]*)"\\s*>(.*?)</{tag}>'
+    return {match.group(1): match.group(2).strip() for match in re.finditer(pattern, content, re.DOTALL)}
+
+
+def normalize_message(text: str) -> str:
+    """Normalize a message so trivially different phrasings compare equal.
+
+    Applies Unicode NFKC folding, case folding, whitespace collapsing and strips
+    trailing punctuation, so "Hi!", "hi" and "  HI  " all normalize to "hi".
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).strip(" .!?,;:")
+
+
+def message_role(message) -> str:
+    """Role of a LangChain message as shown in the chat UI: "user" or "assistant"."""
+    return "user" if message.type == "human" else "assistant"
+
+
+def get_cancel_event(config: Optional[dict]) -> Optional[threading.Event]:
+    """Return the cancellation event attached to a graph run, if any.
+
+    Args:
+        config: Runnable config passed to a graph node
+
+    Returns:
+        The event set when in-flight generation should stop, or None
+    """
+    if not config:
+        return None
+    return config.get("configurable", {}).get(CANCEL_EVENT_KEY)
+
+
+def get_abort_event(config: Optional[dict]) -> Optional[threading.Event]:
+    """Return the event set when nobody reads a graph run's response any more, if any.
+
+    Unlike cancellation, which discards the response, an aborted response is kept
+    as far as it got.
+    """
+    if not config:
+        return None
+    return config.get("configurable", {}).get(ABORT_EVENT_KEY)
+
+
+def node_settings(name: str, node: str) -> dict:
+    """Options of ``node`` in a per-node dict setting such as ``CHATBOT_LLM_MODELS``, merged over its ``"default"``."""
+    from django.conf import settings
+
+    options = getattr(settings, name, {})
+    return {**options.get("default", {}), **options.get(node, {})}
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from chatbot.constants import SAFETY_STATUS_APPROVE
+from chatbot.services.utils import extract_xml
+
+
+@dataclass(frozen=True)
+class SafetyVerdict:
+    """Outcome of a safety assessment for a single user message."""
+
+    status: str
+    violation_type: str = "NONE"
+    reasoning: Optional[str] = None
+
+    @classmethod
+    def from_xml(cls, content: str):
+        """Parse the safety model's XML response; a missing status defaults to APPROVE."""
+        return cls(
+            status=(extract_xml(content, "status") or SAFETY_STATUS_APPROVE).upper(),
+            violation_type=(extract_xml(content, "violation_type") or "NONE").upper(),
+            reasoning=extract_xml(content, "reasoning"),
+        )
+
+
+class VerdictStreamParser:
+    """Decide a safety verdict from the safety model's response while it streams.
+
+    The prompt asks for the status first, so an approval is decided as soon as
+    ``</status>`` arrives and a rejection once its ``</violation_type>`` follows;
+    the reasoning after them is not needed for the decision. ``feed`` returns the
+    verdict once it is decided, and ``result`` parses everything fed so far, for
+    a response that ended before deciding or to pick up the reasoning.
+    """
+
+    def __init__(self):
+        self.content = ""
+
+    def feed(self, text: str) -> Optional[SafetyVerdict]:
+        """Add streamed text; returns the verdict once it is decided, else None."""
+        self.content += text
+        # A tag can only have closed if this text contains the end of one
+        if ">" not in text:
+            return None
+
+        status = extract_xml(self.content, "status")
+        if status is None:
+            return None
+        verdict = SafetyVerdict.from_xml(self.content)
+        if verdict.status != SAFETY_STATUS_APPROVE and extract_xml(self.content, "violation_type") is None:
+            return None
+        return verdict
+
+    def result(self) -> SafetyVerdict:
+        """Verdict parsed from the whole response fed so far."""
+        return SafetyVerdict.from_xml(self.content)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -5,7 +6,17 @@ from . import views
 urlpatterns = [
     path("", views.chatbot_page, name="chatbot_page"),
     path("clear/", views.clear_chat, name="clear_chat"),
-    path("stream/", views.stream_chat, name="stream_chat"),
+    path("history/", views.chat_history, name="chat_history"),
+    path(
+        "stream/",
+        views.astream_chat if getattr(settings, "CHATBOT_ASYNC_STREAMING", False) else views.stream_chat,
+        name="stream_chat",
+    ),
     path("register/", views.register, name="register"),
+    path("ready/", views.readiness, name="readiness"),
+    path("metrics/", views.metrics, name="metrics"),
     path("debug/state/", views.debug_state, name="debug_state"),
+    path("debug/safety-cache/", views.debug_safety_cache, name="debug_safety_cache"),
+    path("debug/response-cache/", views.debug_response_cache, name="debug_response_cache"),
+    path("debug/safety-events/", views.debug_safety_events, name="debug_safety_events"),
 ]
@@ -1,28 +1,63 @@
-import json
+import hmac
+import re
+from datetime import timedelta
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import UserCreationForm
-from django.http import JsonResponse, StreamingHttpResponse
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
 
-from chatbot.services.chatbot_service import get_chatbot
+from chatbot.services import sse
+from chatbot.services.admission import AdmissionRejected, ReplayUnavailable
+from chatbot.services.chatbot_service import get_chatbot, get_readiness
+from chatbot.services.metrics import REGISTRY, metrics_enabled
+from chatbot.services.response_cache import get_response_cache
+from chatbot.services.safety_cache import get_verdict_cache
+from chatbot.services.safety_events import REPORT_BUCKETS, REPORT_GROUPS, get_safety_event_writer, safety_event_report
+
+_ACCEPTS_GZIP = re.compile(r"\bgzip\b")
 
 
 @login_required
 def chatbot_page(request):
-    """Render the chatbot interface with conversation history."""
+    """Render the chatbot interface with the most recent page of conversation history."""
     chatbot = get_chatbot()
-    # Get conversation history from LangGraph state
-    messages = chatbot.get_conversation_history(request.user)
+    page_size = getattr(settings, "CHATBOT_HISTORY_PAGE_SIZE", 50)
+    conversation, next_cursor = chatbot.get_history_page(request.user, limit=page_size)
+
+    return render(
+        request,
+        "chatbot/index.html",
+        {"conversation": conversation, "next_cursor": next_cursor, "page_size": page_size},
+    )
+
 
-    # Convert LangGraph messages to template format
-    conversation = []
-    for msg in messages:
-        role = "user" if msg.type == "human" else "assistant"
-        conversation.append({"role": role, "content": msg.content})
+@login_required
+@require_GET
+def chat_history(request):
+    """Older conversation history as JSON, one page per request.
+
+    Pass the ``next_cursor`` of the previous response as ``before`` to fetch the
+    page preceding it; ``next_cursor`` is null once the start is reached.
+    """
+    max_page_size = getattr(settings, "CHATBOT_HISTORY_MAX_PAGE_SIZE", 200)
+    try:
+        before = int(request.GET["before"]) if request.GET.get("before") else None
+        limit = int(request.GET.get("limit", getattr(settings, "CHATBOT_HISTORY_PAGE_SIZE", 50)))
+    except ValueError:
+        return JsonResponse({"error": "before and limit must be integers"}, status=400)
 
-    return render(request, "chatbot/index.html", {"conversation": conversation})
+    chatbot = get_chatbot()
+    messages, next_cursor = chatbot.get_history_page(request.user, before, min(max(limit, 1), max_page_size))
+    return JsonResponse({"messages": messages, "next_cursor": next_cursor})
 
 
 @login_required
@@ -35,24 +70,115 @@ def clear_chat(request):
 
 @login_required
 def stream_chat(request):
-    """Stream chatbot response."""
+    """Stream chatbot response, or resume it for a client reconnecting with ``Last-Event-ID``."""
     user_message = request.POST.get("message", "").strip()
+    chatbot = get_chatbot()
+    timings = _stream_timings()
+    try:
+        if last_event_id := request.headers.get("Last-Event-ID"):
+            turn = chatbot.resume_stream(request.user, last_event_id, timings)
+        else:
+            turn = chatbot.open_stream(user_message, request.user, timings)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    except ReplayUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=410)
+
+    # Stream the response (message saving is handled inside stream_response),
+    # then the completion signal
+    events = sse.event_stream(turn.chunks, timings, turn.turn_id, turn.start)
+    if _gzip_stream(request):
+        return _event_stream_response(sse.gzip_stream(events), gzip=True)
+    return _event_stream_response(events)
+
+
+@login_required
+async def astream_chat(request):
+    """Stream chatbot response from an async view (requires an ASGI server).
+
+    The LLM calls and checkpoint I/O are awaited on the event loop, so an open
+    stream does not pin a worker thread for the length of the generation.
+    """
+    user_message = request.POST.get("message", "").strip()
+    user = await request.auser()
+    chatbot = await sync_to_async(get_chatbot)()
+    timings = _stream_timings()
+    try:
+        if last_event_id := request.headers.get("Last-Event-ID"):
+            turn = chatbot.aresume_stream(user, last_event_id, timings)
+        else:
+            turn = await chatbot.aopen_stream(user_message, user, timings)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    except ReplayUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=410)
+
+    events = sse.aevent_stream(turn.chunks, timings, turn.turn_id, turn.start)
+    if _gzip_stream(request):
+        return _event_stream_response(sse.agzip_stream(events), gzip=True)
+    return _event_stream_response(events)
 
-    def generate():
-        chatbot = get_chatbot()
 
-        # Stream the response (message saving is handled inside stream_response)
-        for chunk in chatbot.stream_response(user_message, request.user):
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+def _rejected_response(rejection: AdmissionRejected):
+    """429 for a stream request turned away by admission control."""
+    response = JsonResponse({"error": str(rejection), "reason": rejection.reason}, status=429)
+    response["Retry-After"] = str(rejection.retry_after)
+    return response
 
-        # Send completion signal
-        yield f"data: {json.dumps({'complete': True})}\n\n"
 
-    response = StreamingHttpResponse(generate(), content_type="text/event-stream")
+def _event_stream_response(events, gzip=False):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
     response["Cache-Control"] = "no-cache"
+    if gzip:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
     return response
 
 
+def _gzip_stream(request) -> bool:
+    """Whether to gzip the event stream: enabled in settings and accepted by the client."""
+    return getattr(settings, "CHATBOT_STREAM_GZIP", False) and bool(
+        _ACCEPTS_GZIP.search(request.headers.get("Accept-Encoding", ""))
+    )
+
+
+def _stream_timings():
+    """Dict to collect a turn's phase timings into, when the SSE timing event is enabled."""
+    return {} if getattr(settings, "CHATBOT_STREAM_TIMING_EVENT", False) else None
+
+
+@require_GET
+def metrics(request):
+    """Phase latency histograms and token counters of this worker in Prometheus text format.
+
+    Served to superusers, and to scrapers sending ``CHATBOT_METRICS_TOKEN`` as a
+    bearer token when one is configured.
+    """
+    if not metrics_enabled():
+        raise Http404("Metrics are disabled")
+    if not request.user.is_superuser and not _has_metrics_token(request):
+        raise PermissionDenied
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _has_metrics_token(request) -> bool:
+    token = getattr(settings, "CHATBOT_METRICS_TOKEN", None)
+    return bool(token) and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+
+
+@require_GET
+def readiness(request):
+    """Readiness probe reporting whether this worker's chatbot is warm.
+
+    With eager warm-up enabled the probe fails (503) until warm-up completes, so a
+    load balancer holds traffic back; otherwise a cold worker is still ready and
+    builds the chatbot on its first request.
+    """
+    state = get_readiness()
+    state["ready"] = state["status"] == "warm" or not getattr(settings, "CHATBOT_EAGER_WARMUP", False)
+    return JsonResponse(state, status=200 if state["ready"] else 503)
+
+
 def register(request):
     """User registration view."""
     if request.method == "POST":
@@ -106,3 +232,66 @@ def debug_state(request):
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def debug_safety_cache(request):
+    """Safety verdict cache hit/miss counters for this worker process (admin only)."""
+    cache = get_verdict_cache()
+    if cache is None:
+        return JsonResponse({"enabled": False})
+
+    return JsonResponse({"enabled": True, "backend": type(cache).__name__, **cache.stats()})
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def debug_response_cache(request):
+    """Response cache entries and exact/near-duplicate hit counters for this worker process (admin only)."""
+    cache = get_response_cache()
+    if cache is None:
+        return JsonResponse({"enabled": False})
+
+    return JsonResponse({"enabled": True, **cache.stats()})
+
+
+@user_passes_test(lambda u: u.is_superuser)
+@require_GET
+def debug_safety_events(request):
+    """Safety event counts per time bucket and violation type, status, source or user (admin only).
+
+    Query parameters: ``since`` and ``until`` (ISO 8601, default the last 7 days),
+    ``bucket`` (hour, day or week), ``group`` and an optional ``user_id``.
+    """
+    bucket = request.GET.get("bucket", "day")
+    group = request.GET.get("group", "violation_type")
+    if bucket not in REPORT_BUCKETS or group not in REPORT_GROUPS:
+        return JsonResponse(
+            {"error": f"bucket must be one of {', '.join(REPORT_BUCKETS)}; group one of {', '.join(REPORT_GROUPS)}"},
+            status=400,
+        )
+    try:
+        since = _parse_time(request.GET.get("since")) or timezone.now() - timedelta(days=7)
+        until = _parse_time(request.GET.get("until"))
+        user_id = int(request.GET["user_id"]) if request.GET.get("user_id") else None
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    writer = get_safety_event_writer()
+    return JsonResponse(
+        {
+            "since": since.isoformat(),
+            "until": until.isoformat() if until else None,
+            "buckets": safety_event_report(since, until, bucket=bucket, group=group, user_id=user_id),
+            "writer": writer.stats() if writer else None,
+        }
+    )
+
+
+def _parse_time(value):
+    """Parse an ISO 8601 query parameter as an aware datetime, in the current time zone when it has no offset."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
@@ -132,6 +132,262 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Anthropic API Key
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
+# Language model of each node: "safety" checks, "context" summaries, the
+# "chatbot" domain agent and bulk "screening". Each entry is merged over
+# "default" and gets a client of its own: TIMEOUT in seconds, MAX_TOKENS output
+# cap, MAX_RETRIES and MAX_CONCURRENCY node runs at once per worker (None for no
+# limit). MAX_CONNECTIONS gives an Anthropic client an HTTP pool of its own
+# instead of the one langchain-anthropic shares; it replaces the model's private
+# SDK clients, so it is off (None) unless set. The safety cap leaves room for
+# the reasoning logged with safety events; the verdict comes first either way.
+CHATBOT_LLM_MODELS = {
+    "default": {
+        "MODEL": os.getenv("CHATBOT_LLM_MODEL", "anthropic:claude-3-5-sonnet-latest"),
+        "TIMEOUT": 60,
+        "MAX_TOKENS": 4096,
+        "MAX_RETRIES": 2,
+        "MAX_CONNECTIONS": None,
+        "MAX_CONCURRENCY": None,
+    },
+    "safety": {
+        "MODEL": os.getenv("CHATBOT_SAFETY_MODEL", "anthropic:claude-3-5-haiku-latest"),
+        "TIMEOUT": 15,
+        "MAX_TOKENS": 256,
+    },
+    "context": {
+        "MODEL": os.getenv("CHATBOT_SUMMARY_MODEL", "anthropic:claude-3-5-haiku-latest"),
+        "TIMEOUT": 30,
+        "MAX_TOKENS": 1024,
+    },
+}
+
+# Resilience of the model calls of the "safety" and "chatbot" nodes, each entry
+# merged over "default" (see chatbot.services.resilience): DEADLINE in seconds
+# for a call (the safety verdict; for "chatbot" the first token of the response,
+# after which the client TIMEOUT bounds any stall), HEDGE to send a second
+# request once a call has run longer than the HEDGE_QUANTILE of recent ones
+# (never for the streamed "chatbot" response), and a circuit breaker opening
+# after FAILURE_THRESHOLD consecutive failures for RESET_TIMEOUT seconds. The
+# safety call has no deadline or hedging unless set (e.g. DEADLINE 8 with HEDGE),
+# as a safety verdict cut short falls under the failure policy below.
+CHATBOT_LLM_RESILIENCE = {
+    "default": {"DEADLINE": None, "HEDGE": False, "FAILURE_THRESHOLD": 5, "RESET_TIMEOUT": 30},
+    "safety": {"DEADLINE": None, "HEDGE": False, "HEDGE_QUANTILE": 95},
+    "chatbot": {"DEADLINE": 30},
+}
+
+# What the safety node does when it cannot reach a verdict (model error,
+# deadline, open circuit): "open" (default, as before the policy existed) lets
+# the message through unchecked, "closed" turns it away. Both are logged as
+# safety events with source "unavailable".
+CHATBOT_SAFETY_FAILURE_POLICY = os.getenv("CHATBOT_SAFETY_FAILURE_POLICY", "open")
+
+# Chatbot pipeline
+# Start the domain agent in parallel with the safety check; its tokens are held
+# back until the message is approved and the generation is cancelled on rejection.
+CHATBOT_SPECULATIVE_EXECUTION = os.getenv("CHATBOT_SPECULATIVE_EXECUTION", "false").lower() == "true"
+
+# Serve /stream/ from the async view. Only enable when running under an ASGI
+# server (e.g. `uvicorn config.asgi:application`); WSGI servers such as
+# runserver would buffer the whole async response before sending it.
+CHATBOT_ASYNC_STREAMING = os.getenv("CHATBOT_ASYNC_STREAMING", "false").lower() == "true"
+
+# Coalesce streamed response text into fewer SSE events: after the first chunk,
+# text is sent once this many characters are buffered or the oldest buffered
+# text is this many milliseconds old (e.g. 512 and 50). While either is 0, the
+# default, every model chunk is sent as its own event. Gzip compresses the
+# event stream (for clients that accept it), flushing once per event, so it
+# pairs with coalescing.
+CHATBOT_STREAM_FLUSH_CHARS = 0
+CHATBOT_STREAM_FLUSH_MS = 0
+CHATBOT_STREAM_GZIP = os.getenv("CHATBOT_STREAM_GZIP", "false").lower() == "true"
+
+# Build the chatbot when a worker starts instead of on its first request. The
+# optional ping sends a one-token completion to open the connection to the model
+# provider (a billed request). Warm-up status is reported at /ready/.
+CHATBOT_EAGER_WARMUP = os.getenv("CHATBOT_EAGER_WARMUP", "false").lower() == "true"
+CHATBOT_WARMUP_PING = os.getenv("CHATBOT_WARMUP_PING", "false").lower() == "true"
+
+# LangGraph checkpoint backend: "sqlite" keeps checkpoints in a local file,
+# which only worker processes on one host can share; "django" stores them in the
+# CHATBOT_CHECKPOINT_DATABASE alias of DATABASES, so workers on several hosts
+# share conversation state.
+CHATBOT_CHECKPOINT_BACKEND = os.getenv("CHATBOT_CHECKPOINT_BACKEND", "sqlite")
+CHATBOT_CHECKPOINT_DATABASE = "default"
+
+# Hold a per-thread lease (in CHATBOT_CHECKPOINT_DATABASE) for the length of a
+# turn, so concurrent requests for the same conversation, on any worker, run
+# one after the other. A request waits up to TIMEOUT seconds for the running
+# turn; a lease left by a crashed worker expires after TTL seconds. Off unless
+# CHATBOT_THREAD_LOCKS=true.
+CHATBOT_THREAD_LOCKS = os.getenv("CHATBOT_THREAD_LOCKS", "false").lower() == "true"
+CHATBOT_THREAD_LOCK_TIMEOUT = 30
+CHATBOT_THREAD_LOCK_TTL = 300
+
+# SQLite checkpoint database. Sync requests share a pool of WAL-mode
+# connections; writers wait up to the busy timeout for SQLite's write lock.
+CHATBOT_CHECKPOINT_PATH = os.getenv("CHATBOT_CHECKPOINT_PATH", str(BASE_DIR / "chatguard_checkpoints.sqlite"))
+CHATBOT_CHECKPOINT_POOL_SIZE = 8
+CHATBOT_CHECKPOINT_BUSY_TIMEOUT_MS = 5000
+
+# Checkpoint blob encoding, for either backend: "jsonplus" is LangGraph's
+# encoding; "compact" stores messages as msgpack records holding only their
+# non-default fields and, once `manage.py migrate_checkpoints --train` has
+# trained a dictionary into DICTIONARY_DIR, compresses every blob with it (zstd,
+# or zlib when zstandard is not installed). Both read blobs written by
+# LangGraph; `migrate_checkpoints` rewrites stored blobs in the configured
+# encoding. Opting in is one-way for older releases, which cannot read compact
+# blobs: to roll back, set "jsonplus" and run `migrate_checkpoints` first. Keep
+# every dictionary file blobs were compressed with.
+CHATBOT_CHECKPOINT_SERIALIZER = os.getenv("CHATBOT_CHECKPOINT_SERIALIZER", "jsonplus")
+CHATBOT_CHECKPOINT_DICTIONARY_DIR = os.getenv(
+    "CHATBOT_CHECKPOINT_DICTIONARY_DIR", str(BASE_DIR / "checkpoint_dictionaries")
+)
+CHATBOT_CHECKPOINT_COMPRESSION_LEVEL = 3
+
+# Checkpoint retention, applied by `manage.py compact_checkpoints` and, when an
+# interval (seconds) is set, by a background thread in every worker process.
+# Threads the user cleared, or idle longer than the TTL (seconds), are deleted
+# unless a turn is running on them. Converting a database created before
+# incremental auto-vacuum needs a full VACUUM, which only the command runs.
+CHATBOT_CHECKPOINT_KEEP_LATEST = 3
+CHATBOT_CHECKPOINT_IDLE_TTL = None
+CHATBOT_CHECKPOINT_VACUUM_PAGES = 2000
+CHATBOT_CHECKPOINT_COMPACTION_INTERVAL = None
+
+# Context window for the domain agent. When either budget is set, older turns
+# are folded into a persisted running summary so prompt size stays bounded.
+# None disables windowing and sends the full conversation.
+CHATBOT_CONTEXT_MAX_MESSAGES = None
+CHATBOT_CONTEXT_MAX_TOKENS = None
+
+# Messages rendered with the chat page; older ones load as the user scrolls up,
+# in pages of the same size (the history endpoint caps `limit` at the maximum).
+CHATBOT_HISTORY_PAGE_SIZE = 50
+CHATBOT_HISTORY_MAX_PAGE_SIZE = 200
+
+# Per-thread message index (ConversationMessage rows) serving history pages
+# without loading the checkpoint. Without it pages are sliced from the
+# checkpointed conversation. Off unless CHATBOT_MESSAGE_INDEX=true.
+CHATBOT_MESSAGE_INDEX = os.getenv("CHATBOT_MESSAGE_INDEX", "false").lower() == "true"
+
+# Safety verdict cache: "local" (in-process LRU), "django" (the CACHES alias
+# below, shared across workers) or None to disable, the default. A cached
+# verdict is reused for the same normalized message from any user. Keys include
+# hashes of SAFETY_PROMPT and of the safety model's name, so changing either
+# invalidates cached verdicts. A TTL of 0 disables caching for that verdict.
+CHATBOT_SAFETY_CACHE_BACKEND = os.getenv("CHATBOT_SAFETY_CACHE_BACKEND") or None
+CHATBOT_SAFETY_CACHE_ALIAS = "default"
+CHATBOT_SAFETY_CACHE_MAX_ENTRIES = 10000
+CHATBOT_SAFETY_CACHE_APPROVE_TTL = 60 * 60
+CHATBOT_SAFETY_CACHE_REJECT_TTL = 24 * 60 * 60
+
+# Local pre-filter ahead of the LLM safety check, off unless enabled: long,
+# unambiguous jailbreak phrasings are rejected and short allowlisted messages
+# approved without an LLM call. The phrase lists default to those in
+# chatbot.constants when left as None.
+CHATBOT_SAFETY_PREFILTER = os.getenv("CHATBOT_SAFETY_PREFILTER", "false").lower() == "true"
+CHATBOT_SAFETY_PREFILTER_REJECT_PHRASES = None
+CHATBOT_SAFETY_PREFILTER_ALLOWLIST = None
+CHATBOT_SAFETY_PREFILTER_MAX_SAFE_LENGTH = 40
+
+# Provider prompt caching: the safety and summary system prompts and each
+# conversation prompt are marked as cache breakpoints, so the next call reuses
+# the cached prefix. Cache reads and writes are counted in
+# chatguard_llm_tokens_total{type="cache_read"|"cache_write"}, the input cost
+# they save and add in chatguard_prompt_cache_tokens_saved_total and
+# chatguard_prompt_cache_write_overhead_tokens_total. Off unless
+# CHATBOT_PROMPT_CACHING=true.
+CHATBOT_PROMPT_CACHING = os.getenv("CHATBOT_PROMPT_CACHING", "false").lower() == "true"
+
+# Response cache for first-turn questions, per worker process: an approved answer
+# to a question sent on a fresh thread (no earlier messages or summary, at most
+# MAX_QUESTION_CHARS characters) is served again for the same normalized question
+# or one whose word MinHash similarity reaches SIMILARITY (None for exact matches
+# only). A near duplicate is served another user's answer, so an identifier in
+# the question could leak: questions with digits or "@" only match exactly, but
+# names and other free-text details are not detected. Hits are replayed at the recorded chunk cadence scaled by PACING (0 to
+# send them at once) and only after the message is approved. Entries expire after
+# TTL seconds; the least recently used beyond MAX_ENTRIES are evicted. Counters at
+# /debug/response-cache/.
+CHATBOT_RESPONSE_CACHE = os.getenv("CHATBOT_RESPONSE_CACHE", "false").lower() == "true"
+CHATBOT_RESPONSE_CACHE_TTL = 60 * 60
+CHATBOT_RESPONSE_CACHE_MAX_ENTRIES = 1000
+CHATBOT_RESPONSE_CACHE_SIMILARITY = 0.8
+CHATBOT_RESPONSE_CACHE_PACING = 1.0
+CHATBOT_RESPONSE_CACHE_MAX_QUESTION_CHARS = 500
+
+# Safety event log: every verdict is queued in memory and written to the
+# SafetyEvent table by a background thread in batches of up to BATCH_SIZE, at
+# least every FLUSH_MS; events beyond MAX_QUEUE waiting ones are dropped rather
+# than slowing requests down. Aggregates at /debug/safety-events/. Off unless
+# CHATBOT_SAFETY_EVENTS=true.
+CHATBOT_SAFETY_EVENTS = os.getenv("CHATBOT_SAFETY_EVENTS", "false").lower() == "true"
+CHATBOT_SAFETY_EVENTS_BATCH_SIZE = 500
+CHATBOT_SAFETY_EVENTS_FLUSH_MS = 1000
+CHATBOT_SAFETY_EVENTS_MAX_QUEUE = 10000
+
+# Stream the safety check and decide as soon as the model has written the
+# verdict, which the prompt asks for ahead of the reasoning. With REASONING the
+# rest of the response is still read in the background so safety events keep
+# the model's reasoning; without it the response is cut off after the verdict.
+# Off unless CHATBOT_SAFETY_STREAMING=true.
+CHATBOT_SAFETY_STREAMING = os.getenv("CHATBOT_SAFETY_STREAMING", "false").lower() == "true"
+CHATBOT_SAFETY_REASONING = os.getenv("CHATBOT_SAFETY_REASONING", "true").lower() == "true"
+
+# Admission control in front of /stream/, per worker process: a user may have
+# MAX_STREAMS_PER_USER responses in flight or queued, at most
+# MAX_CONCURRENT_STREAMS are generated at once and up to STREAM_QUEUE_SIZE more
+# wait up to STREAM_QUEUE_TIMEOUT seconds for a slot; requests beyond that get a
+# 429. With DEDUPE an identical message resubmitted while the first is still
+# running attaches to its response instead of starting another. Off unless
+# CHATBOT_ADMISSION_CONTROL=true.
+CHATBOT_ADMISSION_CONTROL = os.getenv("CHATBOT_ADMISSION_CONTROL", "false").lower() == "true"
+CHATBOT_MAX_STREAMS_PER_USER = 2
+CHATBOT_MAX_CONCURRENT_STREAMS = int(os.getenv("CHATBOT_MAX_CONCURRENT_STREAMS", "32"))
+CHATBOT_STREAM_QUEUE_SIZE = 64
+CHATBOT_STREAM_QUEUE_TIMEOUT = 10
+CHATBOT_STREAM_DEDUPE = True
+
+# Resumable streams: chunks of each turn are numbered and the last
+# STREAM_REPLAY_CHUNKS kept in memory, so a client reconnecting to /stream/ with
+# Last-Event-ID gets what it missed and follows the rest of the generation
+# without the graph running again. A turn can be resumed on the worker that
+# produced it until STREAM_RESUME_GRACE seconds after it is checkpointed. Off
+# unless CHATBOT_STREAM_RESUME=true.
+CHATBOT_STREAM_RESUME = os.getenv("CHATBOT_STREAM_RESUME", "false").lower() == "true"
+CHATBOT_STREAM_REPLAY_CHUNKS = 2048
+CHATBOT_STREAM_RESUME_GRACE = 60
+
+# Disconnects: with CANCEL_ON_DISCONNECT a response nobody reads any more stops
+# generating, closing the provider stream, and is checkpointed as far as it got
+# with a truncated marker. Turns followed through the hub above are cancelled
+# STREAM_CANCEL_GRACE seconds after their last reader leaves, so a client can
+# still reconnect. Generation runs at most STREAM_BUFFER_CHUNKS chunks ahead of
+# its slowest reader; a reader holding it back for STREAM_STALL_TIMEOUT seconds
+# is cut off. Off unless CHATBOT_STREAM_CANCEL_ON_DISCONNECT=true.
+CHATBOT_STREAM_CANCEL_ON_DISCONNECT = os.getenv("CHATBOT_STREAM_CANCEL_ON_DISCONNECT", "false").lower() == "true"
+CHATBOT_STREAM_CANCEL_GRACE = 5
+CHATBOT_STREAM_BUFFER_CHUNKS = 64
+CHATBOT_STREAM_STALL_TIMEOUT = 30
+
+# Bulk safety screening (manage.py screen_messages): messages are packed into
+# batched LLM requests of up to BATCH_SIZE messages or MAX_BATCH_CHARS characters,
+# sent by WORKERS threads and spaced out to REQUESTS_PER_MINUTE (0 for no limit).
+CHATBOT_BULK_SCREENING_BATCH_SIZE = 20
+CHATBOT_BULK_SCREENING_MAX_BATCH_CHARS = 20000
+CHATBOT_BULK_SCREENING_WORKERS = 8
+CHATBOT_BULK_SCREENING_REQUESTS_PER_MINUTE = int(os.getenv("CHATBOT_BULK_SCREENING_REQUESTS_PER_MINUTE", "0"))
+
+# Per-turn phase latency histograms and LLM token counters, served in Prometheus
+# text format at /metrics/ (per worker process) to superusers, or to scrapers
+# sending `Authorization: Bearer <CHATBOT_METRICS_TOKEN>` when a token is set.
+# The timing event adds a final `data: {"timing": {...}}` SSE event with the
+# turn's phase timings in ms.
+CHATBOT_METRICS_ENABLED = os.getenv("CHATBOT_METRICS_ENABLED", "true").lower() == "true"
+CHATBOT_METRICS_TOKEN = os.getenv("CHATBOT_METRICS_TOKEN") or None
+CHATBOT_STREAM_TIMING_EVENT = os.getenv("CHATBOT_STREAM_TIMING_EVENT", "false").lower() == "true"
+
 # Authentication settings
 LOGIN_URL = "/accounts/login/"
 LOGIN_REDIRECT_URL = "/"